@@ -0,0 +1,135 @@
+# analytics.py (Post-interview analytics over the Parquet tables written by export.py)
+# Usage: python analytics.py --export-dir data/export
+import argparse
+import glob
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+import config
+from export import DEFAULT_EXPORT_DIR, TABLES
+
+# --- Survey Fields ---
+SLIDER_FIELDS = ["learning_enjoyment", "university_enjoyment", "ai_usage_percentage"] # 0-100 sliders
+YEAR_ORDINALS = {"First Year": 1, "Second Year": 2, "Third Year": 3, "Fourth Year": 4, "Fifth Year": 5}
+AGE_BOUNDS = {"Under 18": 17, "Older than 35": 36} # Open-ended age options mapped to the nearest bound
+PERCENTILES = [10, 25, 50, 75, 90, 95, 99]
+FUNNEL_STAGES = [config.WELCOME_STAGE, config.INTERVIEW_STAGE, config.SURVEY_STAGE, config.COMPLETED_STAGE]
+
+
+# --- Loading ---
+def load_tables(export_dir=DEFAULT_EXPORT_DIR):
+    """Concatenates all part files per table, keeping only each user's latest export run."""
+    tables = {}
+    for table in TABLES:
+        paths = sorted(glob.glob(os.path.join(export_dir, table, "part-*.parquet")))
+        df = pd.concat([pd.read_parquet(p).assign(export_part=os.path.basename(p)) for p in paths], ignore_index=True) if paths else pd.DataFrame({"username": [], "export_run": []})
+        if len(df): df = df[_latest_run_mask(df)].drop(columns="export_part")
+        tables[table] = df.reset_index(drop=True)
+    survey = tables["survey_responses"]
+    if len(survey):
+        # Prefer survey_data over survey_backup_data when a user has both
+        survey = survey.sort_values(["username", "source"]).drop_duplicates("username", keep="last")
+        tables["survey_responses"] = survey.reset_index(drop=True)
+    return tables
+
+def _latest_run_mask(df):
+    """Boolean mask of rows from each user's newest export: latest run, and within it the latest part file."""
+    # A user updated during a run is exported again in a later part of the same run. Part files are
+    # named part-<run_id>-<n>, and run_ids start with a UTC timestamp, so sorted codes run oldest -> newest.
+    part_codes, parts = pd.factorize(df["export_part"], sort=True)
+    if len(parts) == 1: return np.ones(len(df), dtype=bool)
+    user_codes, users = pd.factorize(df["username"])
+    latest = np.full(len(users), -1, dtype=part_codes.dtype)
+    np.maximum.at(latest, user_codes, part_codes)
+    return part_codes == latest[user_codes]
+
+def _numeric_column(df, column, mapping=None):
+    """Returns a float64 array for `column` (NaN where missing/unparseable)."""
+    if column not in df.columns: return np.full(len(df), np.nan)
+    values = pd.to_numeric(df[column], errors="coerce")
+    if mapping: values = values.fillna(pd.to_numeric(df[column].map(mapping), errors="coerce"))
+    return values.to_numpy(dtype=np.float64)
+
+
+# --- Distributions ---
+def _describe(values, bins=None):
+    values = values[~np.isnan(values)]
+    if not values.size: return {"count": 0}
+    summary = {
+        "count": int(values.size), "mean": float(values.mean()), "std": float(values.std(ddof=1)) if values.size > 1 else 0.0,
+        "min": float(values.min()), "max": float(values.max()),
+        "percentiles": dict(zip([f"p{p}" for p in PERCENTILES], np.percentile(values, PERCENTILES).round(2).tolist())),
+    }
+    if bins is not None:
+        counts, edges = np.histogram(values, bins=bins)
+        summary["histogram"] = {"edges": edges.tolist(), "counts": counts.tolist()}
+    return summary
+
+def survey_distributions(survey):
+    """Distributions of the numeric sliders plus age, year of study and GPA."""
+    result = {field: _describe(_numeric_column(survey, field), bins=np.arange(0, 101, 10)) for field in SLIDER_FIELDS}
+    result["age"] = _describe(_numeric_column(survey, "age", AGE_BOUNDS))
+    result["year"] = _describe(_numeric_column(survey, "year", YEAR_ORDINALS), bins=np.arange(0.5, 6.5, 1.0))
+    result["gpa"] = _describe(_numeric_column(survey, "gpa"), bins=np.arange(5.0, 10.5, 0.5))
+    return result
+
+
+# --- Funnel ---
+BOOL_VALUES = {True: True, False: False, "True": True, "False": False} # Exports before nullable booleans wrote strings
+
+def _bool_column(df, column):
+    """True where `column` is true; False for false, missing or unknown values."""
+    if column not in df.columns: return np.zeros(len(df), dtype=bool)
+    values = df[column]
+    if values.dtype == object: values = values.map(BOOL_VALUES).astype("boolean") # "False"/"None" would otherwise be truthy strings
+    return values.fillna(False).to_numpy(dtype=bool)
+
+def completion_funnel(sessions):
+    """Counts of users reaching welcome -> interview -> survey -> completed, with drop-off between steps."""
+    stage = sessions["current_stage"].fillna(config.WELCOME_STAGE).to_numpy(dtype=object) if "current_stage" in sessions else np.full(len(sessions), config.WELCOME_STAGE, dtype=object)
+    completed = _bool_column(sessions, "survey_completed_flag") | (stage == config.COMPLETED_STAGE)
+    reached_survey = completed | _bool_column(sessions, "interview_completed_flag") | (stage == config.SURVEY_STAGE)
+    reached_interview = reached_survey | _bool_column(sessions, "welcome_shown") | np.isin(stage, [config.INTERVIEW_STAGE, config.MANUAL_INTERVIEW_STAGE])
+    reached = np.array([len(sessions), reached_interview.sum(), reached_survey.sum(), completed.sum()], dtype=np.int64)
+    conversion = np.divide(reached[1:], reached[:-1], out=np.zeros(3), where=reached[:-1] > 0)
+    return {
+        "reached": dict(zip(FUNNEL_STAGES, reached.tolist())),
+        "step_conversion": {f"{a}->{b}": round(float(c), 4) for a, b, c in zip(FUNNEL_STAGES, FUNNEL_STAGES[1:], conversion)},
+        "dropped_at": dict(zip(FUNNEL_STAGES[:-1], (reached[:-1] - reached[1:]).tolist())),
+        "manual_fallback": int(_bool_column(sessions, "manual_fallback_triggered").sum()),
+    }
+
+
+# --- Turns & Durations ---
+def turn_counts(messages):
+    """Respondent turns (user messages) per interview."""
+    if not len(messages): return {"count": 0}
+    codes, uniques = pd.factorize(messages["username"])
+    user_turns = np.bincount(codes, weights=(messages["role"].to_numpy() == "user"), minlength=len(uniques))
+    return _describe(user_turns.astype(np.float64), bins=np.arange(0, user_turns.max() + 6, 5))
+
+def duration_percentiles(sessions):
+    """Interview duration (timing_data.duration_seconds) in minutes."""
+    return _describe(_numeric_column(sessions, "timing_duration_seconds") / 60.0)
+
+
+# --- Report ---
+def summarize(export_dir=DEFAULT_EXPORT_DIR):
+    tables = load_tables(export_dir)
+    return {
+        "participants": int(len(tables["sessions"])),
+        "funnel": completion_funnel(tables["sessions"]),
+        "survey": survey_distributions(tables["survey_responses"]),
+        "turns": turn_counts(tables["messages"]),
+        "duration_minutes": duration_percentiles(tables["sessions"]),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize exported interview data (funnel, survey distributions, turns, durations).")
+    parser.add_argument("--export-dir", default=DEFAULT_EXPORT_DIR)
+    args = parser.parse_args()
+    print(json.dumps(summarize(args.export_dir), indent=2))
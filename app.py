@@ -6,21 +6,34 @@ import time
 # import pandas as pd # Remove if not used in app.py
 import utils # Import your utils module (Heroku version)
 import config
+import clients # Shared, pre-warmed API clients
+import studies # Study registry (?study=<id>)
+import scripted_turns # Verbatim outline questions without an LLM call
+import llm_stream # Deadline-aware streaming (first-token / stall timeouts)
+import llm_replay # Record/replay of LLM replies (LLM_REPLAY_MODE)
+import token_counts
+import compaction # Checkpoint + tail as model context for long interviews
+import eventlog # Structured event log (username / turn correlated, sampled)
+import page_text # Static welcome / consent text, split once per process
+import profiler # Opt-in per-session sampling profiler
+import startup # Parallel startup checks / readiness
 import json # Keep if used directly in app.py
 import numpy as np
 import uuid
 import random # For GSheet throttle sleep
-import re # For parsing outline
 
 # --- Tenacity Imports ---
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
 
 # --- Constants ---
-WELCOME_STAGE = "welcome"
-INTERVIEW_STAGE = "interview"
-MANUAL_INTERVIEW_STAGE = "manual_interview"
-SURVEY_STAGE = "survey"
-COMPLETED_STAGE = "completed" # Ensure this matches config if used there
+WELCOME_STAGE = config.WELCOME_STAGE
+INTERVIEW_STAGE = config.INTERVIEW_STAGE
+MANUAL_INTERVIEW_STAGE = config.MANUAL_INTERVIEW_STAGE
+SURVEY_STAGE = config.SURVEY_STAGE
+COMPLETED_STAGE = config.COMPLETED_STAGE
+
+startup.start() # Once per process: builds and probes Firestore/GSheet/OpenAI in parallel, then keeps them warm
+studies.start_watcher() # Once per process: hot-reloads study definitions for new sessions
 
 # --- API Setup & Retry Configuration ---
 openai_client = None
@@ -34,13 +47,14 @@ openai_api_key_from_env = os.environ.get('API_KEY_OPENAI')
 
 if "gpt" in config.MODEL.lower():
     api = "openai"
-    from openai import OpenAI, RateLimitError, APITimeoutError, APIConnectionError, InternalServerError as OpenAIInternalServerError
+    from openai import RateLimitError, APITimeoutError, APIConnectionError, InternalServerError as OpenAIInternalServerError
     if openai_api_key_from_env:
         try:
-            openai_client = OpenAI(api_key=openai_api_key_from_env, timeout=60.0)
-            print("INFO: OpenAI client initialized successfully using environment variable.")
+            openai_client = clients.get_client("openai") # Shared per process: keeps its connection pool across reruns
         except Exception as e:
             st.error(f"CRITICAL Error initializing OpenAI client from environment variable: {e}"); st.stop()
+    elif llm_replay.REPLAY_MODE == "replay":
+        eventlog.debug("llm.replay_only_mode") # Recorded replies only, no OpenAI client
     else:
         st.error("CRITICAL: Environment variable 'API_KEY_OPENAI' not found.");
         st.info("Hint: If running locally, set the environment variable. If deploying, ensure it's set as a Heroku Config Var.")
@@ -62,42 +76,29 @@ api_retry_decorator = retry(
 )
 # --- End API Setup & Retry ---
 
-# --- Manual Interview Questions Setup (Keep original logic) ---
-outline_parts = config.INTERVIEW_OUTLINE.split("**Part ")
-manual_questions_map = {}
-part_keys = ["Intro", "I", "II", "III", "IV"]
-current_part_index = 0
-intro_match = re.search(r"\*\*Begin the interview with:\*\*\s*'(.*?)'", config.INTERVIEW_OUTLINE, re.DOTALL)
-if intro_match: manual_questions_map["Intro"] = [{"key": "intro_q", "text": intro_match.group(1).strip()}]
-else: manual_questions_map["Intro"] = []
-framing_match = re.search(r"\*\*Ask Next \(Framing Q\):\*\*\s*'(.*?)'", config.INTERVIEW_OUTLINE, re.DOTALL)
-if framing_match: manual_questions_map["Framing"] = [{"key": "framing_q", "text": framing_match.group(1).strip()}]
-else: manual_questions_map["Framing"] = []
-for i, part_text in enumerate(outline_parts[1:]):
-    part_key = f"Part{part_keys[i+1]}"; manual_questions_map[part_key] = []
-    ask_matches = re.findall(r"\*\*Ask\s*(?:\(.*?Q\))?\s*:\*\*\s*'(.*?)'", part_text, re.DOTALL)
-    for q_idx, q_text in enumerate(ask_matches):
-        manual_questions_map[part_key].append({"key": f"{part_key}_q{q_idx+1}", "text": q_text.strip()})
-manual_questions_map["Summary"] = [{"key": "summary_prompt", "text": "Based on our discussion (including any AI parts and your manual answers), could you briefly summarize your key perspectives on skills and AI's impact on them?"}]
-part_key_sequence = ["Intro", "Framing", "PartI", "PartII", "PartIII", "PartIV", "Summary"]
+# --- Manual Interview Questions Setup (parsed once per study, see studies.py) ---
+part_keys = studies.PART_KEYS
+part_key_sequence = studies.PART_KEY_SEQUENCE
+manual_questions_map = {} # Set to the session's study below
 
 def find_last_ai_part_completed(messages):
-    # (Keep original logic)
-    last_completed_part_index = -1
-    for msg in reversed(messages):
-        if msg.get("role") == "assistant":
-            content = msg.get("content", "")
-            if manual_questions_map.get("Framing") and manual_questions_map["Framing"][0]["text"] in content: return 0
-            for idx, part_key in enumerate(part_keys[1:]):
-                part_index_in_list = idx + 1
-                if part_key in manual_questions_map:
-                    for question_data in manual_questions_map[part_key]:
-                         if question_data["text"][:50] in content[:70]:
-                             last_completed_part_index = max(last_completed_part_index, part_index_in_list); break
-            if last_completed_part_index > 0: break
-    if last_completed_part_index == -1 and manual_questions_map.get("Intro"):
-         if any(manual_questions_map["Intro"][0]["text"] in msg.get("content","") for msg in reversed(messages) if msg.get("role")=="assistant"): return -1
-    return last_completed_part_index
+    return utils.find_last_ai_part_completed(messages, manual_questions_map, part_keys)
+
+# --- Manual Fallback Switch ---
+def enter_manual_fallback(user_id, error, partial_content=""):
+    """Switches to MANUAL_INTERVIEW_STAGE, keeping any partially streamed AI reply in the transcript."""
+    eventlog.error("interview.manual_fallback", username=user_id, error=str(error), partial_chars=len(partial_content or ""))
+    partial_content = (partial_content or "").strip()
+    if partial_content and not utils.detect_closing_code(partial_content):
+        # The respondent already saw this text; keep it instead of asking the model again
+        interrupted_msg_dict = {"role": "assistant", "content": partial_content}
+        utils.append_message(user_id, interrupted_msg_dict)
+    partial_transcript = utils.format_transcript_for_gsheet(utils.transcript_messages(user_id))
+    st.session_state.partial_ai_transcript_formatted = partial_transcript
+    state_update = {"current_stage": MANUAL_INTERVIEW_STAGE,"interview_active": False,"manual_fallback_triggered": True,"partial_ai_transcript_formatted": partial_transcript}
+    utils.save_interview_state_write_behind(user_id, state_update) # Non-blocking; flushed within WRITE_BEHIND_INTERVAL
+    utils.clear_partial_reply_checkpoint(user_id)
+    st.session_state.current_stage = MANUAL_INTERVIEW_STAGE; st.rerun()
 
 # --- Page Config (Heroku compatible) ---
 st.set_page_config(page_title="Skills & AI Interview") # No icon needed here
@@ -109,14 +110,24 @@ if "username" not in st.session_state: st.session_state.username = None
 # Generate UUID if none exists
 if st.session_state.username is None:
     st.session_state.username = f"user_{uuid.uuid4()}"
-    print(f"INFO: Generated potential new user UUID: {st.session_state.username}.")
+    eventlog.info("session.new_user", username=st.session_state.username)
 
 username = st.session_state.username
+st.session_state.run_started = time.perf_counter() # Script-thread time of a stage transition (see utils.queue_transition_notice)
+eventlog.bind(username=username) # Correlates every event of this script run
+
+# Opt-in profiling of this session's reruns (?profile=<PROFILE_KEY> or PROFILE_SESSIONS)
+if "profiling" not in st.session_state: st.session_state.profiling = profiler.enabled(username, st.query_params.get("profile"))
+if st.session_state.profiling: profiler.start(username, st.session_state.get("current_stage") or "initializing")
+
+# Study routing: ?study=<id> on first visit; a resumed session keeps the study stored in Firestore
+if "study_id" not in st.session_state:
+    st.session_state.study_id = studies.resolve_study_id(st.query_params.get("study"))
 
 # --- Initialize Session State Function (using Firestore backend via Env Vars) ---
 def initialize_session_state_from_env(user_id): # Use this name consistently
     if st.session_state.get("session_initialized", False): return
-    print(f"Attempting to initialize session from Firestore (via Env) for user: {user_id}")
+    eventlog.debug("session.init_start")
 
     # Default values
     default_values = {
@@ -124,11 +135,13 @@ def initialize_session_state_from_env(user_id): # Use this name consistently
         "start_time_unix": None, "interview_active": False, "interview_completed_flag": False,
         "survey_completed_flag": False, "welcome_shown": False, "partial_ai_transcript_formatted": "",
         "manual_answers_formatted": "", "current_formatted_transcript_for_gsheet": "",
-        "timing_data": None, "saved_to_gsheet_successfully": None
+        "timing_data": None, "saved_to_gsheet_successfully": None, "message_storage": None,
+        "study_id": studies.DEFAULT_STUDY_ID, "study_version": None,
+        "compaction_checkpoint": None, "history_compacted": False
     }
     for key, default_value in default_values.items():
         if key not in st.session_state: st.session_state[key] = default_value
-    print("Initialized session state with default values.")
+    eventlog.debug("session.defaults_set")
 
     # Attempt to load existing state from Firestore
     loaded_state, loaded_messages = utils.load_interview_state_from_firestore(user_id) # Call Firestore loader
@@ -138,27 +151,48 @@ def initialize_session_state_from_env(user_id): # Use this name consistently
         st.session_state.messages = []
     st.session_state.messages = loaded_messages
 
+    # Sessions keep the study version they started with; outline updates only reach new sessions
+    study = studies.get_study((loaded_state or {}).get("study_id") or st.session_state.get("study_id"), (loaded_state or {}).get("study_version"))
+    if (loaded_state or {}).get("study_version") != study["version"]: # Unversioned session, or its pinned version is not stored
+        st.session_state.study_version = study["version"]
+        if loaded_state:
+            loaded_state["study_version"] = study["version"]
+            utils.save_interview_state_write_behind(user_id, {"study_version": study["version"]}) # Pin to the version actually served
+
     # Inject system prompt if needed
     if api == "openai":
         if not st.session_state.messages or st.session_state.messages[0].get("role") != "system":
-            print("INFO: System prompt missing. Re-injecting.")
-            sys_prompt_dict = {"role": "system", "content": config.SYSTEM_PROMPT}
+            eventlog.info("session.system_prompt_injected")
+            sys_prompt_dict = {"role": "system", "content": study["system_prompt"]}
             if isinstance(st.session_state.messages, list):
                  st.session_state.messages.insert(0, sys_prompt_dict)
             else:
                  st.session_state.messages = [sys_prompt_dict]
 
+    # Restore a reply that was interrupted mid-stream (checkpointed by the chat handler)
+    partial_reply = (loaded_state or {}).get("partial_assistant_reply")
+    if partial_reply and partial_reply.get("content"):
+        last_msg = st.session_state.messages[-1] if st.session_state.messages else {}
+        if last_msg.get("role") == "user":
+            eventlog.info("session.partial_reply_restored", chars=len(partial_reply["content"]))
+            restored_msg_dict = {"role": "assistant", "content": partial_reply["content"].strip()}
+            utils.append_message(user_id, restored_msg_dict)
+        utils.clear_partial_reply_checkpoint(user_id)
+
+    utils.recount_context_tokens() # Counts only messages saved without a token_count
+
     # Overwrite defaults with loaded state
     if loaded_state:
-        print(f"INFO: Overwriting defaults with state loaded from Firestore for user: {user_id}")
+        eventlog.info("session.state_loaded", history_compacted=bool(loaded_state.get("history_compacted")))
         for key in default_values:
             if key in loaded_state:
                  st.session_state[key] = loaded_state[key]
     elif not loaded_messages:
-        print(f"INFO: No previous state/messages found for {user_id} in Firestore. Initializing fresh.")
+        eventlog.info("session.fresh_user")
+        utils.save_interview_state_to_firestore(user_id, {"current_stage": WELCOME_STAGE, "study_id": st.session_state.study_id, "study_version": st.session_state.study_version}) # Registers the user in the stage counters
 
     st.session_state.session_initialized = True
-    print(f"INFO: Session initialized. Stage: {st.session_state.get('current_stage')}, Msgs: {len(st.session_state.get('messages', []))}, StartTimeUnix: {st.session_state.get('start_time_unix')}")
+    eventlog.info("session.initialized", stage=st.session_state.get("current_stage"), messages=len(st.session_state.get("messages", [])), start_time_unix=st.session_state.get("start_time_unix"))
 
 # --- Function to Determine Current Stage (Keep original logic) ---
 def determine_current_stage(user_id):
@@ -177,7 +211,7 @@ def determine_current_stage(user_id):
     else: new_stage = WELCOME_STAGE
 
     if new_stage != current_stage_in_state:
-         print(f"INFO: Stage re-determined: {current_stage_in_state} -> {new_stage}")
+         eventlog.info("stage.redetermined", from_stage=current_stage_in_state, to_stage=new_stage)
          st.session_state.current_stage = new_stage
 
 
@@ -189,53 +223,164 @@ if not st.session_state.get("session_initialized", False):
     determine_current_stage(username)
     st.rerun()
 
+# --- Interview Chat Panel ---
+# With config.CHAT_FRAGMENT, a message sent through st.chat_input reruns only this function: session
+# init, stage routing and the page header are skipped. Stage changes made here (closing code, manual
+# fallback) call st.rerun(), whose default scope reruns the full app.
+def interview_chat_panel():
+    """Chat history, opening message and respondent turns of the interview stage."""
+    st.session_state.run_started = time.perf_counter(); eventlog.bind(username=username) # A fragment rerun skips the top of the script
+    if st.session_state.get("profiling"): profiler.start(username, "interview_chat") # Fragment reruns only; a full run is already sampled
+    # Display chat messages (Logic Unchanged)
+    if st.session_state.get("history_compacted"): st.caption("Earlier messages of this interview are saved; the most recent part is shown below.")
+    for message in st.session_state.get("messages", []):
+        # ... (message filtering logic unchanged) ...
+        if message.get('role') == "system": continue
+        content = message.get('content', '')
+        closing_vals = list(study["closing_messages"].values())
+        closing_keys = list(study["closing_messages"].keys())
+        if content in closing_vals or content in closing_keys: continue
+        avatar = config.AVATAR_INTERVIEWER if message.get('role') == "assistant" else config.AVATAR_RESPONDENT
+        with st.chat_message(message.get('role', 'unknown'), avatar=avatar): st.markdown(content)
+
+    # Initial message generation (Calls Firestore save)
+    if not st.session_state.get("messages", []) or \
+       (api == "openai" and len(st.session_state.get("messages", [])) == 1 and st.session_state.get("messages", [])[0].get("role") == "system"):
+        # --- Initial message: non-streamed call with retry; failures switch to the manual fallback ---
+        try:
+            intro_questions = study["manual_questions_map"].get("Intro") if study.get("scripted_intro") else None
+            with st.chat_message("assistant", avatar=config.AVATAR_INTERVIEWER):
+                message_placeholder = st.empty(); message_placeholder.markdown("Thinking...")
+                api_kwargs = {"model": study["model"], "messages": token_counts.api_messages(st.session_state.messages[:1]), "max_tokens": study["max_output_tokens"], "stream": False}
+                if study["temperature"] is not None: api_kwargs["temperature"] = study["temperature"]
+                try:
+                    @api_retry_decorator
+                    def get_initial_completion(): return openai_client.chat.completions.create(**api_kwargs).choices[0].message.content or ""
+                    if intro_questions: message_interviewer = intro_questions[0]["text"] # The outline fixes the opening question verbatim
+                    else: message_interviewer = llm_replay.complete_text(study["model"], study["temperature"], api_kwargs["messages"], get_initial_completion)
+                    message_placeholder.markdown(message_interviewer)
+                except RETRYABLE_ERRORS as e_retry:
+                     message_placeholder.error(f"Error connecting to the AI assistant. Switching to the manual interview.")
+                     enter_manual_fallback(username, f"Initial API call failed: {e_retry}")
+                except Exception as e_fatal:
+                     message_placeholder.error(f"Unexpected error contacting the AI assistant. Switching to the manual interview.")
+                     enter_manual_fallback(username, f"Non-retryable initial API error: {e_fatal}")
+            assistant_msg_dict = {"role": "assistant", "content": message_interviewer.strip()}
+            if intro_questions: assistant_msg_dict["scripted"] = True
+            utils.append_message(username, assistant_msg_dict) # Calls Firestore save
+            eventlog.info("interview.initial_message", scripted=bool(intro_questions)); st.rerun()
+        except Exception as e:
+            st.error(f"Failed initial message setup: {e}"); st.stop()
+
+    # Handle user input (Calls Firestore saves)
+    if prompt := st.chat_input("Your response..."):
+        user_msg_dict = {"role": "user", "content": prompt}
+        utils.append_message(username, user_msg_dict) # Calls Firestore save
+        with st.chat_message("user", avatar=config.AVATAR_RESPONDENT): st.markdown(prompt)
+        in_flight = {"content": "", "checkpointed_chars": 0} # Partial reply, kept for the fallback
+        turn_token = eventlog.bind(turn=(user_msg_dict["n"] + 1) // 2) # Respondent turn; odd numbers after the opening question
+        try:
+            with st.chat_message("assistant", avatar=config.AVATAR_INTERVIEWER):
+                 message_placeholder = st.empty(); message_placeholder.markdown("Thinking...")
+                 # Context size is a running sum of per-message counts, so budgeting costs O(1) per turn
+                 context_tokens = st.session_state.get("context_tokens", 0)
+                 max_output_tokens = max(min(study["max_output_tokens"], study["context_window_tokens"] - context_tokens), 256)
+                 eventlog.info("turn.context", context_tokens=context_tokens, max_output_tokens=max_output_tokens, messages=len(st.session_state.messages))
+                 api_kwargs = {"model": study["model"], "messages": token_counts.api_messages(compaction.context_messages(st.session_state.messages, st.session_state.get("compaction_checkpoint"))), "max_tokens": max_output_tokens, "stream": True}
+                 if study["temperature"] is not None: api_kwargs["temperature"] = study["temperature"]
+
+                 @api_retry_decorator
+                 def open_stream(partial_content):
+                     # Called again with the partial reply if the stream misses its first-token/stall budget
+                     call_messages = llm_stream.continuation_messages(api_kwargs["messages"], partial_content)
+                     def start_live():
+                         stream = openai_client.chat.completions.create(**{**api_kwargs, "messages": call_messages})
+                         return llm_stream.openai_text_deltas(stream), stream.close
+                     return llm_replay.open_text_stream(study["model"], study["temperature"], call_messages, start_live)
+
+                 def show_partial_reply(text_so_far):
+                     if utils.detect_closing_code(text_so_far): return True # Stop streaming once the reply is a closing code
+                     message_placeholder.markdown(text_so_far + "▌")
+                     in_flight["content"] = text_so_far
+                     if len(text_so_far) - in_flight["checkpointed_chars"] >= config.PARTIAL_CHECKPOINT_CHARS:
+                         utils.checkpoint_partial_reply(username, text_so_far, turn=len(st.session_state.messages))
+                         in_flight["checkpointed_chars"] = len(text_so_far)
+
+                 try:
+                    scripted = scripted_turns.next_turn(st.session_state.messages, study["compiled_scripted_turns"])
+                    if scripted:
+                        eventlog.info("turn.scripted", rule=scripted[0]) # No LLM call
+                        full_response_content = scripted[1]
+                    else:
+                        full_response_content = llm_stream.consume_stream(open_stream, on_text=show_partial_reply)
+                    detected_code = utils.detect_closing_code(full_response_content)
+                    message_interviewer = full_response_content.replace(detected_code, "").strip() if detected_code else full_response_content
+                    if message_interviewer: message_placeholder.markdown(message_interviewer)
+                    else: message_placeholder.empty()
+
+                    assistant_msg_content = full_response_content.strip()
+                    assistant_msg_dict = {"role": "assistant", "content": assistant_msg_content}
+                    if scripted: assistant_msg_dict["scripted"] = True
+                    if not st.session_state.messages or st.session_state.messages[-1] != assistant_msg_dict:
+                        utils.append_message(username, assistant_msg_dict) # Calls Firestore save
+                    if in_flight["checkpointed_chars"]: utils.clear_partial_reply_checkpoint(username)
+                    if not detected_code: utils.checkpoint_conversation(username, study) # When the context passes COMPACTION_CONTEXT_FRACTION
+                    if detected_code:
+                        st.session_state.interview_active = False; st.session_state.interview_completed_flag = True
+                        utils.save_timing_to_state(username) # Calls Firestore save internally
+                        formatted_transcript = utils.format_transcript_for_gsheet(utils.transcript_messages(username))
+                        st.session_state.current_formatted_transcript_for_gsheet = formatted_transcript
+                        state_update = {"interview_active": False,"interview_completed_flag": True,"current_stage": SURVEY_STAGE,"partial_ai_transcript_formatted": formatted_transcript}
+                        utils.save_interview_state_to_firestore(username, state_update) # Calls Firestore save
+                        utils.queue_transition_notice(study["closing_messages"][detected_code])
+                        st.session_state.current_stage = SURVEY_STAGE
+                        eventlog.info("stage.change", to_stage=SURVEY_STAGE, reason="closing_code", code=detected_code); st.rerun()
+
+                 except llm_stream.StreamTimeout as e_timeout:
+                     enter_manual_fallback(username, f"Chat stream timed out: {e_timeout}", e_timeout.partial_content or in_flight["content"])
+                 except RETRYABLE_ERRORS as e_retry:
+                     enter_manual_fallback(username, f"API call failed during chat stream: {e_retry}", in_flight["content"])
+                 except Exception as e_fatal:
+                     enter_manual_fallback(username, f"Unhandled API error during chat stream: {e_fatal}", in_flight["content"])
+        except Exception as e:
+            enter_manual_fallback(username, f"Error processing chat response: {e}", in_flight["content"])
+        finally: eventlog.reset(turn_token) # Later events of this run (and the next fragment run) carry no stale turn
+
+if config.CHAT_FRAGMENT: interview_chat_panel = st.fragment(interview_chat_panel)
+
 # --- === Main Application Logic === ---
 if not st.session_state.get("session_initialized", False):
     st.spinner("Initializing session...")
     st.stop()
 
+study = studies.current_study() # Prompt, model parameters and sinks of this session's study
+manual_questions_map = study["manual_questions_map"]
+
+utils.show_pending_transition_notice() # Confirmation from the previous stage (no sleep before rerun)
+if st.session_state.get("current_stage") in config.STAGES: st.session_state.fallback_reruns = 0
+
 # --- Section 0: Welcome Stage ---
 if st.session_state.get("current_stage") == WELCOME_STAGE:
     st.title("Welcome")
-    # Display welcome markdown (ensure username is displayed)
-    st.markdown(f"""
-    Hi there, [...]
-    *(Your User ID for this session is: `{st.session_state.username}`)*
-    """)
+    # Static segments are shared by all sessions; only the User ID is filled in per participant
+    st.markdown(username.join(page_text.WELCOME_SEGMENTS))
     st.markdown("---")
     st.subheader("Information Sheet & Consent Form")
-    # Display consent form markdown (ensure username interpolation works & text is updated)
-    st.markdown(f"""
-**Study Title:** [...] \n
-**Researcher:** [...]
-[...]
-**3. Privacy, Anonymity, API Usage, and Logging:**
-*   [...] User ID: `{st.session_state.username}`.
-[...]
-*   **Research Data:** [...] linked to your **anonymized User ID** (`{st.session_state.username}`).
-[...]
-*   **Persistent Logging (Firestore):** To prevent data loss [...], your anonymized chat messages and session state are saved to a secure cloud database (Google Cloud Firestore) [...]. Data is linked only to your anonymized User ID (`{st.session_state.username}`). Final results are also sent to Google Sheets.
-[...]
-**5. Voluntary Participation and Withdrawal:**
-[...]
-*   If you have concerns [...], contact Janik Deutscher (janik.deutscher@upf.edu) with your User ID (`{st.session_state.username}`). [...]
-[...]
-*(Rest of consent form markdown)*
-    """)
-
-    # Consent Checkbox Logic (Calls Firestore save)
+    st.markdown(username.join(page_text.CONSENT_SEGMENTS))
+
+    # Consent Checkbox Logic (write-behind: repeated toggles coalesce into one Firestore write)
     consent = st.checkbox("I confirm that I have read...", key="consent_checkbox", value=st.session_state.get("consent_given", False))
     if consent != st.session_state.get("consent_given", False):
         st.session_state.consent_given = consent
-        utils.save_interview_state_to_firestore(username, {'consent_given': consent}) # Calls Firestore save
+        utils.save_interview_state_write_behind(username, {'consent_given': consent})
 
     # Start Button Logic (Calls Firestore save)
     if st.button("Start Interview", key="start_interview_btn", disabled=not st.session_state.get("consent_given", False)):
         if st.session_state.get("consent_given", False):
             st.session_state.welcome_shown = True
             st.session_state.current_stage = INTERVIEW_STAGE
-            utils.save_interview_state_to_firestore(username, {'welcome_shown': True, 'current_stage': INTERVIEW_STAGE}) # Calls Firestore save
-            print("INFO: Moving to Interview Stage from Welcome"); st.rerun()
+            utils.save_interview_state_to_firestore(username, {'consent_given': True, 'welcome_shown': True, 'current_stage': INTERVIEW_STAGE}) # Calls Firestore save
+            eventlog.info("stage.change", to_stage=INTERVIEW_STAGE, reason="start"); st.rerun()
 
 
 # --- Section 1: Interview Stage ---
@@ -247,13 +392,13 @@ elif st.session_state.get("current_stage") == INTERVIEW_STAGE:
         current_time = time.time()
         st.session_state.start_time_unix = current_time
         utils.save_interview_state_to_firestore(username, {"start_time_unix": current_time}) # Calls Firestore save
-        print(f"INFO: Start time initialized ({current_time}).")
+        eventlog.info("interview.start_time", start_time_unix=current_time)
 
     # Mark interview active (Calls Firestore save)
     if not st.session_state.get("interview_active", False):
          st.session_state.interview_active = True
          utils.save_interview_state_to_firestore(username, {"interview_active": True}) # Calls Firestore save
-         print("INFO: Interview marked as active.")
+         eventlog.info("interview.active")
 
     st.info("Please answer the interviewer's questions.")
 
@@ -263,11 +408,10 @@ elif st.session_state.get("current_stage") == INTERVIEW_STAGE:
         st.session_state.interview_completed_flag = True
         quit_message = "You have chosen to end the interview early..."
         quit_msg_dict = {"role": "assistant", "content": quit_message}
-        st.session_state.messages.append(quit_msg_dict)
-        utils.save_message_to_firestore(username, quit_msg_dict) # Calls Firestore save
+        utils.append_message(username, quit_msg_dict) # Calls Firestore save
 
         utils.save_timing_to_state(username) # Calls Firestore state save internally
-        formatted_transcript = utils.format_transcript_for_gsheet(st.session_state.messages)
+        formatted_transcript = utils.format_transcript_for_gsheet(utils.transcript_messages(username))
         st.session_state.current_formatted_transcript_for_gsheet = formatted_transcript
         state_update = {
             "interview_active": False, "interview_completed_flag": True,
@@ -275,105 +419,12 @@ elif st.session_state.get("current_stage") == INTERVIEW_STAGE:
         }
         utils.save_interview_state_to_firestore(username, state_update) # Calls Firestore save
 
-        st.warning(quit_message)
+        utils.queue_transition_notice(quit_message, kind="warning")
         st.session_state.current_stage = SURVEY_STAGE
-        print("INFO: Moving to Survey Stage after Quit."); time.sleep(1); st.rerun()
-
-    # Display chat messages (Logic Unchanged)
-    for message in st.session_state.get("messages", []):
-        # ... (message filtering logic unchanged) ...
-        if message.get('role') == "system": continue
-        content = message.get('content', '')
-        closing_vals = list(config.CLOSING_MESSAGES.values())
-        closing_keys = list(config.CLOSING_MESSAGES.keys())
-        if content in closing_vals or content in closing_keys: continue
-        avatar = config.AVATAR_INTERVIEWER if message.get('role') == "assistant" else config.AVATAR_RESPONDENT
-        with st.chat_message(message.get('role', 'unknown'), avatar=avatar): st.markdown(content)
+        eventlog.info("stage.change", to_stage=SURVEY_STAGE, reason="quit"); st.rerun()
 
-    # Initial message generation (Calls Firestore save)
-    if not st.session_state.get("messages", []) or \
-       (api == "openai" and len(st.session_state.get("messages", [])) == 1 and st.session_state.get("messages", [])[0].get("role") == "system"):
-        # ... (API call logic unchanged) ...
-        try:
-            # ... (placeholder setup) ...
-                try:
-                    # ... (API call execution) ...
-                    message_placeholder.markdown(message_interviewer)
-                except RETRYABLE_ERRORS as e_retry:
-                     # ... (Error handling - calls Firestore save) ...
-                     print(f"ERROR: Initial API call failed: {e_retry}")
-                     message_placeholder.error(f"Error connecting... Switching fallback.")
-                     partial_transcript = utils.format_transcript_for_gsheet(st.session_state.messages)
-                     st.session_state.partial_ai_transcript_formatted = partial_transcript
-                     state_update = {"current_stage": MANUAL_INTERVIEW_STAGE,"interview_active": False,"manual_fallback_triggered": True,"partial_ai_transcript_formatted": partial_transcript}
-                     utils.save_interview_state_to_firestore(username, state_update) # Calls Firestore save
-                     st.session_state.current_stage = MANUAL_INTERVIEW_STAGE; st.rerun()
-                except Exception as e_fatal:
-                     # ... (Error handling - calls Firestore save) ...
-                     print(f"ERROR: Non-retryable initial API error: {e_fatal}")
-                     message_placeholder.error(f"Unexpected error... Switching fallback.")
-                     partial_transcript = utils.format_transcript_for_gsheet(st.session_state.messages)
-                     st.session_state.partial_ai_transcript_formatted = partial_transcript
-                     state_update = {"current_stage": MANUAL_INTERVIEW_STAGE,"interview_active": False,"manual_fallback_triggered": True,"partial_ai_transcript_formatted": partial_transcript}
-                     utils.save_interview_state_to_firestore(username, state_update) # Calls Firestore save
-                     st.session_state.current_stage = MANUAL_INTERVIEW_STAGE; st.rerun()
-            # ... (Save assistant message - calls Firestore save) ...
-            assistant_msg_dict = {"role": "assistant", "content": message_interviewer.strip()}
-            st.session_state.messages.append(assistant_msg_dict)
-            utils.save_message_to_firestore(username, assistant_msg_dict) # Calls Firestore save
-            print("INFO: Initial message obtained and saved."); time.sleep(0.1); st.rerun()
-        except Exception as e:
-            # ... (Outer error handling) ...
-            st.error(f"Failed initial message setup: {e}"); st.stop()
-
-    # Handle user input (Calls Firestore saves)
-    if prompt := st.chat_input("Your response..."):
-        user_msg_dict = {"role": "user", "content": prompt}
-        st.session_state.messages.append(user_msg_dict)
-        utils.save_message_to_firestore(username, user_msg_dict) # Calls Firestore save
-        with st.chat_message("user", avatar=config.AVATAR_RESPONDENT): st.markdown(prompt)
-        try:
-            with st.chat_message("assistant", avatar=config.AVATAR_INTERVIEWER):
-                 # ... (placeholder setup) ...
-                 try:
-                    # ... (API streaming logic unchanged) ...
-                    # ... (Save assistant message - calls Firestore save) ...
-                    assistant_msg_content = full_response_content.strip()
-                    assistant_msg_dict = {"role": "assistant", "content": assistant_msg_content}
-                    if not st.session_state.messages or st.session_state.messages[-1] != assistant_msg_dict:
-                        st.session_state.messages.append(assistant_msg_dict)
-                        utils.save_message_to_firestore(username, assistant_msg_dict) # Calls Firestore save
-                    # ... (Handle code detection - calls Firestore saves) ...
-                    if detected_code:
-                        # ... (set flags) ...
-                        utils.save_timing_to_state(username) # Calls Firestore save internally
-                        formatted_transcript = utils.format_transcript_for_gsheet(st.session_state.messages)
-                        st.session_state.current_formatted_transcript_for_gsheet = formatted_transcript
-                        state_update = {"interview_active": False,"interview_completed_flag": True,"current_stage": SURVEY_STAGE,"partial_ai_transcript_formatted": formatted_transcript}
-                        utils.save_interview_state_to_firestore(username, state_update) # Calls Firestore save
-                        # ... (display message, change stage, rerun) ...
-
-                 except RETRYABLE_ERRORS as e_retry:
-                     # ... (Error handling - calls Firestore save) ...
-                     partial_transcript = utils.format_transcript_for_gsheet(st.session_state.messages)
-                     st.session_state.partial_ai_transcript_formatted = partial_transcript
-                     state_update = {"current_stage": MANUAL_INTERVIEW_STAGE,"interview_active": False,"manual_fallback_triggered": True,"partial_ai_transcript_formatted": partial_transcript}
-                     utils.save_interview_state_to_firestore(username, state_update) # Calls Firestore save
-                     st.session_state.current_stage = MANUAL_INTERVIEW_STAGE; st.rerun()
-                 except Exception as e_fatal:
-                     # ... (Error handling - calls Firestore save) ...
-                     partial_transcript = utils.format_transcript_for_gsheet(st.session_state.messages)
-                     st.session_state.partial_ai_transcript_formatted = partial_transcript
-                     state_update = {"current_stage": MANUAL_INTERVIEW_STAGE,"interview_active": False,"manual_fallback_triggered": True,"partial_ai_transcript_formatted": partial_transcript}
-                     utils.save_interview_state_to_firestore(username, state_update) # Calls Firestore save
-                     st.session_state.current_stage = MANUAL_INTERVIEW_STAGE; st.rerun()
-        except Exception as e:
-             # ... (Outer error handling - calls Firestore save) ...
-            partial_transcript = utils.format_transcript_for_gsheet(st.session_state.messages)
-            st.session_state.partial_ai_transcript_formatted = partial_transcript
-            state_update = {"current_stage": MANUAL_INTERVIEW_STAGE,"interview_active": False,"manual_fallback_triggered": True,"partial_ai_transcript_formatted": partial_transcript}
-            utils.save_interview_state_to_firestore(username, state_update) # Calls Firestore save
-            st.session_state.current_stage = MANUAL_INTERVIEW_STAGE; st.rerun()
+    # Chat history and input: a fragment when config.CHAT_FRAGMENT is set, so a turn reruns only the panel
+    interview_chat_panel()
 
 # --- Section 1.5: Manual Interview Fallback Stage ---
 elif st.session_state.get("current_stage") == MANUAL_INTERVIEW_STAGE:
@@ -406,16 +457,18 @@ elif st.session_state.get("current_stage") == SURVEY_STAGE:
                 st.session_state.survey_completed_flag = True
                 st.session_state.current_stage = COMPLETED_STAGE
                 # Stage update now happens inside utils.save_survey_data
-                st.success("Survey submitted! Thank you."); st.balloons(); time.sleep(3); st.rerun()
+                if st.session_state.pop("survey_save_pending", False): # Same submission already in flight (double click / second tab)
+                    utils.queue_transition_notice("Your survey is already being saved. Thank you!", kind="info"); st.rerun()
+                utils.queue_transition_notice("Survey submitted! Thank you.", balloons=True); st.rerun()
             else:
                 st.warning("Could not save to Google Sheets (backup should be saved). Try again or contact researcher.")
                 # Check Firestore state to see if marked complete there
                 if utils.check_if_survey_completed(username): # Checks Firestore now
-                     st.info("Backup system indicates completion. Moving forward.")
+                     utils.queue_transition_notice("Backup system indicates completion. Moving forward.", kind="info")
                      st.session_state.survey_completed_flag = True
                      st.session_state.current_stage = COMPLETED_STAGE
                      # utils.save_interview_state_to_firestore(username, {"current_stage": COMPLETED_STAGE}) # Ensure stage updated if GSheet failed? Already done in save_survey_data
-                     time.sleep(2); st.rerun()
+                     st.rerun()
 
 
 # --- Section 3: Completed Stage (Unchanged) ---
@@ -433,8 +486,11 @@ elif st.session_state.get("current_stage") == COMPLETED_STAGE:
 # --- Fallback / Initializing ---
 else:
     st.spinner("Loading application state...")
-    print(f"INFO: Fallback/Loading state. User: {username}, Stage: {st.session_state.get('current_stage')}, Initialized: {st.session_state.get('session_initialized')}")
-    time.sleep(1.0)
+    eventlog.info("session.rerun_fallback", stage=st.session_state.get("current_stage"), initialized=st.session_state.get("session_initialized"))
+    # Rerun immediately instead of sleeping; cap attempts so an unknown stage cannot spin the runner
+    st.session_state.fallback_reruns = st.session_state.get("fallback_reruns", 0) + 1
+    if st.session_state.fallback_reruns > 3:
+        st.error("Could not restore your session. Please refresh the page or contact the researcher."); st.stop()
     if username and st.session_state.get("session_initialized"):
         initialize_session_state_from_env(username) # Call correct init function
         determine_current_stage(username)
@@ -0,0 +1,174 @@
+# benchmarks/chat_fragment_cpu.py (Server CPU per interview turn: full-script reruns vs. the chat fragment)
+# Usage: python benchmarks/chat_fragment_cpu.py [--sessions 100] [--turns 5] [--out benchmarks/results/chat_fragment_cpu.json]
+# Starts `streamlit run app.py` twice (config.CHAT_FRAGMENT off, then on) and drives simulated participants
+# over the same websocket protocol the browser uses: consent, start, then --turns chat messages each.
+# All sessions send turn k at the same time; the server's CPU time for that round / sessions = CPU per turn.
+# LLM replies are served from generated llm_replay recordings (no API key needed). Google credentials
+# are removed from the server's environment, so persistence calls fail fast instead of writing test
+# users to Firestore; the Firestore round trips themselves are network wait, not server CPU.
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from tornado.websocket import websocket_connect
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+import config
+config.SCRIPTED_INTRO = True # Same study as the servers (see LAUNCHER)
+import llm_replay
+import studies
+import utils # Registers the survey sinks that study definitions are validated against
+
+ANSWERS = ["Probably consulting.", "Mostly skills, I think.", "Data analysis and writing.", "Internships taught me more.", "Not really, no."]
+REPLY = "Thank you. Could you tell me a bit more about why that matters to you? ({turn})"
+FINISHED = {ForwardMsg.FINISHED_SUCCESSFULLY, ForwardMsg.FINISHED_FRAGMENT_RUN_SUCCESSFULLY, ForwardMsg.FINISHED_WITH_COMPILE_ERROR}
+
+# Runs app.py as the main script with the chat fragment switched on/off. The benchmark study opts in to
+# the scripted opening question (off by default), so the recordings start after it.
+LAUNCHER = """import sys; sys.path.insert(0, {repo!r})
+import config; config.CHAT_FRAGMENT = {fragment!r}; config.SCRIPTED_INTRO = True
+{patch}
+exec(compile(open({app!r}, encoding="utf-8").read(), {app!r}, "exec"))
+"""
+
+
+# --- Setup ---
+def write_recordings(replay_dir, turns):
+    """Replay recordings for the scripted conversation: intro (scripted), then ANSWERS / REPLY turns."""
+    llm_replay.REPLAY_DIR = replay_dir
+    study = studies.get_study(studies.DEFAULT_STUDY_ID)
+    messages = [{"role": "system", "content": study["system_prompt"]}, {"role": "assistant", "content": study["manual_questions_map"]["Intro"][0]["text"].strip()}]
+    for turn in range(turns):
+        messages.append({"role": "user", "content": ANSWERS[turn % len(ANSWERS)]})
+        reply = REPLY.format(turn=turn + 1); words = reply.split(" ")
+        key = llm_replay.replay_key(study["model"], study["temperature"], messages)
+        llm_replay.save_recording(key, study["model"], [[0.0, w + " "] for w in words[:-1]] + [[0.0, words[-1]]])
+        messages.append({"role": "assistant", "content": reply})
+
+def _free_port():
+    with socket.socket() as s: s.bind(("127.0.0.1", 0)); return s.getsockname()[1]
+
+def start_server(work_dir, replay_dir, fragment, patch="", name=None):
+    """Starts `streamlit run` on a launcher for app.py; `patch` is Python run before app.py (e.g. to restore old behaviour)."""
+    name = name or f"fragment_{int(fragment)}"; launcher = os.path.join(work_dir, f"launch_{name}.py")
+    with open(launcher, "w", encoding="utf-8") as f: f.write(LAUNCHER.format(repo=REPO_DIR, fragment=fragment, patch=patch, app=os.path.join(REPO_DIR, "app.py")))
+    env = {k: v for k, v in os.environ.items() if k not in ("GOOGLE_CREDENTIALS_JSON", "API_KEY_OPENAI")}
+    env.update({"LLM_REPLAY_MODE": "replay", "LLM_REPLAY_DIR": replay_dir, "LLM_REPLAY_SPEED": "0"})
+    port = _free_port()
+    log = open(os.path.join(work_dir, f"server_{name}.log"), "w")
+    process = subprocess.Popen([sys.executable, "-m", "streamlit", "run", launcher, "--server.headless", "true", "--server.port", str(port),
+                                "--server.fileWatcherType", "none", "--browser.gatherUsageStats", "false"], cwd=REPO_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+    for _ in range(120):
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout=1); return process, port
+        except Exception: time.sleep(0.5)
+    process.kill(); raise RuntimeError(f"Streamlit server did not start (see {log.name})")
+
+def cpu_seconds(pid):
+    """User + system CPU time of process `pid` (Linux /proc)."""
+    with open(f"/proc/{pid}/stat") as f: fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+# --- Simulated Participant ---
+class Session:
+    """One browser tab: sends reruns with widget triggers and reads ForwardMsgs until the run finishes."""
+    def __init__(self, port):
+        self.url = f"ws://127.0.0.1:{port}/_stcore/stream"; self.widgets = {}; self.forward_msgs = 0
+
+    async def connect(self):
+        self.ws = await websocket_connect(self.url, max_message_size=64 * 1024 * 1024)
+
+    async def rerun(self, widget_state=None, fragment_id=""):
+        msg = BackMsg(); msg.rerun_script.query_string = ""
+        if fragment_id: msg.rerun_script.fragment_id = fragment_id
+        if widget_state is not None: msg.rerun_script.widget_states.widgets.append(widget_state)
+        await self.ws.write_message(msg.SerializeToString(), binary=True); self.texts = []
+        while True:
+            raw = await self.ws.read_message()
+            if raw is None: raise RuntimeError("Server closed the connection")
+            forward = ForwardMsg(); forward.ParseFromString(raw); self.forward_msgs += 1
+            if forward.HasField("delta") and forward.delta.HasField("new_element"):
+                element = forward.delta.new_element; kind = element.WhichOneof("type")
+                if kind in ("checkbox", "button", "chat_input"): self.widgets[kind] = (getattr(element, kind).id, forward.delta.fragment_id)
+                elif kind == "markdown": self.texts.append(element.markdown.body)
+                elif kind == "alert": self.texts.append(element.alert.body)
+            if forward.HasField("script_finished") and forward.script_finished in FINISHED: return
+
+    def _state(self, kind):
+        widget_id, fragment_id = self.widgets[kind]
+        state = WidgetState(id=widget_id)
+        return state, fragment_id
+
+    async def start_interview(self):
+        await self.rerun() # Session init -> welcome stage
+        state, _ = self._state("checkbox"); state.bool_value = True; await self.rerun(state)
+        state, _ = self._state("button"); state.trigger_value = True; await self.rerun(state) # -> interview, scripted intro
+
+    async def send(self, text, turn):
+        state, fragment_id = self._state("chat_input"); state.string_trigger_value.data = text
+        await self.rerun(state, fragment_id)
+        if REPLY.format(turn=turn) not in self.texts: raise RuntimeError(f"Turn {turn} was not answered from the recordings (manual fallback?)")
+
+
+async def run_mode(port, pid, sessions, turns, concurrency):
+    participants = [Session(port) for _ in range(sessions)]
+    limit = asyncio.Semaphore(concurrency)
+    async def setup(p):
+        async with limit: await p.connect(); await p.start_interview()
+    await asyncio.gather(*(setup(p) for p in participants))
+    rounds = []
+    for turn in range(turns):
+        before_msgs = sum(p.forward_msgs for p in participants)
+        cpu_before = cpu_seconds(pid); started = time.perf_counter()
+        await asyncio.gather(*(p.send(ANSWERS[turn % len(ANSWERS)], turn + 1) for p in participants))
+        cpu = cpu_seconds(pid) - cpu_before; wall = time.perf_counter() - started
+        rounds.append({"turn": turn + 1, "cpu_ms_per_turn": round(cpu * 1000 / sessions, 2), "wall_s": round(wall, 3),
+                       "forward_msgs_per_turn": round((sum(p.forward_msgs for p in participants) - before_msgs) / sessions, 1)})
+        print(f"INFO: turn {turn + 1}: {rounds[-1]}")
+    for p in participants: p.ws.close()
+    return {"rounds": rounds, "cpu_ms_per_turn": round(sum(r["cpu_ms_per_turn"] for r in rounds) / len(rounds), 2),
+            "forward_msgs_per_turn": round(sum(r["forward_msgs_per_turn"] for r in rounds) / len(rounds), 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Server CPU per interview turn with and without the chat fragment.")
+    parser.add_argument("--sessions", type=int, default=100)
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=20, help="Sessions set up in parallel")
+    parser.add_argument("--out", default=os.path.join(REPO_DIR, "benchmarks", "results", "chat_fragment_cpu.json"))
+    args = parser.parse_args()
+    work_dir = tempfile.mkdtemp(prefix="bench_chat_fragment_"); replay_dir = os.path.join(work_dir, "llm_replay")
+    write_recordings(replay_dir, args.turns)
+    results = {}
+    try:
+        for mode, fragment in (("full_rerun", False), ("fragment", True)):
+            process, port = start_server(work_dir, replay_dir, fragment)
+            try: results[mode] = asyncio.run(run_mode(port, process.pid, args.sessions, args.turns, args.concurrency))
+            finally: process.terminate(); process.wait(timeout=30)
+            print(f"INFO: {mode}: {results[mode]['cpu_ms_per_turn']} ms server CPU per turn")
+    finally: shutil.rmtree(work_dir, ignore_errors=True)
+    import streamlit
+    report = {"benchmark": "chat_fragment_cpu", "sessions": args.sessions, "turns": args.turns, "created_unix": time.time(),
+              "python": platform.python_version(), "streamlit": streamlit.__version__, "modes": results,
+              "cpu_reduction": round(1 - results["fragment"]["cpu_ms_per_turn"] / results["full_rerun"]["cpu_ms_per_turn"], 3)}
+    os.makedirs(os.path.dirname(args.out), exist_ok=True)
+    with open(args.out, "w", encoding="utf-8") as f: json.dump(report, f, indent=2); f.write("\n")
+    print(f"INFO: Wrote {args.out} (CPU per turn -{report['cpu_reduction']:.0%} with the chat fragment)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# benchmarks/transition_runner_time.py (Script-thread time of stage transitions: queued notices vs. the old sleeps)
+# Usage: python benchmarks/transition_runner_time.py [--sessions 20] [--out benchmarks/results/transition_runner_time.json]
+# Starts `streamlit run app.py` twice: "blocking" restores the sleeps transitions had before notices were
+# queued (quit 1 s, closing code 2 s, survey submit 3 s, backup completion 2 s, after queueing, before
+# st.rerun()), "queued" is the current code. In each, --sessions simulated participants quit the interview
+# early, and as many end it with the closing code (served from a replay recording). For each transition
+# the benchmark records the wall time from the click / message until the new stage finished rendering,
+# and the server's run_ms (script-thread time of the transition run up to queueing the notice, from the
+# stage.transition_rendered event; in "blocking" the sleep comes after it). The survey submit is not
+# driven: the survey form in app.py is placeholder code.
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_DIR, "benchmarks"))
+from chat_fragment_cpu import Session, start_server # Server launcher and websocket participant
+import config
+import llm_replay
+import studies
+
+CLOSING_CODE = "x7y8"
+CLOSING_ANSWER = "That is all from my side, thank you."
+QUIT_MESSAGE = "You have chosen to end the interview early..."
+BLOCKING_PATCH = """import time, utils
+def _queue_and_sleep(text, kind="success", balloons=False, _queue=utils.queue_transition_notice):
+    _queue(text, kind, balloons)
+    time.sleep(3.0 if balloons else {"success": 2.0, "warning": 1.0, "info": 2.0}[kind]) # Confirmation kept on screen, then st.rerun()
+if not hasattr(utils.queue_transition_notice, "blocking"): # The launcher runs on every rerun; wrap once
+    _queue_and_sleep.blocking = True; utils.queue_transition_notice = _queue_and_sleep
+"""
+
+
+# --- Setup ---
+def write_recordings(replay_dir):
+    """Replay recording of the closing-code reply to CLOSING_ANSWER after the scripted intro."""
+    llm_replay.REPLAY_DIR = replay_dir
+    study = studies.get_study(studies.DEFAULT_STUDY_ID)
+    messages = [{"role": "system", "content": study["system_prompt"]}, {"role": "assistant", "content": study["manual_questions_map"]["Intro"][0]["text"].strip()},
+                {"role": "user", "content": CLOSING_ANSWER}]
+    llm_replay.save_recording(llm_replay.replay_key(study["model"], study["temperature"], messages), study["model"], [[0.0, CLOSING_CODE]])
+
+def server_run_ms(log_path):
+    """run_ms of every stage.transition_rendered event in a server log, by notice kind."""
+    runs = {}
+    with open(log_path, encoding="utf-8") as f:
+        for line in f:
+            if '"stage.transition_rendered"' not in line: continue
+            entry = json.loads(line); runs.setdefault(entry["kind"], []).append(entry["run_ms"])
+    return runs
+
+
+# --- Transitions ---
+async def quit_early(p):
+    p.widgets.pop("button", None); await p.rerun() # Widgets of the interview page only (the Quit button)
+    state, _ = p._state("button"); state.trigger_value = True
+    started = time.perf_counter(); await p.rerun(state); wall = time.perf_counter() - started
+    if QUIT_MESSAGE not in p.texts: raise RuntimeError("Quit did not reach the survey stage")
+    return wall
+
+async def closing_code(p):
+    state, fragment_id = p._state("chat_input"); state.string_trigger_value.data = CLOSING_ANSWER
+    started = time.perf_counter(); await p.rerun(state, fragment_id); wall = time.perf_counter() - started
+    if config.CLOSING_MESSAGES[CLOSING_CODE] not in p.texts: raise RuntimeError("Closing code did not reach the survey stage (manual fallback?)")
+    return wall
+
+async def run_mode(port, sessions, concurrency):
+    limit = asyncio.Semaphore(concurrency); walls = {"quit": [], "closing_code": []}
+    async def participant(transition):
+        async with limit:
+            p = Session(port); await p.connect(); await p.start_interview()
+            walls[transition.__name__ if transition is closing_code else "quit"].append(await transition(p)); p.ws.close()
+    await asyncio.gather(*(participant(t) for t in (quit_early, closing_code) for _ in range(sessions)))
+    return walls
+
+def summary(walls, runs):
+    kinds = {"quit": "warning", "closing_code": "success"}
+    return {name: {"wall_ms_median": round(statistics.median(values) * 1000, 1), "wall_ms_max": round(max(values) * 1000, 1),
+                   "run_ms_median": statistics.median(runs.get(kinds[name], [0]))} for name, values in walls.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Script-thread time of stage transitions with queued notices vs. the old sleeps.")
+    parser.add_argument("--sessions", type=int, default=20, help="Participants per transition and mode")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--out", default=os.path.join(REPO_DIR, "benchmarks", "results", "transition_runner_time.json"))
+    args = parser.parse_args()
+    work_dir = tempfile.mkdtemp(prefix="bench_transitions_"); replay_dir = os.path.join(work_dir, "llm_replay")
+    write_recordings(replay_dir)
+    results = {}
+    try:
+        for mode, patch in (("blocking", BLOCKING_PATCH), ("queued", "")):
+            process, port = start_server(work_dir, replay_dir, config.CHAT_FRAGMENT, patch=patch, name=mode)
+            try: walls = asyncio.run(run_mode(port, args.sessions, args.concurrency))
+            finally: process.terminate(); process.wait(timeout=30)
+            results[mode] = summary(walls, server_run_ms(os.path.join(work_dir, f"server_{mode}.log")))
+            print(f"INFO: {mode}: {results[mode]}")
+    finally: shutil.rmtree(work_dir, ignore_errors=True)
+    import streamlit
+    report = {"benchmark": "transition_runner_time", "sessions": args.sessions, "created_unix": time.time(),
+              "python": platform.python_version(), "streamlit": streamlit.__version__, "modes": results,
+              "wall_ms_saved": {name: round(results["blocking"][name]["wall_ms_median"] - results["queued"][name]["wall_ms_median"], 1) for name in results["queued"]}}
+    os.makedirs(os.path.dirname(args.out), exist_ok=True)
+    with open(args.out, "w", encoding="utf-8") as f: json.dump(report, f, indent=2); f.write("\n")
+    print(f"INFO: Wrote {args.out} (median wall time saved per transition: {report['wall_ms_saved']} ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+# benchmarks/utils_hot_paths.py (Micro-benchmarks for the per-turn / per-submission helpers in utils.py)
+# Usage: python benchmarks/utils_hot_paths.py            compare against benchmarks/results/utils_hot_paths.json
+#        python benchmarks/utils_hot_paths.py --save     run and store the results as the new baseline
+# Synthetic transcripts of 10, 100 and 1000 messages. Firestore is replaced by an in-memory fake that
+# serves the same document layout, so load_interview_state_from_firestore is timed without network.
+# Each case is timed right after a fixed calibration loop, and the gate compares case / calibration
+# against the baseline's ratio, so machine speed and drift between runs cancel out. A case over
+# --threshold is re-measured (--confirm times) and only reported if every attempt is over; the gate
+# exits with status 1 then. If the baseline was stored on another machine (fingerprint), the
+# comparison is informational and never fails.
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import time
+import timeit
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+import config
+import scripted_turns
+import studies
+import utils
+for _name in list(logging.root.manager.loggerDict): # Bare mode: no "missing ScriptRunContext" warning per call
+    if _name.startswith("streamlit"): logging.getLogger(_name).setLevel(logging.ERROR)
+config.EVENT_LOG_LEVEL = "ERROR" # The loaders log an event per call
+
+SIZES = (10, 100, 1000)
+RESULTS_FILE = os.path.join(REPO_DIR, "benchmarks", "results", "utils_hot_paths.json")
+CLOSING_CODE = "x7y8"
+CALIBRATION_WORDS = [f"word{i}" for i in range(2000)]
+
+
+# --- Synthetic Data ---
+def synthetic_messages(count, study):
+    """`count` alternating interviewer/respondent messages; outline questions only near the start."""
+    questions = [q["text"] for part in studies.PART_KEY_SEQUENCE for q in study["manual_questions_map"].get(part, [])]
+    messages = [{"role": "system", "content": study["system_prompt"]}]
+    for i in range(count):
+        if i % 2 == 0:
+            text = questions[i // 2] if i // 2 < len(questions) and i < count // 4 else f"That is helpful, thank you. Could you tell me a bit more about why aspect {i} matters to you and give an example from your studies?"
+            messages.append({"role": "assistant", "content": text, "n": i})
+        else:
+            messages.append({"role": "user", "content": f"Answer {i}: " + "I think the most important part is practical experience with real projects, " * 4, "n": i})
+    return messages
+
+
+class _Snapshot:
+    def __init__(self, path, data):
+        self.reference = _Document(None, path); self.exists = data is not None; self._data = data
+    def to_dict(self): return dict(self._data) if self._data is not None else None
+
+class _Document:
+    def __init__(self, db, path): self.db, self.path = db, path
+    def collection(self, name): return _Collection(self.db, f"{self.path}/{name}")
+
+class _Collection:
+    def __init__(self, db, path): self.db, self.path = db, path; self.order = None; self.filters = []
+    def document(self, doc_id): return _Document(self.db, f"{self.path}/{doc_id}")
+    def order_by(self, field, direction="ASCENDING"): self.order = (field, direction); return self
+    def where(self, filter): self.filters.append(filter); return self
+    def stream(self):
+        docs = [data for data in self.db.collections.get(self.path, []) if all(f.op_string == ">=" and data.get(f.field_path, -1) >= f.value for f in self.filters)]
+        if self.order: docs.sort(key=lambda d: d[self.order[0]], reverse=self.order[1] == "DESCENDING")
+        return [_Snapshot(None, d) for d in docs]
+
+class FakeFirestore:
+    """In-memory stand-in for the calls load_interview_state_from_firestore makes."""
+    def __init__(self): self.documents = {}; self.collections = {}
+    def collection(self, name): return _Collection(self, name)
+    def get_all(self, refs): return [_Snapshot(ref.path, self.documents.get(ref.path)) for ref in refs]
+
+def fake_interview(username, messages, storage, checkpoint=False):
+    db = FakeFirestore(); conversation = [m for m in messages if m["role"] != "system"]
+    state = {"current_stage": config.INTERVIEW_STAGE, "message_storage": storage, "consent_given": True, "welcome_shown": True}
+    if checkpoint and len(conversation) > config.COMPACTION_TAIL_MESSAGES:
+        state["compaction_checkpoint"] = {"through": conversation[-config.COMPACTION_TAIL_MESSAGES]["n"], "note": "...", "note_tokens": 10}
+    db.documents[f"interviews/{username}"] = state
+    db.documents[f"interviews/{username}/blobs/state"] = {"partial_ai_transcript_formatted": ""}
+    if storage == "segments":
+        for seq, start in enumerate(range(0, len(conversation), config.SEGMENT_MAX_MESSAGES)):
+            chunk = [{"role": m["role"], "content": m["content"], "n": m["n"], "ts": 0.0} for m in conversation[start:start + config.SEGMENT_MAX_MESSAGES]]
+            db.collections.setdefault(f"interviews/{username}/message_segments", []).append({"seq": seq, "first_n": chunk[0]["n"], "payload": utils.encode_segment(chunk)})
+    else:
+        db.collections[f"interviews/{username}/messages"] = [{"role": m["role"], "content": m["content"], "n": m["n"], "timestamp": m["n"], "token_count": 60} for m in conversation]
+    return db
+
+
+# --- Measurement ---
+def measure(fn, repeat=7):
+    """Median / min seconds per call over `repeat` repeats of an auto-ranged loop (~0.2 s each)."""
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    runs = sorted(t / number for t in timer.repeat(repeat=repeat, number=number))
+    return {"median_us": round(runs[len(runs) // 2] * 1e6, 2), "min_us": round(runs[0] * 1e6, 2), "loops": number}
+
+def calibration():
+    """Fixed pure-Python work (dicts, strings, sorting) like the cases, timed as the unit of machine speed."""
+    rows = [{"role": "user", "content": word, "n": i} for i, word in enumerate(CALIBRATION_WORDS)]
+    return len("\n".join(row["content"].upper() for row in sorted(rows, key=lambda row: -row["n"])))
+
+def measure_relative(fn):
+    """measure(fn) plus the calibration loop timed just before it; "relative" = case / calibration."""
+    calibration_us = measure(calibration, repeat=3)["min_us"]; result = measure(fn)
+    return {**result, "calibration_us": calibration_us, "relative": round(result["min_us"] / calibration_us, 5)}
+
+def machine_fingerprint():
+    cpu = ""
+    try:
+        with open("/proc/cpuinfo", encoding="utf-8") as f: cpu = next((line.split(":", 1)[1].strip() for line in f if line.startswith("model name")), "")
+    except OSError: pass
+    return {"python": platform.python_version(), "machine": platform.machine(), "cpu": cpu or platform.processor(), "cpus": os.cpu_count()}
+
+def cases():
+    """{case name: zero-argument callable}"""
+    study = studies.get_study(studies.DEFAULT_STUDY_ID)
+    reply = "Thank you for sharing that. " * 20 + CLOSING_CODE
+    stream_prefixes = [reply[:i] for i in range(4, len(reply) + 4, 4)] # What show_partial_reply sees, chunk by chunk
+    selected = {
+        "parse_outline_questions": lambda: studies.parse_outline_questions(config.INTERVIEW_OUTLINE),
+        "labelled_questions": lambda: scripted_turns.labelled_questions(config.INTERVIEW_OUTLINE),
+        "detect_closing_code_stream": lambda: [utils.detect_closing_code(prefix) for prefix in stream_prefixes],
+    }
+    for size in SIZES:
+        messages = synthetic_messages(size, study); transcript = utils.format_transcript_for_gsheet(messages)
+        selected[f"format_transcript_for_gsheet[{size}]"] = lambda m=messages: utils.format_transcript_for_gsheet(m)
+        selected[f"split_transcript_for_sheet[{size}]"] = lambda t=transcript: utils.split_transcript_for_sheet(t)
+        selected[f"find_last_ai_part_completed[{size}]"] = lambda m=messages: utils.find_last_ai_part_completed(m, study["manual_questions_map"])
+        for storage, checkpoint in (("documents", False), ("segments", False), ("documents", True)):
+            db = fake_interview("bench_user", messages, storage, checkpoint)
+            name = f"load_interview_state[{storage}{'+checkpoint' if checkpoint else ''},{size}]"
+            selected[name] = lambda db=db: utils.load_interview_state_from_firestore("bench_user")
+            selected[name].db = db
+    return selected
+
+def run(names=None):
+    results = {}; original_client = utils.get_firestore_client
+    try:
+        for name, fn in cases().items():
+            if names is not None and name not in names: continue
+            utils.get_firestore_client = (lambda db=fn.db: db) if hasattr(fn, "db") else original_client
+            results[name] = measure_relative(fn)
+            print(f"INFO: {name:<55} {results[name]['median_us']:>12.2f} us  ({results[name]['relative']:.3f}x calibration)")
+    finally: utils.get_firestore_client = original_client
+    return results
+
+def slowdowns(results, baseline, threshold):
+    """{case: ratio} for cases whose calibrated time is more than `threshold` times the baseline's."""
+    ratios = {name: result["relative"] / max(baseline[name]["relative"], 1e-9) for name, result in results.items() if "relative" in baseline.get(name, {})}
+    return {name: ratio for name, ratio in ratios.items() if ratio > threshold}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for utils.py hot functions.")
+    parser.add_argument("--save", action="store_true", help="Store the results as the new baseline")
+    parser.add_argument("--baseline", default=RESULTS_FILE)
+    parser.add_argument("--threshold", type=float, default=1.5, help="Slowdown factor (calibrated fastest repeat) reported as a regression")
+    parser.add_argument("--confirm", type=int, default=2, help="Re-measurements of a slow case before it counts as a regression")
+    args = parser.parse_args()
+    results = run()
+    if args.save:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        report = {"benchmark": "utils_hot_paths", "created_unix": time.time(), "python": platform.python_version(), "machine": machine_fingerprint(), "results": results}
+        with open(args.baseline, "w", encoding="utf-8") as f: json.dump(report, f, indent=2); f.write("\n")
+        print(f"INFO: Wrote baseline {args.baseline}"); return 0
+    if not os.path.exists(args.baseline):
+        print(f"Warning: No baseline at {args.baseline}; run with --save first."); return 0
+    with open(args.baseline, encoding="utf-8") as f: report = json.load(f)
+    baseline = report["results"]; same_machine = report.get("machine") == machine_fingerprint()
+    slow = slowdowns(results, baseline, args.threshold)
+    for _ in range(args.confirm): # Noise rarely repeats; a real regression does
+        if not slow: break
+        print(f"INFO: Re-measuring {len(slow)} slow case(s)")
+        slow = {name: min(ratio, slowdowns(run(slow), baseline, args.threshold).get(name, 0)) for name, ratio in slow.items()}
+        slow = {name: ratio for name, ratio in slow.items() if ratio > args.threshold}
+    for name, ratio in slow.items():
+        print(f"{'ERROR' if same_machine else 'Warning'}: {name} is {ratio:.2f}x slower than the baseline (calibrated; {baseline[name]['min_us']} -> {results[name]['min_us']} us)")
+    if not same_machine: print(f"Warning: Baseline was stored on another machine ({report.get('machine')}); not failing. Run with --save here for a gate.")
+    print(f"INFO: {len(results)} cases, {len(slow)} regressions (threshold {args.threshold}x).")
+    return 1 if slow and same_machine else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
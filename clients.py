@@ -0,0 +1,172 @@
+# clients.py (Process-wide Google/OpenAI clients: warm-up, token refresh, pooled connections, health)
+# startup.py builds all clients and opens their connections with a cheap request (in parallel) when
+# the process starts, then calls start(), which keeps OAuth tokens fresh and connections alive, so
+# the first participant after a dyno restart/idle does not pay for TLS handshakes and token fetches.
+import calendar
+import functools
+import json
+import os
+import socket
+import threading
+import time
+
+import requests
+import gspread
+from google.auth.transport.requests import AuthorizedSession, Request
+from google.oauth2.service_account import Credentials as ServiceAccountCredentials
+from google.cloud import firestore
+
+import config
+import eventlog
+
+GSHEET_SCOPES = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
+CLIENT_NAMES = ("firestore", "gsheet", "openai")
+
+_lock = threading.Lock()
+_clients = {} # name -> client
+_credentials = {} # name -> google credentials (refreshed in the background)
+_health = {name: {"status": "pending", "latency_ms": None, "last_checked_unix": None, "error": None} for name in CLIENT_NAMES}
+_build_locks = {name: threading.Lock() for name in CLIENT_NAMES}
+_maintenance_thread = None
+_readiness = None # Callable returning the startup readiness state (set by startup.py)
+
+
+# --- Client Construction ---
+@functools.lru_cache(maxsize=1)
+def _parsed_google_creds(creds_json_str):
+    return json.loads(creds_json_str)
+
+def _google_creds_dict():
+    """Service account info from GOOGLE_CREDENTIALS_JSON, parsed once for all Google clients."""
+    creds_json_str = os.environ.get("GOOGLE_CREDENTIALS_JSON")
+    if not creds_json_str: raise RuntimeError("Environment variable 'GOOGLE_CREDENTIALS_JSON' not found.")
+    return _parsed_google_creds(creds_json_str)
+
+def _pooled_adapter():
+    return requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=config.HTTP_POOL_SIZE)
+
+def _build_firestore():
+    creds_dict = _google_creds_dict()
+    # Scoped up front: the client then uses this very object, so the background refresh keeps its token fresh
+    creds = ServiceAccountCredentials.from_service_account_info(creds_dict, scopes=firestore.Client.SCOPE)
+    _credentials["firestore"] = creds
+    # gRPC multiplexes concurrent calls over one channel, so there is no pool to size here
+    return firestore.Client(credentials=creds, project=creds_dict.get('project_id'))
+
+def _build_gsheet():
+    creds = ServiceAccountCredentials.from_service_account_info(_google_creds_dict(), scopes=GSHEET_SCOPES)
+    _credentials["gsheet"] = creds
+    session = AuthorizedSession(creds)
+    session.mount("https://", _pooled_adapter())
+    return gspread.authorize(creds, session=session)
+
+def _build_openai():
+    api_key = os.environ.get('API_KEY_OPENAI')
+    if not api_key: raise RuntimeError("Environment variable 'API_KEY_OPENAI' not found.")
+    import httpx
+    from openai import OpenAI
+    limits = httpx.Limits(max_connections=config.HTTP_POOL_SIZE, max_keepalive_connections=config.HTTP_POOL_SIZE, keepalive_expiry=config.CLIENT_KEEPALIVE_INTERVAL + 60)
+    return OpenAI(api_key=api_key, timeout=60.0, http_client=httpx.Client(limits=limits, timeout=60.0))
+
+_BUILDERS = {"firestore": _build_firestore, "gsheet": _build_gsheet, "openai": _build_openai}
+
+
+def get_client(name):
+    """Returns the shared client `name`, building it on first use (raises on failure)."""
+    client = _clients.get(name)
+    if client is not None: return client
+    with _build_locks[name]: # The warm-up thread and a script run may ask at the same time
+        client = _clients.get(name)
+        if client is None:
+            started = time.perf_counter()
+            try: client = _BUILDERS[name]()
+            except Exception as e:
+                _set_health(name, "error", error=str(e)); raise
+            _clients[name] = client
+            eventlog.info("client.initialized", client=name, init_ms=round((time.perf_counter() - started) * 1000))
+        return client
+
+
+_worksheets = {} # sheet name -> first worksheet (saves a Drive lookup per submission)
+
+def get_worksheet(sheet_name=None):
+    """First worksheet of spreadsheet `sheet_name` (config.GSHEET_NAME by default), opened once per process."""
+    sheet_name = sheet_name or config.GSHEET_NAME
+    worksheet = _worksheets.get(sheet_name)
+    if worksheet is None: worksheet = _worksheets[sheet_name] = get_client("gsheet").open(sheet_name).sheet1
+    return worksheet
+
+
+# --- Warm-Up Probes ---
+def _probe_firestore(db): db.collection('_test_connection').limit(1).get()
+def _probe_gsheet(gc):
+    get_worksheet(); gc.http_client.session.get("https://sheets.googleapis.com/$discovery/rest?version=v4", timeout=10) # Keeps a pooled connection open
+def _probe_openai(client): client.models.retrieve(config.MODEL)
+
+_PROBES = {"firestore": _probe_firestore, "gsheet": _probe_gsheet, "openai": _probe_openai}
+
+def _set_health(name, status, latency_ms=None, error=None):
+    with _lock:
+        _health[name] = {"status": status, "latency_ms": latency_ms, "last_checked_unix": time.time(), "error": error}
+
+def probe(name):
+    """Runs a cheap request on client `name` (opening/keeping its connection) and records the latency."""
+    started = time.perf_counter()
+    try:
+        _PROBES[name](get_client(name))
+        _set_health(name, "ok", latency_ms=round((time.perf_counter() - started) * 1000, 1))
+        return True
+    except Exception as e:
+        _set_health(name, "error", latency_ms=round((time.perf_counter() - started) * 1000, 1), error=str(e))
+        eventlog.warning("client.probe_failed", client=name, error=str(e))
+        return False
+
+def client_health():
+    """{name: {status, latency_ms, last_checked_unix, error, token_expires_in_s}} for the dashboard."""
+    with _lock: health = {name: dict(entry) for name, entry in _health.items()}
+    for name, creds in list(_credentials.items()):
+        health[name]["token_expires_in_s"] = round(_token_expires_in(creds)) if creds.expiry else None
+    return health
+
+
+HEALTH_COLLECTION = "client_health" # One document per dyno/host, read by dashboard.py
+
+def publish_health():
+    """Stores client_health() in client_health/{dyno} so the monitor (another process) can show it."""
+    try:
+        instance = os.environ.get("DYNO") or socket.gethostname()
+        health = {"clients": client_health(), "updated_unix": time.time()}
+        if _readiness: health["readiness"] = _readiness()
+        get_client("firestore").collection(HEALTH_COLLECTION).document(instance).set(health)
+    except Exception as e: eventlog.warning("client.health_publish_failed", error=str(e))
+
+
+# --- Background Maintenance ---
+def _token_expires_in(creds):
+    if not creds.expiry: return 0.0
+    return calendar.timegm(creds.expiry.utctimetuple()) - time.time() # google-auth uses naive UTC datetimes
+
+def _refresh_tokens():
+    """Refreshes Google OAuth tokens that expire within config.TOKEN_REFRESH_MARGIN seconds."""
+    for name, creds in list(_credentials.items()):
+        if creds.valid and _token_expires_in(creds) > config.TOKEN_REFRESH_MARGIN: continue
+        try: creds.refresh(Request()); eventlog.info("client.token_refreshed", client=name)
+        except Exception as e: eventlog.warning("client.token_refresh_failed", client=name, error=str(e))
+
+def _maintenance_loop():
+    _refresh_tokens(); publish_health()
+    while True:
+        time.sleep(config.CLIENT_KEEPALIVE_INTERVAL)
+        _refresh_tokens()
+        for name in CLIENT_NAMES:
+            if name in _clients: probe(name) # Keeps pooled connections from idling out
+        publish_health()
+
+def start(readiness=None):
+    """Starts maintenance once per process (after startup.py's warm-up); returns immediately."""
+    global _maintenance_thread, _readiness
+    with _lock:
+        if _maintenance_thread is not None: return
+        _readiness = readiness
+        _maintenance_thread = threading.Thread(target=_maintenance_loop, name="client-maintenance", daemon=True)
+        _maintenance_thread.start()
@@ -100,6 +100,8 @@ if st.session_state.username is None:
     if retrieved_username:
         print(f"Found username string in local storage: {retrieved_username}")
         st.session_state.username = retrieved_username
+        # Returning user: start the Firestore load now, it runs while the rest of the page is set up
+        st.session_state.resume_prefetch = utils.start_session_prefetch(retrieved_username)
     else:
         if username_from_storage is not None:
              print(f"Value found in local storage ({username_from_storage}) is not a valid username string or is null/empty. Generating new.")
@@ -136,7 +138,12 @@ def initialize_session_state_with_firestore(user_id):
         if key not in st.session_state: st.session_state[key] = default_value
     print("Initialized session state with default values.")
 
-    loaded_state, loaded_messages = utils.load_interview_state_from_firestore(user_id)
+    prefetch = st.session_state.pop("resume_prefetch", None)
+    try:
+        loaded_state, loaded_messages = prefetch.result(timeout=30) if prefetch else utils.load_interview_state_from_firestore(user_id)
+    except Exception as e:
+        print(f"Resume prefetch failed for {user_id}: {e}. Loading directly.")
+        loaded_state, loaded_messages = utils.load_interview_state_from_firestore(user_id)
     st.session_state.messages = loaded_messages
 
     if api == "openai":
@@ -198,9 +205,15 @@ if username is None:
     st.stop()
 
 if not st.session_state.get("session_initialized", False):
+    # Skeleton while the (already running) prefetch finishes; replaced by the real page in this same run
+    skeleton = st.empty()
+    with skeleton.container():
+        st.caption("Restoring your session...")
+        for avatar in (config.AVATAR_INTERVIEWER, config.AVATAR_RESPONDENT):
+            with st.chat_message("assistant" if avatar == config.AVATAR_INTERVIEWER else "user", avatar=avatar): st.markdown(":gray[░░░░░░░░░░░░░░░░░░░░░░░░]")
     initialize_session_state_with_firestore(username)
     determine_current_stage(username)
-    st.rerun() # Rerun once after initialization and stage determination
+    skeleton.empty() # No st.rerun(): state is complete, so the stage renders in this run
 
 
 # --- === Main Application Logic === ---
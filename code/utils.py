@@ -9,6 +9,7 @@ import gspread
 from google.oauth2.service_account import Credentials
 import config
 import random # For GSheet throttle sleep
+from concurrent.futures import ThreadPoolExecutor
 
 # --- NEW Firestore Imports ---
 from google.cloud import firestore
@@ -75,10 +76,15 @@ def save_interview_state_to_firestore(username, state_data):
         print(f"Error saving state to Firestore for user {username}: {e}")
         return False
 
-def load_interview_state_from_firestore(username):
-    """Loads interview state and messages from Firestore, ignoring obsolete keys."""
+def load_interview_state_from_firestore(username, raise_errors=False):
+    """Loads interview state and messages from Firestore, ignoring obsolete keys.
+
+    Errors are printed and an empty result returned, unless raise_errors=True (used by the resume
+    prefetch, whose caller then retries the load synchronously).
+    """
     db = get_firestore_client()
     if not db or not username:
+        if raise_errors: raise RuntimeError("Cannot load state, invalid input or DB client.")
         print("Error: Cannot load state, invalid input or DB client.")
         return {}, []
     loaded_state = {}
@@ -107,9 +113,24 @@ def load_interview_state_from_firestore(username):
              print(f"Loaded {len(loaded_messages)} messages from Firestore for user {username}")
         return loaded_state, loaded_messages
     except Exception as e:
+        if raise_errors: raise
         print(f"Error loading state/messages from Firestore for user {username}: {e}")
         return {}, []
 
+# --- Session Resume Prefetch ---
+@st.cache_resource
+def get_prefetch_executor():
+    """Shared worker pool for background Firestore loads (one per process)."""
+    return ThreadPoolExecutor(max_workers=8, thread_name_prefix="resume-prefetch")
+
+def start_session_prefetch(username):
+    """Starts loading the user's state and messages in the background; returns a Future of (state, messages).
+
+    A failed load raises from Future.result(), so the caller can fall back to a synchronous load.
+    """
+    get_firestore_client() # Create the cached client on the script thread, where st.error can still be shown
+    return get_prefetch_executor().submit(load_interview_state_from_firestore, username, raise_errors=True)
+
 # --- Interview Save (Formats Transcript for GSheet, Saves Timing Locally) ---
 def save_interview_data(
     username,
@@ -230,17 +251,26 @@ def save_survey_data_to_firestore(username, survey_responses, consent_given, for
         print(f"Error saving survey data to Firestore for user {username}: {e}")
         return False
 
+# --- GSpread Client (authorized once per process instead of per submission) ---
+@st.cache_resource
+def get_survey_worksheet(sheet_name="pilot_survey_results"):
+    """Authorizes gspread with a pooled keep-alive session and returns the first worksheet of `sheet_name`."""
+    from google.auth.transport.requests import AuthorizedSession
+    from requests.adapters import HTTPAdapter
+    scopes = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
+    creds = Credentials.from_service_account_info(st.secrets["connections"]["gsheets"], scopes=scopes)
+    session = AuthorizedSession(creds) # Refreshes the OAuth token itself when it expires
+    session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=20))
+    gc = gspread.authorize(creds, session=session)
+    print("GSpread client authorized.")
+    return gc.open(sheet_name).sheet1
+
 def save_survey_data_to_gsheet(username, survey_responses):
     """Saves survey responses (incl NIS, new sliders) and AI transcript to Google Sheets."""
     st.session_state["gsheet_save_successful"] = False
     try:
-        scopes = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
-        creds_dict = st.secrets["connections"]["gsheets"]
-        creds = Credentials.from_service_account_info(creds_dict, scopes=scopes)
-        gc = gspread.authorize(creds)
-
         sheet_name = "pilot_survey_results"
-        worksheet = gc.open(sheet_name).sheet1
+        worksheet = get_survey_worksheet(sheet_name)
         submission_time_utc = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
         consent_given = st.session_state.get("consent_given", "ERROR: Consent status missing")
 
@@ -0,0 +1,98 @@
+# compaction.py (Conversation checkpoints: covered outline parts, key answers and a digest of earlier turns)
+# Once the model context passes config.COMPACTION_CONTEXT_FRACTION of the study's context window (or,
+# if set, every config.COMPACTION_EVERY_TURNS respondent turns), utils.checkpoint_conversation condenses all
+# messages except the last ~COMPACTION_TAIL_MESSAGES into interviews/{user}.compaction_checkpoint.
+# The model then receives system prompt + checkpoint note + tail, and a resumed session loads the
+# checkpoint plus the messages after it, so prompt size and Firestore reads stay bounded however long
+# the interview ran. Conversation messages carry their position "n" (the system prompt has none).
+# Checkpoints are built from the outline without an LLM call, so they cannot fail or add latency.
+import time
+
+import config
+import scripted_turns
+import studies
+import token_counts
+
+QUESTION_CHARS = 150 # Per interviewer question in the digest
+ANSWER_CHARS = 300 # Per respondent answer in the digest / key answers
+
+
+# --- Message Numbers ---
+def number_messages(messages, start=0):
+    """Sets "n" on conversation messages that lack it; returns the next free number."""
+    n = start
+    for message in messages:
+        if message.get("role") == "system": continue
+        message.setdefault("n", n); n = message["n"] + 1
+    return n
+
+def next_number(messages):
+    """Number for the next appended message."""
+    for message in reversed(messages):
+        if "n" in message: return message["n"] + 1
+    return number_messages(messages)
+
+
+# --- Checkpoints ---
+def due(messages, checkpoint, context_tokens=0, context_window_tokens=0):
+    """True once the context passes COMPACTION_CONTEXT_FRACTION of the window, or COMPACTION_EVERY_TURNS
+    respondent turns were added since the last checkpoint."""
+    if config.COMPACTION_CONTEXT_FRACTION and context_window_tokens and context_tokens >= config.COMPACTION_CONTEXT_FRACTION * context_window_tokens: return True
+    if not config.COMPACTION_EVERY_TURNS: return False
+    since = checkpoint["message_count"] if checkpoint else 0; turns = 0
+    for message in reversed(messages):
+        if message.get("role") == "system" or message.get("n", 0) < since: break
+        if message.get("role") == "user": turns += 1
+    return turns >= config.COMPACTION_EVERY_TURNS
+
+def _clip(text, limit):
+    text = " ".join((text or "").split())
+    return text if len(text) <= limit else text[:limit - 3].rstrip() + "..."
+
+def _note(covered_parts, key_answers, summary):
+    lines = ["Condensed record of the earlier part of this interview (the later messages follow verbatim).",
+             f"Outline parts already covered: {', '.join(covered_parts) or 'none'}."]
+    if key_answers: lines += ["Key answers:"] + [f"- {label}: {answer}" for label, answer in key_answers.items()]
+    if summary: lines += ["Earlier exchanges:", summary]
+    return "\n".join(lines)
+
+def build_checkpoint(messages, study, previous=None):
+    """Checkpoint covering everything before the tail (which starts at an interviewer question), or None."""
+    conversation = [m for m in messages if m.get("role") != "system"]
+    cut = len(conversation) - config.COMPACTION_TAIL_MESSAGES
+    while cut > 0 and conversation[cut].get("role") != "assistant": cut -= 1
+    since = previous["through"] if previous else 0
+    if cut <= 0 or conversation[cut]["n"] <= since: return None
+    covered = [m for m in conversation[:cut] if m["n"] >= since]
+
+    parts = set(previous["covered_parts"]) if previous else set()
+    questions_text = [m.get("content", "") for m in covered if m.get("role") == "assistant"]
+    for part_key, part_questions in study["manual_questions_map"].items():
+        if any(scripted_turns.was_asked(q["text"], text) for q in part_questions for text in questions_text): parts.add(part_key)
+    covered_parts = [part_key for part_key in studies.PART_KEY_SEQUENCE if part_key in parts]
+
+    key_answers = dict(previous["key_answers"]) if previous else {}; lines = []
+    for question, answer in zip(covered, covered[1:]):
+        if question.get("role") != "assistant" or answer.get("role") != "user": continue
+        label = next((label for label, text in study["outline_questions"].items() if label not in key_answers and scripted_turns.was_asked(text, question["content"])), None)
+        if label: key_answers[label] = _clip(answer["content"], ANSWER_CHARS); continue # Outline question: kept under its label
+        lines.append(f"Q: {_clip(question['content'], QUESTION_CHARS)}\nA: {_clip(answer['content'], ANSWER_CHARS)}")
+    summary = "\n".join(filter(None, [previous["summary"] if previous else "", *lines]))
+    if len(summary) > config.COMPACTION_SUMMARY_CHARS: # Oldest exchanges go first; key answers stay
+        start = summary.find("\nQ: ", len(summary) - config.COMPACTION_SUMMARY_CHARS)
+        summary = summary[start + 1:] if start >= 0 else summary[-config.COMPACTION_SUMMARY_CHARS:]
+
+    note = _note(covered_parts, key_answers, summary)
+    return {
+        "through": conversation[cut]["n"], "message_count": conversation[-1]["n"] + 1,
+        "covered_parts": covered_parts, "key_answers": key_answers, "summary": summary,
+        "note": note, "note_tokens": token_counts.count_text_tokens(note, study["model"]) + token_counts.MESSAGE_OVERHEAD_TOKENS,
+        "study_version": study["version"], "created_unix": time.time(),
+    }
+
+def context_messages(messages, checkpoint):
+    """Messages for the model: system prompt, checkpoint note and the messages from checkpoint["through"] on."""
+    if not checkpoint: return messages
+    system = [m for m in messages[:1] if m.get("role") == "system"]
+    note = {"role": "system", "content": checkpoint["note"], "token_count": checkpoint["note_tokens"]}
+    return system + [note] + [m for m in messages if m.get("role") != "system" and m.get("n", 0) >= checkpoint["through"]]
@@ -111,6 +111,65 @@ MODEL = "gpt-4o-mini-2024-07-18"
 TEMPERATURE = 0.3 # Make AI more focused, less creative (adjust 0.2-0.5 if needed)
 # --- END TEMPERATURE CHANGE ---
 MAX_OUTPUT_TOKENS = 2048
+CONTEXT_WINDOW_TOKENS = 128000 # Model context limit used for budgeting (gpt-4o-mini: 128k)
+
+# Streaming latency budget per interview turn (seconds)
+FIRST_TOKEN_TIMEOUT = 15.0 # No token yet -> abort and retry
+STREAM_STALL_TIMEOUT = 8.0 # Gap between tokens -> abort and resume from the partial reply
+TURN_DEADLINE = 45.0 # Hard cap for all attempts of one turn
+STREAM_MAX_ATTEMPTS = 2
+PARTIAL_CHECKPOINT_CHARS = 300 # Checkpoint the in-flight reply to Firestore every N new characters
+WRITE_BEHIND_INTERVAL = 0.5 # Seconds the write-behind store waits to coalesce state updates
+WRITE_BEHIND_MAX_ATTEMPTS = 5 # Flushes of a failed write-behind update before it is dropped (and logged)
+# Conversation checkpoints (see compaction.py): the model sees system prompt + checkpoint + recent tail
+COMPACTION_CONTEXT_FRACTION = 0.5 # Checkpoint once the model context exceeds this share of context_window_tokens (0 disables)
+COMPACTION_EVERY_TURNS = 0 # Additionally checkpoint every N respondent turns (0 disables)
+COMPACTION_TAIL_MESSAGES = 8 # Recent messages kept verbatim after the checkpoint
+COMPACTION_SUMMARY_CHARS = 4000 # Digest of earlier exchanges kept in a checkpoint (oldest dropped first)
+CHAT_FRAGMENT = True # Interview chat as an st.fragment: a turn reruns only the chat panel, not the whole script
+# Event log (see eventlog.py)
+EVENT_LOG_LEVEL = "INFO" # "DEBUG" adds per-rerun / credential events
+EVENT_LOG_FORMAT = "json" # "json" (log drain) or "text" (local development)
+EVENT_SAMPLE_RATES = { # Fraction of INFO/DEBUG events kept; unlisted events are always kept
+    "turn.context": 0.25,
+    "llm_stream.request": 0.25,
+    "session.rerun_fallback": 0.1,
+}
+# Session profiler (see profiler.py; enabled per session by ?profile=<PROFILE_KEY> or the PROFILE_SESSIONS env var)
+PROFILE_SAMPLE_INTERVAL = 0.005 # Seconds between stack samples of a profiled run
+PROFILE_TOP_FUNCTIONS = 25 # Functions kept per stage in the report
+
+# Scripted turns: outline questions sent verbatim without an LLM call (see scripted_turns.py).
+# Off by default; a study opts in with "scripted_intro" / "scripted_turns" in its definition (see README).
+# "after"/"ask" are outline labels; the scripted question is only used if the answer has >= min_words
+# and none of the probe_keywords.
+SCRIPTED_INTRO = False # Opening message = the outline's "Begin the interview with" question
+SCRIPTED_TURNS = [] # Rules: {"after", "ask" | "emit_code", "min_words", "probe_keywords", "reply_pattern"}
+
+# Survey result sinks written concurrently on submit (see sinks.py); optional: "json", "csv", "parquet"
+SURVEY_SINKS = ["gsheet", "firestore"]
+
+# Shared API clients (see clients.py)
+HTTP_POOL_SIZE = 20 # Keep-alive connections per HTTP client; roughly the expected concurrent participants per dyno
+TOKEN_REFRESH_MARGIN = 300 # Refresh Google OAuth tokens this many seconds before they expire
+CLIENT_KEEPALIVE_INTERVAL = 240 # Seconds between background token checks / connection probes
+STARTUP_CHECK_TIMEOUT = 10.0 # Seconds each client may take to build and answer its probe at process start
+GSHEET_NAME = "pilot_survey_results"
+
+# Firestore message storage for new interviews: "documents" (one document per message) or
+# "segments" (zlib-compressed chunks of messages, see utils.save_message_to_firestore)
+MESSAGE_STORAGE_FORMAT = "documents"
+SEGMENT_MAX_MESSAGES = 50
+SEGMENT_MAX_BYTES = 500_000 # Uncompressed JSON per segment; Firestore documents are capped at 1 MiB
+
+
+# Interview stages (shared by app.py, utils.py and the analytics tooling)
+WELCOME_STAGE = "welcome"
+INTERVIEW_STAGE = "interview"
+MANUAL_INTERVIEW_STAGE = "manual_interview"
+SURVEY_STAGE = "survey"
+COMPLETED_STAGE = "completed"
+STAGES = [WELCOME_STAGE, INTERVIEW_STAGE, MANUAL_INTERVIEW_STAGE, SURVEY_STAGE, COMPLETED_STAGE]
 
 
 # Display login screen
@@ -123,6 +182,7 @@ TRANSCRIPTS_DIRECTORY = f"{DATA_BASE_DIR}/transcripts/"
 TIMES_DIRECTORY = f"{DATA_BASE_DIR}/times/"
 BACKUPS_DIRECTORY = f"{DATA_BASE_DIR}/backups/"
 SURVEY_DIRECTORY = f"{DATA_BASE_DIR}/survey/" # For post-interview survey data
+PROFILE_DIRECTORY = f"{DATA_BASE_DIR}/profiles/" # Session profiles (see profiler.py)
 
 
 # Avatars displayed in the chat interface
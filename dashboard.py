@@ -0,0 +1,88 @@
+# dashboard.py (Live study monitor - run separately with: streamlit run dashboard.py)
+# Access requires ?key=<ADMIN_DASHBOARD_KEY> when the ADMIN_DASHBOARD_KEY env var is set.
+import os
+import time
+
+import pandas as pd
+import streamlit as st
+
+import clients
+import config
+import profiler
+import utils
+
+st.set_page_config(page_title="Interview Monitor")
+
+# --- Access Check ---
+admin_key = os.environ.get("ADMIN_DASHBOARD_KEY")
+if admin_key and st.query_params.get("key") != admin_key:
+    st.error("Not authorized."); st.stop()
+
+# --- Stage Counters (cached briefly so refreshes stay at a handful of reads) ---
+@st.cache_data(ttl=15)
+def load_stage_counts():
+    return utils.get_stage_counts(), time.time()
+
+@st.cache_data(ttl=15)
+def load_duplicate_report():
+    return utils.get_duplicate_submission_report()
+
+@st.cache_data(ttl=15)
+def load_session_profiles():
+    db = utils.get_firestore_client()
+    if not db: return {}
+    return {doc.id: doc.to_dict() or {} for doc in db.collection(profiler.PROFILE_COLLECTION).stream()}
+
+@st.cache_data(ttl=15)
+def load_client_health():
+    db = utils.get_firestore_client()
+    if not db: return []
+    return [{"instance": doc.id, **(doc.to_dict() or {})} for doc in db.collection(clients.HEALTH_COLLECTION).stream()]
+
+st.title("Interview Monitor")
+if st.button("Refresh"): load_stage_counts.clear(); load_client_health.clear(); load_duplicate_report.clear(); load_session_profiles.clear()
+counts, fetched_at = load_stage_counts()
+if not counts:
+    st.warning("Stage counters unavailable (check Firestore credentials)."); st.stop()
+
+stage_labels = {
+    config.WELCOME_STAGE: "Welcome / consent", config.INTERVIEW_STAGE: "AI interview",
+    config.MANUAL_INTERVIEW_STAGE: "Manual fallback", config.SURVEY_STAGE: "Survey", config.COMPLETED_STAGE: "Completed",
+}
+counts_df = pd.DataFrame([{"stage": stage_labels.get(stage, stage), "users": counts.get(stage, 0)} for stage in config.STAGES])
+total = int(counts_df["users"].sum())
+
+cols = st.columns(len(config.STAGES))
+for col, row in zip(cols, counts_df.itertuples()): col.metric(row.stage, row.users)
+st.bar_chart(counts_df.set_index("stage"))
+in_progress = total - counts.get(config.COMPLETED_STAGE, 0)
+st.caption(f"{total} users tracked, {in_progress} not yet completed. Counts as of {time.strftime('%H:%M:%S UTC', time.gmtime(fetched_at))} ({utils.STAGE_COUNTER_SHARDS} shard reads).")
+duplicates = load_duplicate_report().get("total")
+if duplicates is not None: st.caption(f"Duplicate survey submissions suppressed: {duplicates}")
+
+# --- API Client Health (published by each app process every CLIENT_KEEPALIVE_INTERVAL seconds) ---
+st.subheader("API clients")
+health_rows = [
+    {"instance": entry["instance"], "client": name, "status": info.get("status"), "latency_ms": info.get("latency_ms"),
+     "token_expires_in_s": info.get("token_expires_in_s"), "age_s": round(time.time() - entry.get("updated_unix", 0)), "error": info.get("error")}
+    for entry in load_client_health() for name, info in (entry.get("clients") or {}).items()
+]
+if health_rows: st.dataframe(pd.DataFrame(health_rows), hide_index=True)
+else: st.caption("No client health reported yet.")
+startup_rows = [
+    {"instance": entry["instance"], "readiness": entry["readiness"].get("status"), "startup_ms": entry["readiness"].get("startup_ms"),
+     "failed": ", ".join(name for name, check in (entry["readiness"].get("checks") or {}).items() if not check.get("ok"))}
+    for entry in load_client_health() if entry.get("readiness")
+]
+if startup_rows: st.caption("Startup checks (parallel, per process)"); st.dataframe(pd.DataFrame(startup_rows), hide_index=True)
+
+# --- Session Profiles (sessions opened with ?profile=<PROFILE_KEY> or listed in PROFILE_SESSIONS) ---
+profiles = load_session_profiles()
+if profiles:
+    st.subheader("Session profiles")
+    profiled_user = st.selectbox("User ID", sorted(profiles, key=lambda name: -profiles[name].get("updated_unix", 0)))
+    for stage, entry in (profiles[profiled_user].get("stages") or {}).items():
+        st.markdown(f"**{stage}**: {entry.get('runs')} runs, {entry.get('sampled_ms')} ms sampled")
+        self_col, total_col = st.columns(2)
+        self_col.caption("Self time"); self_col.dataframe(pd.DataFrame(entry.get("self") or []), hide_index=True)
+        total_col.caption("Cumulative (repo code)"); total_col.dataframe(pd.DataFrame(entry.get("total") or []), hide_index=True)
@@ -0,0 +1,78 @@
+# eventlog.py (Structured, leveled event log with per-event sampling and a non-blocking queue handler)
+# eventlog.info("turn.context", context_tokens=812) writes one line per event to stdout (Heroku log drain):
+#   {"ts": 1760870000.123, "level": "INFO", "event": "turn.context", "username": "user_ab12", "turn": 7, "context_tokens": 812}
+# Calls only put the record on a queue; one listener thread per process formats and writes it, so a
+# script run never waits on stdout. username / turn come from bind() (called at the top of each script
+# run, which Streamlit executes on its own thread) or are passed explicitly from worker threads.
+# Events listed in config.EVENT_SAMPLE_RATES are kept with that probability (the record then carries
+# "sample_rate" so counts can be re-weighted); warnings and errors are never sampled out.
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import threading
+
+import config
+
+_context = contextvars.ContextVar("eventlog_context", default={})
+_logger = logging.getLogger("interview.events")
+_listener = None
+_listener_lock = threading.Lock()
+
+
+# --- Formatting ---
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line."""
+    def format(self, record):
+        entry = {"ts": round(record.created, 3), "level": record.levelname, "event": record.event}
+        entry.update(record.fields)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class TextFormatter(logging.Formatter):
+    """LEVEL event key=value ... (local development)."""
+    def format(self, record):
+        return f"{record.levelname}: {record.event} " + " ".join(f"{k}={v}" for k, v in record.fields.items())
+
+def _start():
+    global _listener
+    with _listener_lock:
+        if _listener: return
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(TextFormatter() if config.EVENT_LOG_FORMAT == "text" else JsonFormatter())
+        log_queue = queue.SimpleQueue()
+        _logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        _logger.setLevel(config.EVENT_LOG_LEVEL); _logger.propagate = False
+        _listener = logging.handlers.QueueListener(log_queue, handler)
+        _listener.start(); atexit.register(_listener.stop) # Drains queued events on shutdown
+
+
+# --- API ---
+def bind(**fields):
+    """Sets correlation fields (username, turn) for the rest of the current script run / thread.
+
+    Returns a token; reset(token) restores the fields bound before (use it in a finally block).
+    """
+    return _context.set({**_context.get(), **fields})
+
+def reset(token):
+    """Undoes the bind() that returned `token`."""
+    _context.reset(token)
+
+def event(name, level=logging.INFO, **fields):
+    """Logs `name` with the bound context and `fields`, subject to level and sampling."""
+    if not _listener: _start()
+    if not _logger.isEnabledFor(level): return
+    rate = config.EVENT_SAMPLE_RATES.get(name, 1.0) if level < logging.WARNING else 1.0
+    if rate < 1.0:
+        if random.random() >= rate: return
+        fields["sample_rate"] = rate
+    _logger.log(level, name, extra={"event": name, "fields": {**_context.get(), **fields}})
+
+def debug(name, **fields): event(name, logging.DEBUG, **fields)
+def info(name, **fields): event(name, logging.INFO, **fields)
+def warning(name, **fields): event(name, logging.WARNING, **fields)
+def error(name, **fields): event(name, logging.ERROR, **fields)
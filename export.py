@@ -0,0 +1,249 @@
+# export.py (Bulk export of Firestore interviews to Parquet)
+# Usage: python export.py --out data/export            (incremental since last watermark)
+#        python export.py --out data/export --full     (ignore watermark, export everything)
+# An interrupted run leaves export_state.json behind and is resumed automatically on the next call.
+import argparse
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import pandas as pd
+from google.cloud import firestore
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+import state_schema
+import utils # Reuses get_firestore_client (GOOGLE_CREDENTIALS_JSON)
+
+# --- Export Settings ---
+DEFAULT_EXPORT_DIR = "data/export"
+DEFAULT_PAGE_SIZE = 300 # interviews/* documents per paginated query
+DEFAULT_WORKERS = 16 # parallel messages/* subcollection reads
+DEFAULT_FLUSH_EVERY = 500 # users per part file / checkpoint
+WATERMARK_FILE = "watermark.json"
+CHECKPOINT_FILE = "export_state.json"
+TABLES = ("sessions", "messages", "survey_responses")
+
+# Top-level state keys copied as-is into the sessions table
+SESSION_KEYS = [
+    "current_stage", "consent_given", "welcome_shown", "interview_active",
+    "interview_completed_flag", "survey_completed_flag", "manual_fallback_triggered",
+    "saved_to_gsheet_successfully", "start_time_unix", "study_id", "study_version",
+]
+
+
+# --- Watermark Handling ---
+def load_watermark(out_dir):
+    """Returns the last exported `last_updated` value as a datetime, or None."""
+    path = os.path.join(out_dir, WATERMARK_FILE)
+    if not os.path.exists(path): return None
+    try:
+        with open(path, "r", encoding="utf-8") as f: data = json.load(f)
+        return datetime.fromisoformat(data["last_updated"]) if data.get("last_updated") else None
+    except Exception as e:
+        print(f"Warning: Could not read export watermark {path}: {e}. Running full export.")
+        return None
+
+def save_watermark(out_dir, last_updated, run_id):
+    """Persists the newest exported `last_updated` value for the next incremental run."""
+    path = os.path.join(out_dir, WATERMARK_FILE)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"last_updated": last_updated.isoformat(), "run_id": run_id, "exported_at_unix": time.time()}, f, indent=4)
+
+
+# --- Firestore Reads ---
+def iter_interview_pages(db, since=None, page_size=DEFAULT_PAGE_SIZE):
+    """Yields pages (lists of snapshots) of interviews/* ordered by last_updated, using cursor pagination."""
+    base_query = db.collection("interviews")
+    if since is not None:
+        base_query = base_query.where(filter=FieldFilter("last_updated", ">", since))
+    base_query = base_query.order_by("last_updated", direction=firestore.Query.ASCENDING).limit(page_size)
+    last_snapshot = None
+    while True:
+        query = base_query.start_after(last_snapshot) if last_snapshot is not None else base_query
+        page = list(query.stream())
+        if not page: return
+        yield page
+        if len(page) < page_size: return
+        last_snapshot = page[-1]
+
+def fetch_messages(db, username, message_storage=None):
+    """Reads one user's messages (per-message documents or compressed segments) in order."""
+    messages = utils.load_messages_from_firestore(db, username, message_storage)
+    for msg in messages:
+        if "ts" in msg: msg["timestamp"] = datetime.fromtimestamp(msg.pop("ts"), tz=timezone.utc)
+    return messages
+
+def fetch_user(db, username, message_storage=None):
+    """Messages plus the cold blobs (transcripts, survey blocks) of one user."""
+    blob_doc = state_schema.blob_ref(db.collection("interviews").document(username)).get()
+    return fetch_messages(db, username, message_storage), (blob_doc.to_dict() or {}) if blob_doc.exists else {}
+
+
+# --- Flattening ---
+def flatten_session(username, state, message_count, run_id):
+    """One sessions row per interviews/{username} document."""
+    row = {"username": username, "export_run": run_id, "last_updated": state.get("last_updated"), "message_count": message_count}
+    for key in SESSION_KEYS: row[key] = state.get(key)
+    timing = state.get("timing_data") or {}
+    for key in ("start_time_unix", "end_time_unix", "duration_seconds", "duration_minutes"):
+        row[f"timing_{key}"] = timing.get(key)
+    row["has_survey_data"] = "survey_data" in state
+    row["has_survey_backup_data"] = "survey_backup_data" in state
+    return row
+
+def flatten_messages(username, messages, run_id):
+    """One messages row per message, with its position in the transcript."""
+    return [
+        {"username": username, "export_run": run_id, "seq": seq, "role": msg.get("role"),
+         "content": msg.get("content"), "timestamp": msg.get("timestamp"), "scripted": bool(msg.get("scripted", False))}
+        for seq, msg in enumerate(messages)
+    ]
+
+def flatten_survey(username, state, run_id):
+    """One survey_responses row per survey_data / survey_backup_data block on the document."""
+    rows = []
+    for source in ("survey_data", "survey_backup_data"):
+        block = state.get(source)
+        if not isinstance(block, dict): continue
+        row = {
+            "username": username, "export_run": run_id, "source": source,
+            "submission_timestamp_unix": block.get("submission_timestamp_unix"),
+            "submission_time_utc": block.get("submission_time_utc"),
+            "consent_given": block.get("consent_given"),
+            "saved_to_gsheet_successfully": block.get("saved_to_gsheet_successfully"),
+        }
+        for key, value in (block.get("survey_responses") or {}).items(): row[key] = value
+        rows.append(row)
+    return rows
+
+
+# --- Checkpointing (resumable exports) ---
+def load_checkpoint(out_dir):
+    """Returns the state of an interrupted export run, or None."""
+    path = os.path.join(out_dir, CHECKPOINT_FILE)
+    if not os.path.exists(path): return None
+    try:
+        with open(path, "r", encoding="utf-8") as f: state = json.load(f)
+        for key in ("since", "cursor", "newest"):
+            state[key] = datetime.fromisoformat(state[key]) if state.get(key) else None
+        return state
+    except Exception as e:
+        print(f"Warning: Could not read export checkpoint {path}: {e}. Starting a new run.")
+        return None
+
+def save_checkpoint(out_dir, state):
+    """Atomically writes the run state after each flushed batch."""
+    path = os.path.join(out_dir, CHECKPOINT_FILE); tmp_path = path + ".tmp"
+    serializable = {k: (v.isoformat() if isinstance(v, datetime) else v) for k, v in state.items()}
+    with open(tmp_path, "w", encoding="utf-8") as f: json.dump(serializable, f, indent=4)
+    os.replace(tmp_path, path)
+
+def clear_checkpoint(out_dir):
+    path = os.path.join(out_dir, CHECKPOINT_FILE)
+    if os.path.exists(path): os.remove(path)
+
+
+# --- Parquet Output ---
+def write_table(out_dir, table, rows, part_name):
+    """Writes one part file (tables/part-<part_name>.parquet); readers concatenate parts."""
+    if not rows: return None
+    table_dir = os.path.join(out_dir, table)
+    os.makedirs(table_dir, exist_ok=True)
+    path = os.path.join(table_dir, f"part-{part_name}.parquet")
+    df = pd.DataFrame(rows)
+    for col in df.columns:
+        if df[col].dtype != object or col == "content": continue
+        types = set(df[col].dropna().map(type)) # Missing values do not count as a type
+        if types == {bool}: df[col] = df[col].astype("boolean") # Nullable booleans, e.g. consent_given
+        elif len(types) > 1: # Mixed-type columns (e.g. "Select..." vs numbers) must be stringified for Parquet
+            df[col] = df[col].map(lambda v: None if v is None or (isinstance(v, float) and math.isnan(v)) else str(v))
+    tmp_path = path + ".tmp"
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path) # A crash never leaves a half-written part behind
+    return path
+
+
+# --- Export Command ---
+def _flush_batch(out_dir, batch, state):
+    """Waits for a batch of fetches (in order), writes its part files and checkpoints the cursor."""
+    rows = {table: [] for table in TABLES}
+    newest = {snap.id: i for i, (snap, _) in enumerate(batch)} # Users updated mid-run can appear twice; the later snapshot is newer
+    for i, (snap, future) in enumerate(batch):
+        messages, blobs = future.result()
+        if newest[snap.id] != i: continue
+        data = snap.to_dict() or {}; data.update(blobs)
+        rows["sessions"].append(flatten_session(snap.id, data, len(messages), state["run_id"]))
+        rows["messages"].extend(flatten_messages(snap.id, messages, state["run_id"]))
+        rows["survey_responses"].extend(flatten_survey(snap.id, data, state["run_id"]))
+        last_updated = data.get("last_updated")
+        if last_updated is not None:
+            state["cursor"] = last_updated
+            if state["newest"] is None or last_updated > state["newest"]: state["newest"] = last_updated
+    part_name = f"{state['run_id']}-{state['parts']:05d}"
+    for table, table_rows in rows.items(): write_table(out_dir, table, table_rows, part_name)
+    state["parts"] += 1; state["users_done"] += len(batch)
+    save_checkpoint(out_dir, state)
+
+def export_interviews(out_dir=DEFAULT_EXPORT_DIR, full=False, page_size=DEFAULT_PAGE_SIZE, workers=DEFAULT_WORKERS, flush_every=DEFAULT_FLUSH_EVERY, resume=True):
+    """Streams interviews/* (and messages) changed since the watermark into Parquet tables.
+
+    Message subcollections are fetched by a bounded pool of worker threads. Every `flush_every`
+    users the results are written as part files and the cursor is checkpointed, so an interrupted
+    run continues where it stopped on the next invocation.
+    """
+    if not os.environ.get("GOOGLE_CREDENTIALS_JSON"):
+        print("ERROR: Environment variable 'GOOGLE_CREDENTIALS_JSON' not found."); return None
+    db = utils.get_firestore_client()
+    if not db:
+        print("ERROR: Cannot export, Firestore client unavailable."); return None
+    os.makedirs(out_dir, exist_ok=True)
+
+    state = load_checkpoint(out_dir) if resume else None
+    if state:
+        print(f"INFO: Resuming export run {state['run_id']} after {state['users_done']} users (cursor {state['cursor']}).")
+    else:
+        since = None if full else load_watermark(out_dir)
+        run_id = time.strftime("%Y%m%d_%H%M%S", time.gmtime()) + f"_{uuid.uuid4().hex[:6]}"
+        state = {"run_id": run_id, "since": since, "cursor": since, "newest": since, "parts": 0, "users_done": 0}
+        save_checkpoint(out_dir, state)
+        print(f"INFO: Export run {run_id} started ({'full' if since is None else f'since {since.isoformat()}'}).")
+
+    started = time.time(); users_this_session = state["users_done"]
+    in_flight = threading.BoundedSemaphore(workers * 2) # Caps queued fetches so memory stays flat
+    batch = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for page in iter_interview_pages(db, since=state["cursor"], page_size=page_size):
+            for snap in page:
+                in_flight.acquire()
+                future = pool.submit(fetch_user, db, snap.id, (snap.to_dict() or {}).get("message_storage"))
+                future.add_done_callback(lambda _f: in_flight.release())
+                batch.append((snap, future))
+                if len(batch) >= flush_every:
+                    _flush_batch(out_dir, batch, state); batch = []
+                    elapsed = time.time() - started; done = state["users_done"] - users_this_session
+                    print(f"INFO: {state['users_done']} users exported ({done / elapsed if elapsed else 0:.1f} users/s).")
+        if batch: _flush_batch(out_dir, batch, state)
+
+    elapsed = time.time() - started; done = state["users_done"] - users_this_session
+    throughput = done / elapsed if elapsed else 0.0
+    if state["newest"] is not None and state["users_done"]: save_watermark(out_dir, state["newest"], state["run_id"])
+    clear_checkpoint(out_dir)
+    print(f"INFO: Export run {state['run_id']} finished: {state['users_done']} users, {done} in this session in {elapsed:.1f}s ({throughput:.1f} users/s).")
+    return {"run_id": state["run_id"], "users": state["users_done"], "parts": state["parts"], "users_per_second": throughput}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export Firestore interviews to Parquet (sessions, messages, survey_responses).")
+    parser.add_argument("--out", default=DEFAULT_EXPORT_DIR, help="Output directory for Parquet tables and the watermark.")
+    parser.add_argument("--full", action="store_true", help="Ignore the last_updated watermark and export everything.")
+    parser.add_argument("--page-size", type=int, default=DEFAULT_PAGE_SIZE)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Number of parallel message fetchers.")
+    parser.add_argument("--flush-every", type=int, default=DEFAULT_FLUSH_EVERY, help="Users per part file and checkpoint.")
+    parser.add_argument("--restart", action="store_true", help="Discard an interrupted run's checkpoint instead of resuming it.")
+    args = parser.parse_args()
+    export_interviews(out_dir=args.out, full=args.full, page_size=args.page_size, workers=args.workers, flush_every=args.flush_every, resume=not args.restart)
@@ -0,0 +1,94 @@
+# llm_replay.py (Deterministic record/replay of LLM replies for tests, demos and regression runs)
+# LLM_REPLAY_MODE=off     live API calls (default)
+# LLM_REPLAY_MODE=record  live calls; every completed reply is stored with its chunk timing
+# LLM_REPLAY_MODE=replay  stored replies only, no network (a missing recording raises ReplayMiss)
+# LLM_REPLAY_MODE=auto    replay when a recording exists, otherwise call live and record
+# LLM_REPLAY_SPEED=0 replays instantly, 1 with the recorded timing, 10 ten times faster, ...
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+
+import eventlog
+
+REPLAY_MODE = os.environ.get("LLM_REPLAY_MODE", "off").lower()
+REPLAY_DIR = os.environ.get("LLM_REPLAY_DIR", "data/llm_replay")
+REPLAY_SPEED = float(os.environ.get("LLM_REPLAY_SPEED", "0"))
+FORMAT_VERSION = 1
+
+
+class ReplayMiss(LookupError):
+    """No recording exists for this (model, temperature, messages) in replay mode."""
+
+
+def replay_key(model, temperature, messages):
+    """Stable hash of the request; messages are reduced to role/content."""
+    payload = {"model": model, "temperature": temperature, "messages": [[m.get("role"), m.get("content")] for m in messages]}
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+def _recording_path(key):
+    return os.path.join(REPLAY_DIR, key[:2], f"{key}.json.gz")
+
+def load_recording(key):
+    path = _recording_path(key)
+    if not os.path.exists(path): return None
+    with gzip.open(path, "rt", encoding="utf-8") as f: return json.load(f)
+
+def save_recording(key, model, chunks):
+    """chunks: [[seconds since previous chunk (or request start), text], ...]"""
+    path = _recording_path(key); os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        json.dump({"v": FORMAT_VERSION, "model": model, "recorded_at_unix": time.time(), "chunks": chunks}, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+class _RecordingStream:
+    """Wraps live text deltas; stores them with inter-chunk timing once the reply is complete."""
+    def __init__(self, key, model, deltas):
+        self.key, self.model, self.deltas = key, model, iter(deltas)
+        self.chunks = []; self.last = time.monotonic(); self.saved = False
+
+    def __iter__(self): return self
+
+    def __next__(self):
+        try: text = next(self.deltas)
+        except StopIteration:
+            self.mark_complete(); raise
+        now = time.monotonic(); self.chunks.append([round(now - self.last, 4), text]); self.last = now
+        return text
+
+    def mark_complete(self):
+        """Called on natural end, or by the consumer when it stops early on a complete reply (closing code)."""
+        if self.saved: return
+        self.saved = True
+        try: save_recording(self.key, self.model, list(self.chunks))
+        except Exception as e: eventlog.warning("llm_replay.save_failed", key=self.key[:12], error=str(e))
+
+def _replay_deltas(recording, speed):
+    for delay, text in recording["chunks"]:
+        if speed > 0 and delay > 0: time.sleep(delay / speed)
+        yield text
+
+
+# --- Entry Points ---
+def open_text_stream(model, temperature, messages, start_live):
+    """Returns (deltas, close) like llm_stream's open_stream, served from / recorded to the replay store.
+
+    start_live() must start the real API stream and return (deltas, close).
+    """
+    if REPLAY_MODE == "off": return start_live()
+    key = replay_key(model, temperature, messages)
+    if REPLAY_MODE in ("replay", "auto"):
+        recording = load_recording(key)
+        if recording is not None: return _replay_deltas(recording, REPLAY_SPEED), lambda: None
+        if REPLAY_MODE == "replay": raise ReplayMiss(f"No LLM recording for request {key[:12]} in {REPLAY_DIR}.")
+    deltas, close = start_live()
+    return _RecordingStream(key, model, deltas), close
+
+def complete_text(model, temperature, messages, call_live):
+    """Non-streamed variant: call_live() returns the reply text."""
+    deltas, _close = open_text_stream(model, temperature, messages, lambda: (iter([call_live()]), lambda: None))
+    return "".join(deltas)
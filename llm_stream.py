@@ -0,0 +1,104 @@
+# llm_stream.py (Deadline-aware consumption of streamed LLM replies)
+import queue
+import threading
+import time
+
+import config
+import eventlog
+
+# Appended (API call only, never saved) when a stalled reply is resumed from its partial content
+CONTINUE_INSTRUCTION = "Your previous message was cut off. Continue it exactly where it stopped, without repeating any text and without commentary."
+
+
+class StreamTimeout(TimeoutError):
+    """Raised when a reply misses its first-token / stall budget on every attempt. Keeps the partial text."""
+    def __init__(self, message, partial_content=""):
+        super().__init__(message)
+        self.partial_content = partial_content
+
+
+# --- Provider Adapters (chunks -> text deltas) ---
+def openai_text_deltas(stream):
+    for chunk in stream:
+        if chunk.choices and len(chunk.choices) > 0:
+            delta = chunk.choices[0].delta
+            if delta and delta.content: yield delta.content
+
+def continuation_messages(messages, partial_content):
+    """OpenAI messages for resuming a reply that stalled after `partial_content`."""
+    if not partial_content: return messages
+    return messages + [{"role": "assistant", "content": partial_content}, {"role": "user", "content": CONTINUE_INSTRUCTION}]
+
+
+def _log_event(event, **fields):
+    """Default on_event: llm_stream.<event> in the event log (stalls and timeouts as warnings)."""
+    (eventlog.warning if event in ("stall", "timeout") else eventlog.info)(f"llm_stream.{event}", **fields)
+
+
+def _pump(deltas, out_queue, stop_event):
+    """Reader thread: moves text deltas into the queue so the consumer can wait with a timeout."""
+    try:
+        for text in deltas:
+            if stop_event.is_set(): break
+            out_queue.put(("text", text))
+        out_queue.put(("end", None))
+    except Exception as e:
+        out_queue.put(("error", e))
+
+
+# --- Consumer ---
+def consume_stream(open_stream, on_text=None, on_event=_log_event,
+                   first_token_timeout=None, stall_timeout=None, turn_deadline=None, max_attempts=None):
+    """Consumes a streamed reply within a latency budget and returns the full text.
+
+    open_stream(partial_content) must start a request and return (deltas, close), where deltas iterates
+    text pieces and close() aborts the underlying HTTP stream. On a first-token or inter-token timeout the
+    stream is aborted and re-opened with the partial content so far (at most `max_attempts` requests,
+    never past `turn_deadline`). on_text(full_text) is called after every delta; returning True stops early.
+    API errors raised by the stream propagate unchanged so existing retry/fallback handling still applies.
+    """
+    first_token_timeout = first_token_timeout or config.FIRST_TOKEN_TIMEOUT
+    stall_timeout = stall_timeout or config.STREAM_STALL_TIMEOUT
+    turn_deadline = turn_deadline or config.TURN_DEADLINE
+    max_attempts = max_attempts or config.STREAM_MAX_ATTEMPTS
+
+    turn_start = time.monotonic(); deadline = turn_start + turn_deadline
+    full_text = ""
+    for attempt in range(1, max_attempts + 1):
+        on_event("request", attempt=attempt, resumed_chars=len(full_text))
+        attempt_start = time.monotonic()
+        deltas, close = open_stream(full_text)
+        out_queue = queue.Queue(); stop_event = threading.Event()
+        threading.Thread(target=_pump, args=(deltas, out_queue, stop_event), daemon=True).start()
+        got_token = False; stopped_early = False; stalled = False
+        try:
+            while True:
+                budget = stall_timeout if got_token else first_token_timeout
+                wait = min(budget, deadline - time.monotonic())
+                try:
+                    kind, value = out_queue.get(timeout=max(wait, 0.0))
+                except queue.Empty:
+                    stalled = True
+                    on_event("stall", attempt=attempt, phase="inter_token" if got_token else "first_token",
+                             waited_s=round(time.monotonic() - attempt_start, 2), chars=len(full_text))
+                    break
+                if kind == "error": raise value
+                if kind == "end": break
+                if not got_token:
+                    got_token = True
+                    on_event("first_token", attempt=attempt, ttft_s=round(time.monotonic() - attempt_start, 3))
+                full_text += value
+                if on_text and on_text(full_text):
+                    stopped_early = True; break
+        finally:
+            if stopped_early and hasattr(deltas, "mark_complete"): deltas.mark_complete() # Reply is complete (see llm_replay)
+            if stalled or stopped_early:
+                stop_event.set()
+                try: close()
+                except Exception as close_err: eventlog.warning("llm_stream.close_failed", error=str(close_err))
+        if not stalled:
+            on_event("done", attempt=attempt, total_s=round(time.monotonic() - turn_start, 3), chars=len(full_text))
+            return full_text
+        if time.monotonic() >= deadline: break
+    on_event("timeout", attempts=attempt, total_s=round(time.monotonic() - turn_start, 3), chars=len(full_text))
+    raise StreamTimeout(f"LLM reply exceeded its latency budget after {attempt} attempt(s).", partial_content=full_text)
@@ -0,0 +1,27 @@
+# page_text.py (Welcome page and consent form text, verbatim)
+# Identical for every participant except for the User ID. Streamlit re-executes app.py on every rerun,
+# but an imported module runs once per process, so the text is split here into the static segments
+# around the ID; a run only joins them with the participant's ID (username.join(CONSENT_SEGMENTS)).
+
+WELCOME_SEGMENTS = """
+    Hi there, [...]
+    *(Your User ID for this session is: `{username}`)*
+    """.split("{username}")
+
+CONSENT_SEGMENTS = """
+**Study Title:** [...] \n
+**Researcher:** [...]
+[...]
+**3. Privacy, Anonymity, API Usage, and Logging:**
+*   [...] User ID: `{username}`.
+[...]
+*   **Research Data:** [...] linked to your **anonymized User ID** (`{username}`).
+[...]
+*   **Persistent Logging (Firestore):** To prevent data loss [...], your anonymized chat messages and session state are saved to a secure cloud database (Google Cloud Firestore) [...]. Data is linked only to your anonymized User ID (`{username}`). Final results are also sent to Google Sheets.
+[...]
+**5. Voluntary Participation and Withdrawal:**
+[...]
+*   If you have concerns [...], contact Janik Deutscher (janik.deutscher@upf.edu) with your User ID (`{username}`). [...]
+[...]
+*(Rest of consent form markdown)*
+    """.split("{username}")
@@ -0,0 +1,104 @@
+# profiler.py (Opt-in sampling profiler for single sessions: where did this respondent's rerun time go?)
+# A session is profiled when opened with ?profile=<PROFILE_KEY> (env var), or when its User ID is listed
+# in the PROFILE_SESSIONS env var (comma-separated; "all" profiles every session, for staging only).
+# While a profiled script run or chat fragment run executes, a sampler thread records the run thread's
+# stack every config.PROFILE_SAMPLE_INTERVAL seconds. Samples are aggregated per stage across reruns and
+# written to data/profiles/{username}.txt and to Firestore session_profiles/{username} (see dashboard.py).
+# Unprofiled sessions pay one session_state lookup per run.
+import os
+import sys
+import threading
+import time
+
+import clients
+import config
+import eventlog
+
+PROFILE_COLLECTION = "session_profiles"
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_lock = threading.Lock()
+_profiles = {} # username -> {stage: {"runs", "samples", "self": {function: samples}, "total": {function: samples}}}
+_active = {} # thread id -> frame of the run being sampled
+
+
+# --- Switch ---
+def enabled(username, query_value=None):
+    """True if this session should be profiled (query parameter matching PROFILE_KEY, or PROFILE_SESSIONS)."""
+    listed = {name.strip() for name in os.environ.get("PROFILE_SESSIONS", "").split(",") if name.strip()}
+    if "all" in listed or username in listed: return True
+    key = os.environ.get("PROFILE_KEY")
+    return bool(key) and query_value == key
+
+
+# --- Sampling ---
+def _label(code):
+    return f"{os.path.basename(code.co_filename)}:{code.co_firstlineno}({code.co_name})"
+
+def _stack(thread_id):
+    frame = sys._current_frames().get(thread_id); frames = []
+    while frame is not None: frames.append(frame); frame = frame.f_back
+    return frames
+
+def start(username, stage):
+    """Samples the calling thread until the calling script (or fragment function) returns."""
+    thread_id = threading.get_ident(); anchor = sys._getframe(1)
+    with _lock:
+        running = _active.get(thread_id)
+        if running is not None and running in _stack(thread_id): return False # Fragment called inside a sampled full run
+        _active[thread_id] = anchor
+    threading.Thread(target=_sample, args=(username, stage, thread_id, anchor), name="session-profiler", daemon=True).start()
+    return True
+
+def _sample(username, stage, thread_id, anchor):
+    self_counts, total_counts = {}, {}; samples = 0
+    try:
+        while True:
+            time.sleep(config.PROFILE_SAMPLE_INTERVAL) # First sample after start() returned
+            frames = _stack(thread_id)
+            if anchor not in frames: break # The run returned (or was stopped / rerun)
+            samples += 1; codes = [frame.f_code for frame in frames]
+            leaf = _label(codes[0]); self_counts[leaf] = self_counts.get(leaf, 0) + 1
+            for label in {_label(code) for code in codes if code.co_filename.startswith(REPO_DIR)}: # Cumulative: repo code only
+                total_counts[label] = total_counts.get(label, 0) + 1
+            del frames, codes
+    finally:
+        with _lock:
+            if _active.get(thread_id) is anchor: del _active[thread_id]
+        del anchor
+    _record(username, stage, samples, self_counts, total_counts)
+
+
+# --- Aggregation / Output ---
+def _record(username, stage, samples, self_counts, total_counts):
+    with _lock:
+        entry = _profiles.setdefault(username, {}).setdefault(stage, {"runs": 0, "samples": 0, "self": {}, "total": {}})
+        entry["runs"] += 1; entry["samples"] += samples
+        for key, counts in (("self", self_counts), ("total", total_counts)):
+            for label, n in counts.items(): entry[key][label] = entry[key].get(label, 0) + n
+        report = session_report(username)
+    eventlog.info("profile.run", username=username, stage=stage, sampled_ms=round(samples * config.PROFILE_SAMPLE_INTERVAL * 1000))
+    try:
+        os.makedirs(config.PROFILE_DIRECTORY, exist_ok=True)
+        with open(os.path.join(config.PROFILE_DIRECTORY, f"{username}.txt"), "w", encoding="utf-8") as f: f.write(format_report(username, report))
+    except Exception as e: eventlog.warning("profile.file_write_failed", username=username, error=str(e))
+    try: clients.get_client("firestore").collection(PROFILE_COLLECTION).document(username).set({"stages": report, "updated_unix": time.time()})
+    except Exception as e: eventlog.warning("profile.publish_failed", username=username, error=str(e))
+
+def _top(counts):
+    ms = config.PROFILE_SAMPLE_INTERVAL * 1000
+    return [{"function": label, "ms": round(n * ms, 1)} for label, n in sorted(counts.items(), key=lambda item: -item[1])[:config.PROFILE_TOP_FUNCTIONS]]
+
+def session_report(username):
+    """{stage: {runs, sampled_ms, self: [{function, ms}], total: [{function, ms}]}} for one profiled session."""
+    return {stage: {"runs": entry["runs"], "sampled_ms": round(entry["samples"] * config.PROFILE_SAMPLE_INTERVAL * 1000),
+                    "self": _top(entry["self"]), "total": _top(entry["total"])}
+            for stage, entry in _profiles.get(username, {}).items()}
+
+def format_report(username, report):
+    lines = [f"Session profile {username} (sampled every {config.PROFILE_SAMPLE_INTERVAL * 1000:g} ms), {time.strftime('%Y-%m-%d %H:%M:%S UTC', time.gmtime())}"]
+    for stage, entry in report.items():
+        lines += ["", f"== {stage}: {entry['runs']} runs, {entry['sampled_ms']} ms sampled", "-- self time (where the thread was)"]
+        lines += [f"{row['ms']:>10.1f} ms  {row['function']}" for row in entry["self"]]
+        lines += ["-- cumulative time (repo code)"] + [f"{row['ms']:>10.1f} ms  {row['function']}" for row in entry["total"]]
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,59 @@
+# scripted_turns.py (Fixed outline questions emitted without an LLM call)
+# Some turns of the outline are verbatim: the Framing Q always follows the intro, the Gap Q follows
+# the Comparison Q, and a 1-4 summary rating is always answered with the closing code. When the
+# previous assistant message was the trigger question and the respondent's answer needs no probe,
+# the next reply is taken from the outline directly. Anything else goes to the LLM as before.
+import re
+
+# Outline labels: **Begin the interview with:** '...' -> "Intro", **Ask (Gap Q):** '...' -> "Gap Q"
+_QUESTION_PATTERN = re.compile(r"\*\*(Begin the interview with|Ask Next|Ask)\s*(?:\(([^)\n]*)\))?\s*:\*\*\s*'(.*?)'(?=[ \t]*(?:\n|$))", re.DOTALL)
+_RATING_PATTERN = re.compile(r"add the text:\s*'(.*?)'(?=[ \t]*(?:\n|$))", re.DOTALL)
+# Questions contain apostrophes ("you're"), so a quote only closes a question at the end of its line
+MATCH_CHARS = 60 # Leading characters compared when recognising a question in an assistant message
+
+
+def labelled_questions(outline):
+    """{label: verbatim question} for every labelled question in the outline."""
+    questions = {}
+    for verb, label, text in _QUESTION_PATTERN.findall(outline):
+        label = "Intro" if verb == "Begin the interview with" else label.strip()
+        if label and label not in questions: questions[label] = text.strip()
+    rating_match = _RATING_PATTERN.search(outline)
+    if rating_match: questions["Summary rating"] = rating_match.group(1).strip()
+    return questions
+
+def compile_rules(outline, rules, closing_codes):
+    """Resolves rule labels against the outline; returns (compiled rules, problems)."""
+    questions = labelled_questions(outline); compiled = []; problems = []
+    for rule in rules or []:
+        after = questions.get(rule.get("after"))
+        ask = questions.get(rule["ask"]) if rule.get("ask") else None
+        code = rule.get("emit_code")
+        if after is None: problems.append(f"scripted turn trigger {rule.get('after')!r} not found in outline"); continue
+        if rule.get("ask") and ask is None: problems.append(f"scripted question {rule['ask']!r} not found in outline"); continue
+        if code and code not in closing_codes: problems.append(f"scripted turn emits unknown closing code {code!r}"); continue
+        compiled.append({
+            "name": f"{rule['after']} -> {rule.get('ask') or code}", "after": after, "reply": ask or code,
+            "min_words": int(rule.get("min_words", 0)), "probe_keywords": [k.lower() for k in rule.get("probe_keywords", [])],
+            "reply_pattern": rule.get("reply_pattern"),
+        })
+    return compiled, problems
+
+def was_asked(question, assistant_content):
+    """True if `assistant_content` contains (the start of) the outline `question`."""
+    return question[:MATCH_CHARS].lower() in " ".join(assistant_content.split()).lower()
+
+def next_turn(messages, compiled_rules):
+    """(rule name, reply) if the next assistant turn is fixed by the outline, else None (ask the LLM)."""
+    if len(messages) < 2 or messages[-1].get("role") != "user" or messages[-2].get("role") != "assistant": return None
+    answer = messages[-1].get("content", ""); previous_question = messages[-2].get("content", "")
+    for rule in compiled_rules:
+        if not was_asked(rule["after"], previous_question): continue
+        if rule["reply_pattern"]:
+            if re.match(rule["reply_pattern"], answer.strip()): return rule["name"], rule["reply"]
+            continue
+        if len(answer.split()) < rule["min_words"]: continue # Brief answer: the LLM probes first
+        if any(keyword in answer.lower() for keyword in rule["probe_keywords"]): continue # Outline asks for a probe
+        if was_asked(rule["reply"], " ".join(m.get("content", "") for m in messages if m.get("role") == "assistant")): continue # Already asked
+        return rule["name"], rule["reply"]
+    return None
@@ -0,0 +1,99 @@
+# sinks.py (Survey result sinks, written concurrently by utils.save_survey_data)
+# A sink is a function write(submission) -> bool registered under a name; config.SURVEY_SINKS selects
+# which ones run. `submission` is a plain dict built on the script thread (sinks run in worker
+# threads and must not touch st.session_state):
+#   username, survey_responses, consent_given, ai_transcript, manual_answers, combined_transcript,
+#   submission_timestamp_unix, submission_time_utc, submission_key
+import csv
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+import config
+import eventlog
+
+_SINKS = {} # name -> {"write": fn, "timeout": seconds}
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="survey-sink")
+_file_lock = threading.Lock() # Appends to shared local files
+
+
+def register_sink(name, timeout=20.0):
+    """Decorator: registers write(submission) -> bool as sink `name` with a per-sink timeout in seconds."""
+    def decorator(write):
+        _SINKS[name] = {"write": write, "timeout": timeout}
+        return write
+    return decorator
+
+def registered_sinks():
+    return list(_SINKS)
+
+def _run_sink(name, write, submission):
+    started = time.perf_counter()
+    try: ok = bool(write(submission)); error = None
+    except Exception as e: ok = False; error = str(e)
+    return ok, error, time.perf_counter() - started
+
+def dispatch(submission, names=None):
+    """Runs the sinks concurrently; returns {name: {"ok", "seconds", "error"}} once all finished or timed out.
+
+    Total latency is that of the slowest sink (capped by its timeout). A sink that times out keeps
+    running in the background and is reported as failed. names=None runs config.SURVEY_SINKS; an empty
+    list runs none.
+    """
+    names = [name for name in (config.SURVEY_SINKS if names is None else names) if name in _SINKS]
+    started = time.perf_counter()
+    futures = {name: _executor.submit(_run_sink, name, _SINKS[name]["write"], submission) for name in names}
+    results = {}
+    for name, future in futures.items():
+        remaining = started + _SINKS[name]["timeout"] - time.perf_counter()
+        try:
+            ok, error, seconds = future.result(timeout=max(remaining, 0.0))
+            results[name] = {"ok": ok, "seconds": round(seconds, 3), "error": error}
+        except FutureTimeoutError:
+            results[name] = {"ok": False, "seconds": round(time.perf_counter() - started, 3), "error": f"timed out after {_SINKS[name]['timeout']}s"}
+    eventlog.info("sinks.finished", username=submission.get("username"), total_s=round(time.perf_counter() - started, 3),
+                  **{f"{name}_s": r["seconds"] for name, r in results.items()}, failed=[name for name, r in results.items() if not r["ok"]])
+    for name, r in results.items():
+        if r["error"]: eventlog.error("sinks.failed", username=submission.get("username"), sink=name, error=r["error"])
+    return results
+
+
+# --- Local File Sinks (enable via config.SURVEY_SINKS) ---
+def _flat_row(submission):
+    row = {key: submission.get(key) for key in ("username", "submission_time_utc", "submission_timestamp_unix", "consent_given", "submission_key")}
+    for key, value in (submission.get("survey_responses") or {}).items(): row[key] = value
+    row["ai_transcript"] = submission.get("ai_transcript"); row["manual_answers"] = submission.get("manual_answers")
+    return row
+
+@register_sink("json", timeout=5.0)
+def write_json(submission):
+    """One JSON file per participant in config.SURVEY_DIRECTORY."""
+    os.makedirs(config.SURVEY_DIRECTORY, exist_ok=True)
+    path = os.path.join(config.SURVEY_DIRECTORY, f"{submission['username']}_survey.json")
+    with open(path, "w", encoding="utf-8") as f: json.dump(submission, f, ensure_ascii=False, indent=4)
+    return True
+
+@register_sink("csv", timeout=5.0)
+def write_csv(submission):
+    """Appends a row to survey_results.csv (header taken from the first row written)."""
+    os.makedirs(config.SURVEY_DIRECTORY, exist_ok=True)
+    path = os.path.join(config.SURVEY_DIRECTORY, "survey_results.csv"); row = _flat_row(submission)
+    with _file_lock:
+        new_file = not os.path.exists(path)
+        with open(path, "a", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(row), extrasaction="ignore")
+            if new_file: writer.writeheader()
+            writer.writerow(row)
+    return True
+
+@register_sink("parquet", timeout=10.0)
+def write_parquet(submission):
+    """One part file per submission under survey_results/ (read with pandas.read_parquet on the folder)."""
+    import pandas as pd
+    out_dir = os.path.join(config.SURVEY_DIRECTORY, "survey_results"); os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, f"part-{submission['username']}-{int(submission['submission_timestamp_unix'])}.parquet")
+    pd.DataFrame([{k: (None if v is None else str(v)) for k, v in _flat_row(submission).items()}]).to_parquet(path + ".tmp", index=False)
+    os.replace(path + ".tmp", path)
+    return True
@@ -0,0 +1,78 @@
+# startup.py (Parallel startup checks and readiness state of the app process)
+# start() is called on every script run but runs once per process. A background thread builds and
+# probes all API clients concurrently (asyncio.gather over worker threads, each capped at
+# config.STARTUP_CHECK_TIMEOUT seconds), so a cold dyno pays for the slowest client instead of the sum
+# of all of them. It then hands over to clients.start() for token refresh and keep-alive probes.
+# readiness() reports "starting", then "ready" or "degraded" (some check failed or timed out).
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import clients
+import config
+import eventlog
+import llm_replay
+
+_lock = threading.Lock()
+_thread = None
+_readiness = {"status": "starting", "checks": {}, "started_unix": None, "startup_ms": None}
+
+
+# --- Checks ---
+def check_names():
+    """Clients this process needs (no OpenAI client when replaying recorded replies only)."""
+    return [name for name in clients.CLIENT_NAMES if not (name == "openai" and llm_replay.REPLAY_MODE == "replay")]
+
+async def _check(executor, name):
+    loop = asyncio.get_running_loop(); started = time.perf_counter()
+    try:
+        ok = await asyncio.wait_for(loop.run_in_executor(executor, clients.probe, name), timeout=config.STARTUP_CHECK_TIMEOUT)
+        error = None if ok else clients.client_health()[name]["error"]
+    except asyncio.TimeoutError: # The probe keeps running in its thread and still updates the client health
+        ok = False; error = f"timed out after {config.STARTUP_CHECK_TIMEOUT:g}s"
+    return name, {"ok": ok, "ms": round((time.perf_counter() - started) * 1000, 1), "error": error}
+
+async def _check_all(names):
+    # Own executor: asyncio.run() would otherwise wait for timed-out probes when shutting down the default one
+    executor = ThreadPoolExecutor(max_workers=len(names), thread_name_prefix="startup-check")
+    try: return dict(await asyncio.gather(*(_check(executor, name) for name in names)))
+    finally: executor.shutdown(wait=False)
+
+def run_checks():
+    """Builds and probes all clients concurrently; returns and stores the readiness state."""
+    started = time.perf_counter()
+    with _lock: _readiness["started_unix"] = time.time()
+    checks = asyncio.run(_check_all(check_names()))
+    failed = [name for name, check in checks.items() if not check["ok"]]
+    with _lock:
+        _readiness.update(status="degraded" if failed else "ready", checks=checks, startup_ms=round((time.perf_counter() - started) * 1000, 1))
+        state = _readiness_copy()
+    (eventlog.warning if failed else eventlog.info)("startup.finished", status=state["status"], startup_ms=state["startup_ms"],
+                                                    failed=failed, **{f"{name}_ms": check["ms"] for name, check in checks.items()})
+    return state
+
+
+# --- Readiness ---
+def _readiness_copy():
+    return {**_readiness, "checks": {name: dict(check) for name, check in _readiness["checks"].items()}}
+
+def readiness():
+    """{status: starting|ready|degraded, checks: {name: {ok, ms, error}}, started_unix, startup_ms}"""
+    with _lock: return _readiness_copy()
+
+
+def _run():
+    try: run_checks()
+    except Exception as e:
+        with _lock: _readiness["status"] = "degraded"
+        eventlog.error("startup.failed", error=str(e))
+    clients.start(readiness=readiness) # Token refresh, keep-alive probes and health publishing
+
+def start():
+    """Starts the startup checks once per process; returns immediately."""
+    global _thread
+    with _lock:
+        if _thread is not None: return
+        _thread = threading.Thread(target=_run, name="startup-checks", daemon=True)
+        _thread.start()
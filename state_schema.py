@@ -0,0 +1,58 @@
+# state_schema.py (Field layout of interviews/{user}: small indexed state vs. large cold blobs)
+# Usage: python state_schema.py   (regenerates firestore.indexes.json from the declarations below)
+import json
+import os
+
+# --- Hot State (interviews/{user}) ---
+# Small flags read on every session start and by dashboard/export queries.
+# Only INDEXED_FIELDS keep Firestore's automatic single-field indexes.
+HOT_FIELDS = {
+    "current_stage", "consent_given", "welcome_shown", "interview_active",
+    "interview_completed_flag", "survey_completed_flag", "manual_fallback_triggered",
+    "saved_to_gsheet_successfully", "start_time_unix", "timing_data", "message_storage", "survey_submission", "study_id", "study_version", "compaction_checkpoint", "last_updated",
+}
+INDEXED_FIELDS = {"current_stage", "study_id", "survey_completed_flag", "interview_completed_flag", "manual_fallback_triggered", "last_updated"}
+
+# --- Cold Blobs (interviews/{user}/blobs/state) ---
+# Transcripts and submitted answers: written a few times per interview, read only when resuming or exporting.
+COLD_FIELDS = {
+    "partial_ai_transcript_formatted", "manual_answers_formatted", "partial_assistant_reply",
+    "survey_data", "survey_backup_data",
+}
+BLOB_COLLECTION = "blobs"
+BLOB_DOCUMENT = "state"
+
+# Large fields in other collections (see utils' segmented message storage)
+EXTRA_EXEMPTIONS = [("message_segments", "entries"), ("message_segments", "payload"), ("message_segments", "raw_bytes"), ("messages", "content")]
+INDEXES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "firestore.indexes.json")
+
+
+def split_state(state_data):
+    """Splits a state update into (hot, cold) dicts; undeclared keys stay hot."""
+    hot = {}; cold = {}
+    for key, value in state_data.items():
+        (cold if key in COLD_FIELDS else hot)[key] = value
+    return hot, cold
+
+def blob_ref(doc_ref):
+    """interviews/{user}/blobs/state for the interviews/{user} document reference."""
+    return doc_ref.collection(BLOB_COLLECTION).document(BLOB_DOCUMENT)
+
+
+# --- Index Configuration ---
+def _exemption(collection_group, field_path):
+    return {"collectionGroup": collection_group, "fieldPath": field_path, "indexes": []}
+
+def index_overrides():
+    """firestore.indexes.json content: exempt every non-indexed hot field and all cold fields from indexing."""
+    overrides = [_exemption("interviews", field) for field in sorted(HOT_FIELDS - INDEXED_FIELDS)]
+    overrides += [_exemption("interviews", field) for field in sorted(COLD_FIELDS)] # Interviews written before the split
+    overrides += [_exemption(BLOB_COLLECTION, field) for field in sorted(COLD_FIELDS)]
+    overrides += [_exemption(group, field) for group, field in EXTRA_EXEMPTIONS]
+    return {"indexes": [], "fieldOverrides": overrides}
+
+
+if __name__ == "__main__":
+    with open(INDEXES_FILE, "w", encoding="utf-8") as f:
+        json.dump(index_overrides(), f, indent=2); f.write("\n")
+    print(f"INFO: Wrote {INDEXES_FILE}. Deploy with: firebase deploy --only firestore:indexes")
@@ -0,0 +1,261 @@
+# studies.py (Study registry: several interview studies served by one process, routed by ?study=<id>)
+# The default study is built from config.py. Every studies/*.json file adds one more study (a file
+# with id "default" overrides config.py); keys not given in a file fall back to config.py. Studies
+# are compiled (system prompt, outline questions, prompt token count) and validated once per version;
+# an invalid definition is logged and the previous version keeps serving.
+#
+# Hot reload: start_watcher() polls studies/*.json and listens to Firestore study_config/{id}
+# documents (same keys as the JSON files, overriding them). A changed definition is compiled into a
+# new version and swapped in atomically for new sessions; running sessions stay pinned to the version
+# they started with (interviews/{user}.study_version), which is kept in study_versions/ for restarts.
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+import streamlit as st
+
+import clients
+import config
+import eventlog
+import scripted_turns
+import sinks
+import token_counts
+
+STUDIES_DIR = os.environ.get("STUDIES_DIR", "studies")
+DEFAULT_STUDY_ID = "default"
+STUDY_ID_PATTERN = re.compile(r"^[a-z0-9][a-z0-9_-]{0,63}$")
+PART_KEYS = ["Intro", "I", "II", "III", "IV"]
+PART_KEY_SEQUENCE = ["Intro", "Framing", "PartI", "PartII", "PartIII", "PartIV", "Summary"]
+SUMMARY_QUESTION = "Based on our discussion (including any AI parts and your manual answers), could you briefly summarize your key perspectives on skills and AI's impact on them?"
+
+STUDY_RELOAD_INTERVAL = 10 # Seconds between checks of studies/*.json
+STUDY_CONFIG_COLLECTION = "study_config" # Live overrides, watched with a snapshot listener
+STUDY_VERSION_COLLECTION = "study_versions" # Every served version, so pinned sessions survive restarts
+VERSION_KEYS = ("interview_outline", "general_instructions", "codes", "closing_messages", "model", "temperature", "max_output_tokens", "context_window_tokens", "gsheet_name", "survey_sinks", "scripted_intro", "scripted_turns")
+
+_registry_lock = threading.Lock()
+_registry = None # study id -> latest compiled study dict (replaced as a whole on reload)
+_versions = {} # (study id, version) -> compiled study dict, for pinned sessions (None: not loadable, not retried)
+_remote_definitions = {} # study id -> definition from study_config/{id}
+_watcher_thread = None
+
+
+class StudyConfigError(ValueError):
+    """A study definition is incomplete or inconsistent."""
+
+
+# --- Definitions ---
+def default_definition():
+    """The study defined by config.py."""
+    return {
+        "id": DEFAULT_STUDY_ID, "title": "Skills & AI Interview",
+        "interview_outline": config.INTERVIEW_OUTLINE, "general_instructions": config.GENERAL_INSTRUCTIONS,
+        "codes": config.CODES, "closing_messages": dict(config.CLOSING_MESSAGES),
+        "model": config.MODEL, "temperature": config.TEMPERATURE,
+        "max_output_tokens": config.MAX_OUTPUT_TOKENS, "context_window_tokens": config.CONTEXT_WINDOW_TOKENS,
+        "gsheet_name": config.GSHEET_NAME, "survey_sinks": list(config.SURVEY_SINKS),
+        "scripted_intro": config.SCRIPTED_INTRO, "scripted_turns": list(config.SCRIPTED_TURNS),
+    }
+
+def load_definition(path):
+    """Reads a study JSON file; *_file keys (e.g. interview_outline_file) are read relative to it."""
+    with open(path, "r", encoding="utf-8") as f: definition = json.load(f)
+    for key in [k for k in definition if k.endswith("_file")]:
+        with open(os.path.join(os.path.dirname(path), definition.pop(key)), "r", encoding="utf-8") as f:
+            definition[key[:-len("_file")]] = f.read()
+    definition.setdefault("id", os.path.splitext(os.path.basename(path))[0])
+    return {**default_definition(), **definition}
+
+
+# --- Compilation ---
+def parse_outline_questions(outline):
+    """Verbatim outline questions per part (used by the manual fallback form)."""
+    questions = {}
+    intro_match = re.search(r"\*\*Begin the interview with:\*\*\s*'(.*?)'(?=[ \t]*(?:\n|$))", outline, re.DOTALL)
+    questions["Intro"] = [{"key": "intro_q", "text": intro_match.group(1).strip()}] if intro_match else []
+    framing_match = re.search(r"\*\*Ask Next \(Framing Q\):\*\*\s*'(.*?)'(?=[ \t]*(?:\n|$))", outline, re.DOTALL)
+    questions["Framing"] = [{"key": "framing_q", "text": framing_match.group(1).strip()}] if framing_match else []
+    for i, part_text in enumerate(outline.split("**Part ")[1:len(PART_KEYS)]):
+        part_key = f"Part{PART_KEYS[i+1]}"
+        ask_matches = re.findall(r"\*\*Ask\s*(?:\(.*?Q\))?\s*:\*\*\s*'(.*?)'(?=[ \t]*(?:\n|$))", part_text, re.DOTALL)
+        questions[part_key] = [{"key": f"{part_key}_q{q_idx+1}", "text": q_text.strip()} for q_idx, q_text in enumerate(ask_matches)]
+    questions["Summary"] = [{"key": "summary_prompt", "text": SUMMARY_QUESTION}]
+    return questions
+
+def validate_definition(definition):
+    """Raises StudyConfigError listing every problem found."""
+    problems = []
+    if not STUDY_ID_PATTERN.match(str(definition.get("id", ""))): problems.append(f"invalid id {definition.get('id')!r} (lowercase letters, digits, '-', '_')")
+    if not (definition.get("interview_outline") or "").strip(): problems.append("interview_outline is empty")
+    elif "**Begin the interview with:**" not in definition["interview_outline"]: problems.append("interview_outline has no '**Begin the interview with:**' question")
+    if "gpt" not in str(definition.get("model", "")).lower(): problems.append(f"model {definition.get('model')!r} is not an OpenAI chat model")
+    temperature = definition.get("temperature")
+    if temperature is not None and not (isinstance(temperature, (int, float)) and 0 <= temperature <= 2): problems.append("temperature must be between 0 and 2")
+    if not (isinstance(definition.get("max_output_tokens"), int) and 0 < definition["max_output_tokens"] < definition.get("context_window_tokens", 0)):
+        problems.append("max_output_tokens must be a positive integer below context_window_tokens")
+    if not definition.get("closing_messages"): problems.append("closing_messages is empty")
+    for code in definition.get("closing_messages") or {}:
+        if code not in definition.get("codes", "") and code not in definition.get("interview_outline", ""): problems.append(f"closing code {code!r} is never mentioned in codes or outline")
+    unknown_sinks = [name for name in definition.get("survey_sinks") or [] if name not in sinks.registered_sinks()]
+    if unknown_sinks: problems.append(f"unknown survey_sinks {unknown_sinks} (registered: {sinks.registered_sinks()})")
+    problems += scripted_turns.compile_rules(definition.get("interview_outline") or "", definition.get("scripted_turns"), definition.get("closing_messages") or {})[1]
+    if problems: raise StudyConfigError(f"Study {definition.get('id')!r}: " + "; ".join(problems))
+
+def compile_study(definition):
+    """Validated, ready-to-serve study: system prompt, outline questions and prompt token count precomputed."""
+    validate_definition(definition)
+    study = dict(definition)
+    study["system_prompt"] = f"""{definition['interview_outline']}
+
+{definition['general_instructions']}
+
+{definition['codes']}"""
+    study["manual_questions_map"] = parse_outline_questions(definition["interview_outline"])
+    study["outline_questions"] = scripted_turns.labelled_questions(definition["interview_outline"]) # {label: question}, see compaction.py
+    study["compiled_scripted_turns"] = scripted_turns.compile_rules(definition["interview_outline"], definition.get("scripted_turns"), definition["closing_messages"])[0]
+    study["system_prompt_tokens"] = token_counts.system_prompt_tokens(study["system_prompt"], study["model"])
+    study["prompt_hash"] = hashlib.sha256(study["system_prompt"].encode("utf-8")).hexdigest()[:12]
+    study["version"] = definition_version(definition)
+    return study
+
+def definition_version(definition):
+    """Content hash of everything that changes the interview (not the title)."""
+    payload = json.dumps({key: definition.get(key) for key in VERSION_KEYS}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:12]
+
+
+# --- Registry ---
+def _study_files(studies_dir):
+    if not os.path.isdir(studies_dir): return []
+    return sorted(os.path.join(studies_dir, name) for name in os.listdir(studies_dir) if name.endswith(".json"))
+
+def _definitions(studies_dir):
+    """Study id -> definition: config.py default, then studies/*.json, then Firestore study_config overrides."""
+    definitions = {DEFAULT_STUDY_ID: default_definition()}; seen_files = set()
+    for path in _study_files(studies_dir):
+        try: definition = load_definition(path)
+        except Exception as e: eventlog.error("studies.file_skipped", path=path, error=str(e)); continue
+        if definition["id"] in seen_files: eventlog.error("studies.file_skipped", path=path, error=f"duplicate study id {definition['id']!r}"); continue
+        seen_files.add(definition["id"]); definitions[definition["id"]] = definition
+    for study_id, remote in dict(_remote_definitions).items():
+        definitions[study_id] = {**definitions.get(study_id, default_definition()), **remote, "id": study_id}
+    return definitions
+
+def load_registry(studies_dir=None, previous=None):
+    """Compiles all definitions. Call after utils is imported (it registers the gsheet/firestore sinks).
+
+    A definition that fails validation keeps its version from `previous` (if any) instead of going offline.
+    """
+    registry = {}
+    for study_id, definition in _definitions(studies_dir or STUDIES_DIR).items():
+        try:
+            version = definition_version(definition)
+            registry[study_id] = _versions.get((study_id, version)) or compile_study(definition)
+        except Exception as e:
+            eventlog.error("studies.not_loaded", study_id=study_id, error=str(e))
+            if previous and study_id in previous: registry[study_id] = previous[study_id]
+    if DEFAULT_STUDY_ID not in registry: registry[DEFAULT_STUDY_ID] = compile_study(default_definition()) # config.py must always serve
+    eventlog.info("studies.registry_loaded", versions={study_id: study["version"] for study_id, study in registry.items()})
+    return registry
+
+def _swap_registry(new_registry):
+    """Publishes a new registry atomically; new versions are stored for pinned sessions."""
+    global _registry
+    for study_id, study in new_registry.items():
+        if (study_id, study["version"]) not in _versions:
+            _versions[(study_id, study["version"])] = study
+            threading.Thread(target=_store_version, args=(study,), name="study-version-store", daemon=True).start()
+    old_registry = _registry; _registry = new_registry
+    for study_id, study in new_registry.items():
+        old = (old_registry or {}).get(study_id)
+        if old is not None and old["version"] != study["version"]:
+            eventlog.info("studies.updated", study_id=study_id, from_version=old["version"], to_version=study["version"]) # New sessions only
+
+def get_registry():
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None: _swap_registry(load_registry())
+    return _registry
+
+def reload_registry(reason="manual"):
+    """Recompiles all studies and swaps them in for new sessions."""
+    with _registry_lock:
+        eventlog.info("studies.reloading", reason=reason)
+        _swap_registry(load_registry(previous=_registry))
+
+def resolve_study_id(requested):
+    """Study id for a ?study= value; unknown or missing ids fall back to the default study."""
+    if requested and requested in get_registry(): return requested
+    if requested: eventlog.warning("studies.unknown_study", requested=requested, using=DEFAULT_STUDY_ID)
+    return DEFAULT_STUDY_ID
+
+def get_study(study_id=None, version=None):
+    """Latest version of a study, or the pinned `version` if given (loaded from study_versions/ after a restart)."""
+    registry = get_registry()
+    study = registry.get(study_id or DEFAULT_STUDY_ID) or registry[DEFAULT_STUDY_ID]
+    if not version or version == study["version"]: return study
+    key = (study["id"], version)
+    pinned = _versions[key] if key in _versions else _load_version(*key)
+    return pinned or study
+
+def current_study():
+    """Study (at its pinned version) of the running session; re-pins the session if that version is unavailable."""
+    version = st.session_state.get("study_version"); study = get_study(st.session_state.get("study_id"), version)
+    if version and study["version"] != version:
+        eventlog.warning("studies.session_repinned", study_id=study["id"], from_version=version, to_version=study["version"])
+        st.session_state.study_version = study["version"]
+    return study
+
+
+# --- Version Store (Firestore) ---
+def _version_doc(study_id, version):
+    return clients.get_client("firestore").collection(STUDY_VERSION_COLLECTION).document(f"{study_id}__{version}")
+
+def _store_version(study):
+    try: _version_doc(study["id"], study["version"]).set({"definition": {key: study.get(key) for key in ("id", "title", *VERSION_KEYS)}, "stored_unix": time.time()})
+    except Exception as e: eventlog.warning("studies.version_store_failed", study_id=study["id"], version=study["version"], error=str(e))
+
+def _load_version(study_id, version):
+    with _registry_lock: # Lock only to look up / install: the Firestore read must not stall other sessions
+        if (study_id, version) in _versions: return _versions[(study_id, version)]
+    try:
+        snapshot = _version_doc(study_id, version).get()
+        if not snapshot.exists: raise LookupError("not stored")
+        study = compile_study({**default_definition(), **snapshot.to_dict()["definition"]})
+    except Exception as e:
+        eventlog.warning("studies.pinned_version_unavailable", study_id=study_id, version=version, error=str(e))
+        with _registry_lock: _versions.setdefault((study_id, version), None) # Remember the miss: no Firestore read per call
+        return None # Latest version is used
+    with _registry_lock: return _versions.setdefault((study_id, version), study) # A concurrent load may have installed it first
+
+
+# --- Watcher ---
+def _files_signature(studies_dir):
+    return tuple((path, os.path.getmtime(path)) for path in _study_files(studies_dir))
+
+def _on_config_snapshot(docs, changes, read_time):
+    _remote_definitions.clear()
+    for doc in docs: _remote_definitions[doc.id] = {k: v for k, v in (doc.to_dict() or {}).items() if k != "updated"}
+    if _registry is not None: reload_registry("study_config changed in Firestore")
+
+def _watch_loop(studies_dir):
+    try: clients.get_client("firestore").collection(STUDY_CONFIG_COLLECTION).on_snapshot(_on_config_snapshot)
+    except Exception as e: eventlog.warning("studies.watch_failed", collection=STUDY_CONFIG_COLLECTION, error=str(e))
+    signature = _files_signature(studies_dir)
+    while True:
+        time.sleep(STUDY_RELOAD_INTERVAL)
+        try:
+            new_signature = _files_signature(studies_dir)
+            if new_signature != signature: signature = new_signature; reload_registry("study files changed")
+        except Exception as e: eventlog.warning("studies.file_check_failed", error=str(e))
+
+def start_watcher(studies_dir=None):
+    """Starts the file poller and Firestore listener once per process."""
+    global _watcher_thread
+    with _registry_lock:
+        if _watcher_thread is not None: return
+        _watcher_thread = threading.Thread(target=_watch_loop, args=(studies_dir or STUDIES_DIR,), name="study-watcher", daemon=True)
+        _watcher_thread.start()
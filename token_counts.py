@@ -0,0 +1,46 @@
+# token_counts.py (Per-message token counts, computed once and stored alongside the message)
+import functools
+import math
+
+import config
+
+# Optional dependency: exact counts with tiktoken, otherwise a ~4 chars/token estimate
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+MESSAGE_OVERHEAD_TOKENS = 4 # Chat format overhead per message (role markers, separators)
+
+
+@functools.lru_cache(maxsize=4)
+def _encoding(model):
+    try: return tiktoken.encoding_for_model(model)
+    except KeyError: return tiktoken.get_encoding("o200k_base")
+
+def count_text_tokens(text, model=None):
+    """Tokens in `text` for `model` (config.MODEL by default)."""
+    if not text: return 0
+    if tiktoken is None: return math.ceil(len(text) / 4)
+    return len(_encoding(model or config.MODEL).encode(text, disallowed_special=()))
+
+@functools.lru_cache(maxsize=32) # A few prompts per study (see studies.py)
+def _prompt_tokens(prompt, model):
+    return count_text_tokens(prompt, model) + MESSAGE_OVERHEAD_TOKENS
+
+def system_prompt_tokens(prompt=None, model=None):
+    """Token count of the system prompt, computed once per process."""
+    return _prompt_tokens(prompt or config.SYSTEM_PROMPT, model or config.MODEL)
+
+def message_tokens(message):
+    """Cached count for a message dict; counts (and stores it under 'token_count') only if missing."""
+    count = message.get("token_count")
+    if count is None:
+        if message.get("role") == "system": count = system_prompt_tokens(message.get("content", ""))
+        else: count = count_text_tokens(message.get("content", "")) + MESSAGE_OVERHEAD_TOKENS
+        message["token_count"] = count
+    return count
+
+def api_messages(messages):
+    """Messages as sent to the LLM API (the API rejects extra keys such as token_count)."""
+    return [{"role": m["role"], "content": m["content"]} for m in messages]
@@ -1,14 +1,22 @@
 # utils.py (Heroku Secrets Version - CORRECTED Credential Handling)
 import streamlit as st
+import atexit
 import time
 import os
 import json
 import pandas as pd
-import gspread
-from google.oauth2.service_account import Credentials as ServiceAccountCredentials # Use explicit alias
+import clients
+import compaction
 import config
+import eventlog
+import sinks
+import state_schema
+import studies
+import token_counts
 import random
+import threading
 import uuid
+import zlib
 
 # --- Firestore Imports ---
 from google.cloud import firestore
@@ -16,97 +24,285 @@ from google.cloud import firestore
 # OR if default service account credentials on the platform (like Cloud Run, GAE) are available.
 # However, explicitly creating credentials gives more control.
 
-# --- HEROKU CHANGE: Function to get Google Credentials DICT from Env Var ---
-@st.cache_resource
-def get_google_creds_dict_from_env(env_var_name="GOOGLE_CREDENTIALS_JSON"):
-    """Gets the Google Credentials dictionary by parsing JSON from an environment variable."""
-    print(f"Attempting to read environment variable: {env_var_name}")
-    creds_json_str = os.environ.get(env_var_name)
-    if creds_json_str:
-        print(f"Found content in {env_var_name}. Attempting to parse JSON.")
-        try:
-            creds_dict = json.loads(creds_json_str)
-            print(f"Successfully parsed JSON credentials for project: {creds_dict.get('project_id')}")
-            return creds_dict
-        except json.JSONDecodeError as e:
-            st.error(f"CRITICAL: Failed to parse JSON from env var '{env_var_name}'. Error: {e}"); st.stop()
-            return None
-        except Exception as e:
-            st.error(f"CRITICAL: Unexpected error processing credentials from env var '{env_var_name}': {e}"); st.stop()
-            return None
-    else:
-        st.error(f"CRITICAL: Environment variable '{env_var_name}' not found."); st.stop()
-        return None
-
-# --- Firestore Client Initialization (Using Specific Creds) ---
-@st.cache_resource
+# --- Firestore / GSpread Clients (shared, pre-warmed and refreshed by clients.py) ---
 def get_firestore_client():
-    """Initializes and returns a Firestore client using credentials from Env Var."""
-    print("Attempting to get Firestore client...")
-    creds_dict = get_google_creds_dict_from_env()
-    if creds_dict:
-        try:
-            # Create Firestore-specific credentials from the dictionary
-            # Firestore typically doesn't require specific scopes if using service account key directly
-            creds_firestore = ServiceAccountCredentials.from_service_account_info(creds_dict)
-            db = firestore.Client(credentials=creds_firestore, project=creds_dict.get('project_id'))
-            print("INFO: Firestore client initialized successfully using environment variable.")
-            # Test connection
-            try:
-                 db.collection('_test_connection').limit(1).get()
-                 print("INFO: Firestore connection test successful.")
-            except Exception as conn_err:
-                 st.warning(f"Warning: Firestore connection test failed: {conn_err}")
-            return db
-        except Exception as e:
-            st.error(f"Error initializing Firestore client: {e}")
-            print(f"ERROR: Initializing Firestore client: {e}")
-            return None
-    else:
-        print("ERROR: Cannot initialize Firestore client, credentials dictionary is missing.")
+    """Returns the process-wide Firestore client using credentials from Env Var."""
+    try: return clients.get_client("firestore")
+    except Exception as e:
+        st.error(f"Error initializing Firestore client: {e}")
+        eventlog.error("client.init_failed", client="firestore", error=str(e))
         return None
 
-# --- GSpread Client Initialization (Using Specific Creds with Scopes) ---
-@st.cache_resource
 def get_gsheet_client():
-    """Authorizes and returns a gspread client instance using Env Var credentials."""
-    print("Attempting to get GSpread client...")
-    creds_dict = get_google_creds_dict_from_env()
-    if not creds_dict:
-        st.error("Cannot initialize GSpread client: Credentials dictionary not available.")
-        return None
-    try:
-        # Create GSheet-specific credentials with necessary scopes
-        scopes_gsheets = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
-        creds_gsheets = ServiceAccountCredentials.from_service_account_info(creds_dict, scopes=scopes_gsheets)
-        gc = gspread.authorize(creds_gsheets)
-        print("INFO: GSpread client authorized successfully.")
-        return gc
+    """Returns the process-wide gspread client using Env Var credentials."""
+    try: return clients.get_client("gsheet")
     except Exception as e:
         st.error(f"Failed to authorize GSpread client: {e}")
-        print(f"ERROR: Failed to authorize GSpread client: {e}")
+        eventlog.error("client.init_failed", client="gsheet", error=str(e))
         return None
 
 # --- Firestore Utility Functions (Unchanged - rely on get_firestore_client) ---
 def save_message_to_firestore(username, message_data):
     db = get_firestore_client()
     if not db: return False # Add check
-    # ... rest of function ...
+    if _message_storage_for_session(username) == "segments": return _append_message_to_segment(db, username, message_data)
     try:
         message_data_with_ts = message_data.copy(); message_data_with_ts['timestamp'] = firestore.SERVER_TIMESTAMP
         db.collection("interviews").document(username).collection("messages").add(message_data_with_ts)
         return True
-    except Exception as e: print(f"Error saving message: {e}"); return False
+    except Exception as e: eventlog.error("firestore.save_message_failed", error=str(e)); return False
+
+# --- Segmented Message Storage (config.MESSAGE_STORAGE_FORMAT = "segments") ---
+# Messages are appended to interviews/{user}/message_segments/{seq} documents holding up to
+# SEGMENT_MAX_MESSAGES messages / SEGMENT_MAX_BYTES of JSON. Each message is one zlib-compressed
+# item of the `entries` array, added with ArrayUnion: a save sends only the new message and returns
+# once Firestore acknowledged it, and loading 50 messages costs one read. Segments written before
+# `entries` existed hold all their messages in one compressed `payload` and are still read.
+# The interviews/{user} field `message_storage` records the format so readers pick the right one;
+# an interview keeps the format it started with.
+def _message_storage_for_session(username):
+    storage = st.session_state.get("message_storage")
+    if storage is None:
+        storage = st.session_state.message_storage = config.MESSAGE_STORAGE_FORMAT
+        save_interview_state_write_behind(username, {"message_storage": storage})
+    return storage
+
+def encode_segment(messages):
+    return zlib.compress(json.dumps(messages, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), 6)
+
+def decode_segment(payload):
+    return json.loads(zlib.decompress(payload).decode("utf-8"))
+
+def segment_messages(data):
+    """Messages of a segment document (legacy `payload` and/or appended `entries`)."""
+    messages = decode_segment(data["payload"]) if data.get("payload") else []
+    for entry in data.get("entries") or []: messages.extend(decode_segment(entry))
+    return messages
+
+def _load_open_segment(db, username):
+    """Last segment of the user (one read), so appends continue where the previous session stopped."""
+    segments_ref = db.collection("interviews").document(username).collection("message_segments")
+    for doc in segments_ref.order_by("seq", direction=firestore.Query.DESCENDING).limit(1).stream():
+        data = doc.to_dict()
+        return {"username": username, "seq": data["seq"], "messages": segment_messages(data), "raw_bytes": data.get("raw_bytes", 0)}
+    return {"username": username, "seq": 0, "messages": [], "raw_bytes": 0}
+
+def _append_message_to_segment(db, username, message_data):
+    try:
+        segment = st.session_state.get("open_segment")
+        if not segment or segment.get("username") != username: segment = _load_open_segment(db, username)
+        entry = {"role": message_data.get("role"), "content": message_data.get("content"), "ts": time.time()}
+        if "n" in message_data: entry["n"] = message_data["n"]
+        if "token_count" in message_data: entry["token_count"] = message_data["token_count"]
+        if message_data.get("scripted"): entry["scripted"] = True
+        entry_bytes = len(json.dumps(entry, ensure_ascii=False).encode("utf-8"))
+        if segment["messages"] and (len(segment["messages"]) >= config.SEGMENT_MAX_MESSAGES or segment["raw_bytes"] + entry_bytes > config.SEGMENT_MAX_BYTES):
+            segment = {"username": username, "seq": segment["seq"] + 1, "messages": [], "raw_bytes": 0}
+        first_n = segment["messages"][0].get("n") if segment["messages"] else entry.get("n")
+        segment_doc = {"seq": segment["seq"], "first_n": first_n, "count": firestore.Increment(1), "raw_bytes": firestore.Increment(entry_bytes),
+                       "entries": firestore.ArrayUnion([encode_segment([entry])]), "updated": firestore.SERVER_TIMESTAMP}
+        db.collection("interviews").document(username).collection("message_segments").document(f"{segment['seq']:05d}").set(segment_doc, merge=True)
+        segment["messages"].append(entry); segment["raw_bytes"] += entry_bytes # Only once Firestore acknowledged the append
+        st.session_state.open_segment = segment
+        return True
+    except Exception as e: eventlog.error("firestore.save_segment_failed", error=str(e)); return False
+
+def load_messages_from_firestore(db, username, message_storage=None):
+    """All messages of a user, in order, from segments or per-message documents."""
+    doc_ref = db.collection("interviews").document(username)
+    if message_storage == "segments":
+        messages = []
+        for doc in doc_ref.collection("message_segments").order_by("seq", direction=firestore.Query.ASCENDING).stream():
+            messages.extend(segment_messages(doc.to_dict()))
+        return messages
+    messages_ref = doc_ref.collection("messages").order_by("timestamp", direction=firestore.Query.ASCENDING)
+    return [doc.to_dict() for doc in messages_ref.stream()]
+
+def load_message_tail(db, username, message_storage, first_n):
+    """Messages numbered >= first_n (the tail after a compaction checkpoint), or None if they cannot be found."""
+    doc_ref = db.collection("interviews").document(username)
+    if message_storage == "segments":
+        messages = [] # Newest segments first, until the one holding first_n (usually one or two reads)
+        for doc in doc_ref.collection("message_segments").order_by("seq", direction=firestore.Query.DESCENDING).stream():
+            data = doc.to_dict(); messages[:0] = segment_messages(data)
+            if data.get("first_n") is None or data["first_n"] <= first_n: break
+        messages = [m for m in messages if m.get("n") is not None and m["n"] >= first_n]
+    else:
+        query = doc_ref.collection("messages").where(filter=firestore.FieldFilter("n", ">=", first_n)).order_by("n")
+        messages = [doc.to_dict() for doc in query.stream()]
+    if not messages or messages[0].get("n") != first_n: return None # Tail saved before message numbers existed
+    return messages
+
+def append_message(username, message_data):
+    """Appends a message to the session with its token count (counted once) and saves it to Firestore."""
+    token_counts.message_tokens(message_data) # Sets message_data["token_count"], stored with the message
+    message_data.setdefault("n", compaction.next_number(st.session_state.messages)) # Position, used to load the tail after a checkpoint
+    st.session_state.messages.append(message_data)
+    st.session_state.context_tokens = st.session_state.get("context_tokens", 0) + message_data["token_count"]
+    return save_message_to_firestore(username, message_data)
+
+def recount_context_tokens():
+    """Sets the running context size after (re)loading messages or a checkpoint; only uncounted messages are tokenized."""
+    context = compaction.context_messages(st.session_state.get("messages", []), st.session_state.get("compaction_checkpoint"))
+    st.session_state.context_tokens = sum(token_counts.message_tokens(m) for m in context)
+    return st.session_state.context_tokens
+
+def checkpoint_conversation(username, study):
+    """Stores a compaction checkpoint when one is due; the model context then restarts from it."""
+    previous = st.session_state.get("compaction_checkpoint")
+    if not compaction.due(st.session_state.messages, previous, st.session_state.get("context_tokens", 0), study["context_window_tokens"]): return False
+    checkpoint = compaction.build_checkpoint(st.session_state.messages, study, previous)
+    if not checkpoint: return False
+    tokens_before = st.session_state.get("context_tokens", 0)
+    st.session_state.compaction_checkpoint = checkpoint
+    save_interview_state_write_behind(username, {"compaction_checkpoint": checkpoint})
+    eventlog.info("compaction.checkpoint", through=checkpoint["through"], tokens_before=tokens_before, tokens_after=recount_context_tokens())
+    return True
+
+def transcript_messages(username):
+    """All messages for transcripts; a session resumed from a checkpoint loads the ones before its tail."""
+    messages = st.session_state.get("messages", [])
+    if not st.session_state.get("history_compacted"): return messages
+    db = get_firestore_client()
+    if not db: return messages
+    try:
+        loaded = load_messages_from_firestore(db, username, st.session_state.get("message_storage"))
+        compaction.number_messages(loaded)
+        first_n = min((m["n"] for m in messages if "n" in m), default=compaction.next_number(loaded))
+        earlier = [{"role": m["role"], "content": m["content"]} for m in loaded if m.get("n", first_n) < first_n and "role" in m]
+        return messages[:1] + earlier + messages[1:] if messages and messages[0].get("role") == "system" else earlier + messages
+    except Exception as e: eventlog.error("firestore.load_transcript_failed", error=str(e)); return messages
 
 def save_interview_state_to_firestore(username, state_data):
     db = get_firestore_client()
     if not db: return False # Add check
     # ... rest of function ...
     try:
-        state_data_with_ts = state_data.copy(); state_data_with_ts['last_updated'] = firestore.SERVER_TIMESTAMP
-        db.collection("interviews").document(username).set(state_data_with_ts, merge=True)
+        hot_data, cold_data = state_schema.split_state(state_data) # Large transcripts go to interviews/{user}/blobs/state
+        hot_data['last_updated'] = firestore.SERVER_TIMESTAMP
+        doc_ref = db.collection("interviews").document(username)
+        if "current_stage" in state_data:
+            # Stage changes also move the user between the per-stage counters (same transaction)
+            _save_state_and_move_stage(db.transaction(), db, doc_ref, hot_data, cold_data, state_data["current_stage"])
+        elif cold_data:
+            batch = db.batch(); batch.set(doc_ref, hot_data, merge=True); batch.set(state_schema.blob_ref(doc_ref), cold_data, merge=True); batch.commit()
+        else:
+            doc_ref.set(hot_data, merge=True)
         return True
-    except Exception as e: print(f"Error saving state: {e}"); return False
+    except Exception as e: eventlog.error("firestore.save_state_failed", username=username, error=str(e)); return False
+
+# --- Stage Counters (funnel / drop-off index maintained on write) ---
+# Counts live in STAGE_COUNTER_SHARDS documents stage_counters/shard_<n>, one numeric field per stage.
+# Each stage change increments the new stage and decrements the old one in a random shard,
+# so live monitoring costs STAGE_COUNTER_SHARDS reads instead of a scan of interviews/*.
+STAGE_COUNTER_COLLECTION = "stage_counters"
+STAGE_COUNTER_SHARDS = 10 # ~1 sustained write/s per document; raise for very large concurrent cohorts
+
+@firestore.transactional
+def _save_state_and_move_stage(transaction, db, doc_ref, hot_data, cold_data, new_stage):
+    snapshot = doc_ref.get(field_paths=["current_stage"], transaction=transaction)
+    old_stage = (snapshot.to_dict() or {}).get("current_stage") if snapshot.exists else None
+    transaction.set(doc_ref, hot_data, merge=True)
+    if cold_data: transaction.set(state_schema.blob_ref(doc_ref), cold_data, merge=True)
+    if old_stage == new_stage: return
+    counter_update = {new_stage: firestore.Increment(1)}
+    if old_stage: counter_update[old_stage] = firestore.Increment(-1)
+    shard_ref = db.collection(STAGE_COUNTER_COLLECTION).document(f"shard_{random.randrange(STAGE_COUNTER_SHARDS)}")
+    transaction.set(shard_ref, counter_update, merge=True)
+
+def get_stage_counts():
+    """Returns {stage: number of users currently in it} by summing the counter shards."""
+    db = get_firestore_client()
+    if not db: return {}
+    counts = {stage: 0 for stage in config.STAGES}
+    try:
+        shard_refs = [db.collection(STAGE_COUNTER_COLLECTION).document(f"shard_{n}") for n in range(STAGE_COUNTER_SHARDS)]
+        for shard in db.get_all(shard_refs):
+            for stage, value in (shard.to_dict() or {}).items(): counts[stage] = counts.get(stage, 0) + int(value or 0)
+        return counts
+    except Exception as e: eventlog.error("firestore.read_counters_failed", error=str(e)); return {}
+
+def rebuild_stage_counters():
+    """One-off backfill: recounts current_stage over interviews/* and resets the shards. Not for live traffic."""
+    db = get_firestore_client()
+    if not db: return {}
+    counts = {stage: 0 for stage in config.STAGES}
+    for doc in db.collection("interviews").select(["current_stage"]).stream():
+        stage = (doc.to_dict() or {}).get("current_stage")
+        if stage: counts[stage] = counts.get(stage, 0) + 1
+    batch = db.batch()
+    for n in range(STAGE_COUNTER_SHARDS):
+        batch.set(db.collection(STAGE_COUNTER_COLLECTION).document(f"shard_{n}"), counts if n == 0 else {stage: 0 for stage in counts})
+    batch.commit()
+    eventlog.info("stage_counters.rebuilt", counts=counts)
+    return counts
+
+# --- Write-Behind Store (non-blocking state writes) ---
+# Updates are merged per document in memory and flushed by one background thread every
+# config.WRITE_BEHIND_INTERVAL seconds, so frequent checkpoints cost neither render time
+# nor one Firestore write each. Use for data that may lag by a fraction of a second.
+# A failed write is re-queued (newer updates to the same fields win) and retried up to
+# config.WRITE_BEHIND_MAX_ATTEMPTS times; pending updates are flushed at interpreter exit,
+# which Streamlit reaches after a SIGTERM (dyno restart) once its server has stopped.
+_write_behind_lock = threading.Lock()
+_write_behind_pending = {} # (collection path, document id) -> merged data
+_write_behind_attempts = {} # (collection path, document id) -> failed flushes so far
+_write_behind_wakeup = threading.Event()
+_write_behind_thread = None
+
+def _queue_write_behind(collection_path, doc_id, data):
+    global _write_behind_thread
+    with _write_behind_lock:
+        _write_behind_pending.setdefault((collection_path, doc_id), {}).update(data)
+        if _write_behind_thread is None or not _write_behind_thread.is_alive():
+            if _write_behind_thread is None: atexit.register(_flush_at_exit)
+            _write_behind_thread = threading.Thread(target=_write_behind_worker, name="firestore-write-behind", daemon=True)
+            _write_behind_thread.start()
+    _write_behind_wakeup.set()
+
+def save_interview_state_write_behind(username, state_data):
+    """Queues a merge into interviews/{username}; returns immediately."""
+    _queue_write_behind("interviews", username, state_data)
+
+def flush_write_behind():
+    """Writes all queued updates now (blocking); returns False if some were re-queued or dropped."""
+    with _write_behind_lock:
+        batch = dict(_write_behind_pending); _write_behind_pending.clear()
+    all_ok = True
+    for (collection_path, doc_id), data in batch.items():
+        if collection_path == "interviews":
+            ok = save_interview_state_to_firestore(doc_id, data) # Keeps last_updated and stage counters
+        else:
+            try:
+                get_firestore_client().collection(collection_path).document(doc_id).set(data, merge=True); ok = True
+            except Exception as e: eventlog.error("write_behind.write_failed", document=f"{collection_path}/{doc_id}", error=str(e)); ok = False
+        with _write_behind_lock:
+            key = (collection_path, doc_id)
+            if ok: _write_behind_attempts.pop(key, None); continue
+            all_ok = False; attempts = _write_behind_attempts[key] = _write_behind_attempts.get(key, 0) + 1
+            if attempts < config.WRITE_BEHIND_MAX_ATTEMPTS:
+                _write_behind_pending[key] = {**data, **_write_behind_pending.get(key, {})}; _write_behind_wakeup.set()
+            else: _write_behind_attempts.pop(key, None)
+        if attempts < config.WRITE_BEHIND_MAX_ATTEMPTS: eventlog.warning("write_behind.requeued", document=f"{collection_path}/{doc_id}", attempts=attempts)
+        else: eventlog.error("write_behind.dropped", document=f"{collection_path}/{doc_id}", attempts=attempts, fields=sorted(data))
+    return all_ok
+
+def _flush_at_exit():
+    for _ in range(config.WRITE_BEHIND_MAX_ATTEMPTS): # Failed writes are re-queued; retry them before the process ends
+        if flush_write_behind() or not _write_behind_pending: return
+
+def _write_behind_worker():
+    while True:
+        _write_behind_wakeup.wait(); _write_behind_wakeup.clear()
+        time.sleep(config.WRITE_BEHIND_INTERVAL) # Coalesce bursts (e.g. streaming checkpoints) into one write
+        flush_write_behind()
+
+def checkpoint_partial_reply(username, content, turn):
+    """Stores the in-flight assistant reply so a fallback or later resume can continue from it."""
+    save_interview_state_write_behind(username, {"partial_assistant_reply": {"content": content, "turn": turn}})
+
+def clear_partial_reply_checkpoint(username):
+    save_interview_state_write_behind(username, {"partial_assistant_reply": firestore.DELETE_FIELD})
 
 def load_interview_state_from_firestore(username):
     db = get_firestore_client()
@@ -114,59 +310,126 @@ def load_interview_state_from_firestore(username):
     # ... rest of function ...
     loaded_state = {}; loaded_messages = []
     try:
-        state_doc_ref = db.collection("interviews").document(username); state_doc = state_doc_ref.get()
-        if state_doc.exists: loaded_state = state_doc.to_dict(); loaded_state.pop('last_updated', None)
-        else: print(f"No state found for {username}")
-        messages_ref = state_doc_ref.collection("messages").order_by("timestamp", direction=firestore.Query.ASCENDING); docs = messages_ref.stream()
-        for doc in docs:
-            msg = doc.to_dict(); msg.pop('timestamp', None)
-            if 'role' in msg and 'content' in msg: loaded_messages.append({'role': msg['role'], 'content': msg['content']})
-        print(f"Loaded {len(loaded_messages)} messages for {username}")
+        state_doc_ref = db.collection("interviews").document(username); blob_doc_ref = state_schema.blob_ref(state_doc_ref)
+        snapshots = {snap.reference.path: snap for snap in db.get_all([state_doc_ref, blob_doc_ref])} # Hot state and blobs in one round trip
+        state_doc = snapshots.get(state_doc_ref.path); blob_doc = snapshots.get(blob_doc_ref.path)
+        if state_doc is not None and state_doc.exists:
+            loaded_state = state_doc.to_dict(); loaded_state.pop('last_updated', None)
+            if blob_doc is not None and blob_doc.exists: loaded_state.update(blob_doc.to_dict()) # Interviews from before the split keep blobs inline
+        else: eventlog.info("firestore.no_state")
+        checkpoint = loaded_state.get("compaction_checkpoint"); stored_messages = None
+        if checkpoint: # Checkpoint + tail instead of the whole history
+            stored_messages = load_message_tail(db, username, loaded_state.get("message_storage"), checkpoint["through"])
+            loaded_state["history_compacted"] = stored_messages is not None
+        if stored_messages is None: stored_messages = load_messages_from_firestore(db, username, loaded_state.get("message_storage"))
+        for msg in stored_messages:
+            msg.pop('timestamp', None); msg.pop('ts', None)
+            if 'role' in msg and 'content' in msg:
+                loaded_msg = {'role': msg['role'], 'content': msg['content']}
+                for key in ('token_count', 'n'):
+                    if key in msg: loaded_msg[key] = msg[key]
+                loaded_messages.append(loaded_msg)
+        compaction.number_messages(loaded_messages) # Messages saved before numbering get their position
+        if loaded_messages and not loaded_state.get("message_storage"): loaded_state["message_storage"] = "documents" # Interview started before segments
+        eventlog.info("firestore.state_loaded", messages=len(loaded_messages), history_compacted=bool(loaded_state.get("history_compacted")))
         return loaded_state, loaded_messages
-    except Exception as e: print(f"Error loading state/messages: {e}"); return {}, []
+    except Exception as e: eventlog.error("firestore.load_state_failed", error=str(e)); return {}, []
 
 # --- GSpread Save Function (Uses get_gsheet_client) ---
-def save_survey_data_to_gsheet(username, survey_responses):
-    """Saves survey data to Google Sheets."""
-    st.session_state["gsheet_save_successful"] = False
+SHEET_CELL_CHARS = 40000 # Below the 50k characters Google Sheets allows per cell
+SHEET_TRANSCRIPT_COLUMNS = 5
+
+def split_transcript_for_sheet(transcript, chunk_size=SHEET_CELL_CHARS, columns=SHEET_TRANSCRIPT_COLUMNS):
+    """Transcript split into exactly `columns` cells of at most `chunk_size` characters (padded with "")."""
+    chunks = [transcript[i:i+chunk_size] for i in range(0, min(len(transcript), chunk_size * columns), chunk_size)]
+    return chunks + [""] * (columns - len(chunks))
+
+@sinks.register_sink("gsheet", timeout=30.0)
+def save_survey_data_to_gsheet(submission):
+    """Saves survey data to Google Sheets (runs in a sink worker thread)."""
     gc = get_gsheet_client() # Get authorized client
     if not gc: return False # Check if client init failed
     try:
-        sheet_name = "pilot_survey_results"
-        worksheet = gc.open(sheet_name).sheet1
-        # ... (rest of GSheet saving logic unchanged) ...
-        submission_time_utc = time.strftime("%Y-%m-%d %H:%M:%S UTC", time.gmtime())
-        consent_given = st.session_state.get("consent_given", "ERROR")
-        ai_transcript_formatted = st.session_state.get("current_formatted_transcript_for_gsheet", "ERROR")
-        manual_answers_formatted = st.session_state.get("manual_answers_formatted", "")
-        # Split transcript
-        CHUNK_SIZE=40000; MAX_TRANSCRIPT_COLUMNS=5
-        ai_transcript_chunks = [ai_transcript_formatted[i:i+CHUNK_SIZE] for i in range(0, len(ai_transcript_formatted), CHUNK_SIZE)]
-        ai_transcript_parts_for_sheet = ai_transcript_chunks[:MAX_TRANSCRIPT_COLUMNS] + [""] * (MAX_TRANSCRIPT_COLUMNS - len(ai_transcript_chunks))
+        sheet_name = submission.get("gsheet_name") or config.GSHEET_NAME
+        worksheet = clients.get_worksheet(sheet_name)
+        username = submission["username"]; survey_responses = submission["survey_responses"]
+        submission_time_utc = submission["submission_time_utc"]
+        consent_given = submission.get("consent_given", "ERROR")
+        ai_transcript_formatted = submission.get("ai_transcript", "ERROR")
+        manual_answers_formatted = submission.get("manual_answers", "")
+        ai_transcript_parts_for_sheet = split_transcript_for_sheet(ai_transcript_formatted)
         # Build row
         row_to_append = [ username, submission_time_utc, str(consent_given), survey_responses.get("age", ""), survey_responses.get("gender", ""), survey_responses.get("major", ""), survey_responses.get("year", ""), survey_responses.get("gpa", ""), survey_responses.get("ai_frequency", ""), survey_responses.get("ai_model", ""), *ai_transcript_parts_for_sheet, manual_answers_formatted ]
         time.sleep(random.uniform(0.1, 1.5))
         worksheet.append_row(row_to_append, value_input_option='USER_ENTERED')
-        st.session_state["gsheet_save_successful"] = True; return True
+        return True
     # ... (Keep existing GSheet error handling) ...
-    except Exception as e: print(f"Error saving survey data to GSheet: {e}"); st.error(f"GSheet Save Error: {e}"); return False
+    except Exception as e: eventlog.error("sink.gsheet_failed", username=submission.get("username"), error=str(e)); return False
+
+
+# --- Stage Transition Notices (replace time.sleep before st.rerun) ---
+# A confirmation is queued in session state and shown at the top of the next run, so the
+# script runner thread reruns immediately instead of idling while the message is visible.
+def queue_transition_notice(text, kind="success", balloons=False):
+    """Queues a toast/banner for the next run; records how long this run held the script thread so far."""
+    now = time.perf_counter()
+    st.session_state["pending_transition_notice"] = {"text": text, "kind": kind, "balloons": balloons, "queued_at": now,
+                                                     "run_ms": round((now - st.session_state.get("run_started", now)) * 1000)}
+
+def show_pending_transition_notice():
+    """Renders (once) the notice queued by the previous run and logs the measured transition times.
 
+    run_ms: script-thread time of the run that changed the stage (it used to sleep 1-3 s more before
+    rerunning); transition_ms: from queueing the notice until it is rendered on the new stage.
+    """
+    notice = st.session_state.pop("pending_transition_notice", None)
+    if not notice: return
+    icon = {"success": "✅", "warning": "⚠️", "info": "ℹ️"}.get(notice["kind"], None)
+    st.toast(notice["text"], icon=icon)
+    getattr(st, notice["kind"], st.info)(notice["text"]) # Persisted banner on the new stage
+    if notice["balloons"]: st.balloons()
+    eventlog.info("stage.transition_rendered", kind=notice["kind"], run_ms=notice["run_ms"], transition_ms=round((time.perf_counter() - notice["queued_at"]) * 1000))
 
 # --- Other Util Functions (Unchanged logic, ensure they call correct save/load functions) ---
+def detect_closing_code(text):
+    """Returns the closing code (key of the study's closing_messages) if the reply consists of exactly that code, else None."""
+    stripped = text.strip()
+    return stripped if stripped in studies.current_study()["closing_messages"] else None
+
 def format_transcript_for_gsheet(messages_to_format=None):
     # ... (Keep original logic) ...
     try:
         messages = messages_to_format if messages_to_format is not None else st.session_state.get("messages", [])
-        if messages: lines = []; # ... build lines ...
+        if messages:
+            lines = [] # ... build lines ...
+            closing_messages = studies.current_study()["closing_messages"]
+            closing_vals = list(closing_messages.values()); closing_keys = list(closing_messages.keys())
             for message in messages:
                 role = message.get('role', 'Unknown'); content = message.get('content', '')
                 if role == 'system': continue
-                closing_vals = list(config.CLOSING_MESSAGES.values()); closing_keys = list(config.CLOSING_MESSAGES.keys())
                 if content in closing_vals or content in closing_keys: continue
                 lines.append(f"{role.capitalize()}: {content}")
             return "\n---\n".join(lines)
         else: return "ERROR: No messages for formatting."
-    except Exception as e: print(f"Error formatting transcript: {e}"); return f"ERROR: {e}"
+    except Exception as e: eventlog.error("transcript.format_failed", error=str(e)); return f"ERROR: {e}"
+
+def find_last_ai_part_completed(messages, manual_questions_map, part_keys=studies.PART_KEYS):
+    """Index into part_keys of the last outline part the AI interview reached (-1: intro only / none)."""
+    last_completed_part_index = -1
+    for msg in reversed(messages):
+        if msg.get("role") == "assistant":
+            content = msg.get("content", "")
+            if manual_questions_map.get("Framing") and manual_questions_map["Framing"][0]["text"] in content: return 0
+            for idx, part_key in enumerate(part_keys[1:]):
+                part_index_in_list = idx + 1
+                if part_key in manual_questions_map:
+                    for question_data in manual_questions_map[part_key]:
+                         if question_data["text"][:50] in content[:70]:
+                             last_completed_part_index = max(last_completed_part_index, part_index_in_list); break
+            if last_completed_part_index > 0: break
+    if last_completed_part_index == -1 and manual_questions_map.get("Intro"):
+         if any(manual_questions_map["Intro"][0]["text"] in msg.get("content","") for msg in reversed(messages) if msg.get("role")=="assistant"): return -1
+    return last_completed_part_index
 
 def save_timing_to_state(username):
      # ... (Keep original logic using save_interview_state_to_firestore) ...
@@ -178,45 +441,146 @@ def save_timing_to_state(username):
              timing_data = { "start_time_unix": start_time_unix, "start_time_utc": start_time_utc_str, "end_time_unix": end_time_unix, "end_time_utc": end_time_utc_str, "duration_seconds": duration_seconds, "duration_minutes": round(duration_minutes, 2) }
              save_success = save_interview_state_to_firestore(username, {"timing_data": timing_data}) # Calls Firestore state save
              if save_success: st.session_state["timing_data"] = timing_data; return True
-             else: print(f"ERROR: Failed saving timing to Firestore"); return False
-        else: print("Warning: start_time_unix not found."); return False
-    except Exception as e: print(f"Error saving timing: {e}"); return False
+             else: eventlog.error("timing.save_failed"); return False
+        else: eventlog.warning("timing.no_start_time"); return False
+    except Exception as e: eventlog.error("timing.save_failed", error=str(e)); return False
+
+def read_state_fields(username, field_paths):
+    """Projected read of a few hot fields of interviews/{username} (no transcripts are downloaded)."""
+    db = get_firestore_client()
+    if not db or not username: return {}
+    snapshot = db.collection("interviews").document(username).get(field_paths=field_paths)
+    return (snapshot.to_dict() or {}) if snapshot.exists else {}
 
 def check_if_survey_completed(username):
      # ... (Keep original logic using get_firestore_client) ...
     db = get_firestore_client()
     if db and username:
-        try: state_doc_ref = db.collection("interviews").document(username); state_doc = state_doc_ref.get()
-            if state_doc.exists: state_data = state_doc.to_dict(); return state_data.get("survey_completed_flag", False) is True
-        except Exception as e: print(f"Error checking survey completion: {e}")
+        try:
+            flags = read_state_fields(username, ["survey_completed_flag"])
+            return flags.get("survey_completed_flag", False) is True
+        except Exception as e: eventlog.error("firestore.survey_check_failed", error=str(e))
     return False
 
-def save_survey_data(username, survey_responses):
-     # ... (Keep original logic calling save_survey_data_to_gsheet and backup/state functions) ...
-    consent_given = st.session_state.get("consent_given", False)
+def build_survey_submission(username, survey_responses, submission_key=None):
+    """Everything the sinks need, read from session state on the script thread."""
     ai_transcript = st.session_state.get("current_formatted_transcript_for_gsheet", "ERROR: AI transcript missing")
     manual_answers = st.session_state.get("manual_answers_formatted", "")
-    combined_transcript = f"AI Transcript:\n{ai_transcript}\n\nManual Answers:\n{manual_answers}".strip()
-    gsheet_success = save_survey_data_to_gsheet(username, survey_responses)
-    st.session_state.saved_to_gsheet_successfully = gsheet_success
-    firestore_save_attempted = save_survey_data_to_firestore_backup(username, survey_responses, consent_given, combined_transcript, gsheet_success)
-    if not firestore_save_attempted: st.warning("Failed to save survey data backup to Firestore.")
-    state_update_success = save_interview_state_to_firestore(username, {"survey_completed_flag": True, "current_stage": config.COMPLETED_STAGE })
-    if not state_update_success: print("ERROR: Failed to update final state flags in Firestore.")
+    submission_time_unix = time.time()
+    study = studies.current_study()
+    return {
+        "username": username, "survey_responses": survey_responses, "submission_key": submission_key,
+        "study_id": study["id"], "gsheet_name": study["gsheet_name"],
+        "consent_given": st.session_state.get("consent_given", False),
+        "ai_transcript": ai_transcript, "manual_answers": manual_answers,
+        "combined_transcript": f"AI Transcript:\n{ai_transcript}\n\nManual Answers:\n{manual_answers}".strip(),
+        "submission_timestamp_unix": submission_time_unix,
+        "submission_time_utc": time.strftime('%Y-%m-%d %H:%M:%S UTC', time.gmtime(submission_time_unix)),
+    }
+
+def save_survey_data(username, survey_responses):
+    """Writes the survey to the study's survey_sinks concurrently; returns the Google Sheets status for the UI."""
+    submission_key = survey_submission_key(username)
+    previous = claim_survey_submission(username, submission_key)
+    if previous is not None: return previous # Duplicate submit: nothing is written again
+    gsheet_success = False
+    try:
+        st.session_state["gsheet_save_successful"] = False
+        results = sinks.dispatch(build_survey_submission(username, survey_responses, submission_key), studies.current_study()["survey_sinks"])
+        gsheet_success = results.get("gsheet", {}).get("ok", False)
+        st.session_state.saved_to_gsheet_successfully = gsheet_success; st.session_state["gsheet_save_successful"] = gsheet_success
+        if not gsheet_success and "gsheet" in results: st.error(f"GSheet Save Error: {results['gsheet']['error'] or 'see logs'}")
+        if not results.get("firestore", {}).get("ok", False): st.warning("Failed to save survey data backup to Firestore.")
+        # Final status in the request thread: a retry (next key) must not find this claim still in progress
+        save_interview_state_to_firestore(username, {
+            "saved_to_gsheet_successfully": gsheet_success,
+            "survey_backup_data": {"saved_to_gsheet_successfully": gsheet_success},
+            "survey_submission": {"key": submission_key, "status": "done", "gsheet_success": gsheet_success, "finished_unix": time.time()},
+        })
+    finally:
+        finish_survey_submission(submission_key, gsheet_success)
     return gsheet_success # Return GSheet status for UI
 
-def save_survey_data_to_firestore_backup(username, survey_responses, consent_given, combined_transcript, gsheet_save_status):
-     # ... (Keep original logic using get_firestore_client) ...
+# --- Survey Submission Idempotency ---
+# Every submit carries the key "<username>#<attempt>"; the attempt number only advances after a
+# failed Google Sheets save, so double clicks and a second tab reuse the same key. A key is claimed
+# in a per-process index and in interviews/{user}.survey_submission (transaction) before anything is
+# written; repeated submits return the first result and are counted in submission_stats/totals.
+# A repeat of a submission that is still in flight (same key, other tab / dyno) returns True at once and
+# sets session_state.survey_save_pending, so the UI shows "already being saved" instead of an error.
+# The final status is written synchronously, so a retry after a failed Sheets save (next key) claims anew.
+SURVEY_CLAIM_TIMEOUT = 120 # Seconds after which an unfinished claim (crashed dyno) may be taken over
+SUBMISSION_STATS_DOC = ("submission_stats", "totals")
+
+_submission_lock = threading.Lock()
+_submission_index = {} # key -> {"status": "in_progress" | "done" | "failed", "gsheet_success": bool}
+_duplicates_suppressed = 0
+
+def survey_submission_key(username):
+    return f"{username}#{st.session_state.get('survey_attempt', 1)}"
+
+@firestore.transactional
+def _claim_submission_in_firestore(transaction, doc_ref, key):
+    snapshot = doc_ref.get(field_paths=["survey_submission"], transaction=transaction)
+    current = ((snapshot.to_dict() or {}).get("survey_submission") or {}) if snapshot.exists else {}
+    if current.get("status") == "done" and (current.get("key") == key or current.get("gsheet_success")): return current
+    if current.get("status") == "in_progress" and current.get("key") == key and time.time() - current.get("claimed_unix", 0) < SURVEY_CLAIM_TIMEOUT: return current
+    transaction.set(doc_ref, {"survey_submission": {"key": key, "status": "in_progress", "claimed_unix": time.time()}}, merge=True)
+    return None
+
+def claim_survey_submission(username, key):
+    """Returns None if this call may submit, else the earlier result (True/False) of the same submission."""
+    with _submission_lock:
+        entry = _submission_index.get(key)
+        if entry is None or entry["status"] == "failed":
+            entry = _submission_index[key] = {"status": "in_progress", "gsheet_success": False}; local_duplicate = False
+        else: local_duplicate = True
+    if local_duplicate: return _suppress_duplicate(username, key, entry)
     db = get_firestore_client()
-    if not db: return False
-    try: # ... build data_to_save dict ...
-        submission_time_unix = time.time()
-        data_to_save = { "username": username, "submission_timestamp_unix": submission_time_unix, "submission_time_utc": time.strftime('%Y-%m-%d %H:%M:%S UTC', time.gmtime(submission_time_unix)), "consent_given": consent_given, "survey_responses": survey_responses, "combined_transcript": combined_transcript, "saved_to_gsheet_successfully": gsheet_save_status, "last_updated": firestore.SERVER_TIMESTAMP }
-        survey_doc_ref = db.collection("interviews").document(username)
-        survey_doc_ref.set({"survey_backup_data": data_to_save}, merge=True)
-        print(f"INFO: Survey backup data saved to Firestore for user {username}")
-        return True
-    except Exception as e: print(f"Error saving survey backup: {e}"); return False
+    if not db: return None # Without Firestore only the local index can dedupe
+    try: current = _claim_submission_in_firestore(db.transaction(), db.collection("interviews").document(username), key)
+    except Exception as e: eventlog.warning("survey.claim_failed", username=username, key=key, error=str(e)); return None
+    if current is None: return None
+    with _submission_lock: _submission_index.pop(key, None) # Claimed elsewhere (another tab or dyno)
+    return _suppress_duplicate(username, key, {"status": current.get("status"), "gsheet_success": current.get("gsheet_success", False)})
+
+def finish_survey_submission(key, gsheet_success):
+    with _submission_lock:
+        _submission_index[key] = {"status": "done" if gsheet_success else "failed", "gsheet_success": gsheet_success}
+    if not gsheet_success: st.session_state.survey_attempt = st.session_state.get("survey_attempt", 1) + 1 # A retry is a new attempt
+
+def _suppress_duplicate(username, key, entry):
+    global _duplicates_suppressed
+    with _submission_lock: _duplicates_suppressed += 1; suppressed = _duplicates_suppressed
+    eventlog.info("survey.duplicate_suppressed", username=username, key=key, status=entry["status"], suppressed_in_process=suppressed)
+    db = get_firestore_client()
+    if db:
+        try: db.collection(SUBMISSION_STATS_DOC[0]).document(SUBMISSION_STATS_DOC[1]).set({"duplicates_suppressed": firestore.Increment(1)}, merge=True)
+        except Exception as e: eventlog.warning("survey.duplicate_count_failed", error=str(e))
+    if entry["status"] == "in_progress": # Never block the script thread waiting for the other submit
+        st.session_state.survey_save_pending = True; return True
+    return entry.get("gsheet_success", False) if entry["status"] == "done" else False
+
+def get_duplicate_submission_report():
+    """{"process": duplicates suppressed by this process, "total": across all dynos (Firestore)}."""
+    report = {"process": _duplicates_suppressed, "total": None}
+    db = get_firestore_client()
+    if db:
+        try:
+            snapshot = db.collection(SUBMISSION_STATS_DOC[0]).document(SUBMISSION_STATS_DOC[1]).get()
+            report["total"] = int((snapshot.to_dict() or {}).get("duplicates_suppressed", 0)) if snapshot.exists else 0
+        except Exception as e: eventlog.error("survey.stats_read_failed", error=str(e))
+    return report
+
+@sinks.register_sink("firestore", timeout=20.0)
+def save_survey_data_to_firestore_backup(submission):
+    """Backup copy plus the completion flags, in one Firestore transaction (runs in a sink worker thread)."""
+    keys = ("username", "submission_timestamp_unix", "submission_time_utc", "consent_given", "survey_responses", "combined_transcript")
+    data_to_save = {key: submission.get(key) for key in keys} # Merge write: saved_to_gsheet_successfully is owned by save_survey_data
+    if not save_interview_state_to_firestore(submission["username"], {"survey_backup_data": data_to_save, "survey_completed_flag": True, "current_stage": config.COMPLETED_STAGE}):
+        return False
+    eventlog.info("sink.firestore_saved", username=submission["username"])
+    return True
 
 # --- Function Renaming for Clarity ---
 # This function IS the one loading state from Firestore using env vars